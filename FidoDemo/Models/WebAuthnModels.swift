@@ -4,6 +4,7 @@ import Foundation
 
 struct RegistrationStartResponse: Codable {
     let challenge: String
+    let challenge_token: String  // Sealed challenge; send back unchanged with the finish request
     let options: RegistrationOptions
 }
 
@@ -45,6 +46,7 @@ struct RegistrationFinishResponse: Codable {
 
 struct LoginStartResponse: Codable {
     let challenge: String
+    let challenge_token: String  // Sealed challenge; send back unchanged with the finish request
     let options: LoginOptions
 }
 
@@ -116,7 +116,7 @@ class AuthenticationService {
 
     // MARK: - Complete Biometric Registration (Simplified)
     func completeBiometricRegistration(
-        challenge: String,
+        challengeToken: String,
         displayName: String
     ) async throws -> Bool {
         guard tokenManager.hasToken() else {
@@ -140,7 +140,7 @@ class AuthenticationService {
             "username": currentUser.username,
             "display_name": displayName,
             "credential": credentialData,
-            "challenge": challenge
+            "challenge_token": challengeToken
         ]
 
         request.httpBody = try JSONSerialization.data(withJSONObject: body)
@@ -183,7 +183,7 @@ class AuthenticationService {
 
     // MARK: - Complete Usernameless Login (Simplified)
     func completeUsernamelessLogin(
-        challenge: String
+        challengeToken: String
     ) async throws -> AuthResponse {
         let endpoint = "\(baseURL)/auth/login/usernameless/finish"
 
@@ -197,7 +197,7 @@ class AuthenticationService {
 
         let body: [String: Any] = [
             "assertion": assertionData,
-            "challenge": challenge
+            "challenge_token": challengeToken
         ]
 
         request.httpBody = try JSONSerialization.data(withJSONObject: body)
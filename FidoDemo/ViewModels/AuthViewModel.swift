@@ -74,7 +74,7 @@ class AuthViewModel: ObservableObject {
 
             // Complete registration
             _ = try await authService.completeBiometricRegistration(
-                challenge: startResponse.challenge,
+                challengeToken: startResponse.challenge_token,
                 displayName: displayName
             )
 
@@ -115,7 +115,7 @@ class AuthViewModel: ObservableObject {
 
             // Complete login
             let authResponse = try await authService.completeUsernamelessLogin(
-                challenge: startResponse.challenge
+                challengeToken: startResponse.challenge_token
             )
 
             isAuthenticated = true
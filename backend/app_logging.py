@@ -0,0 +1,188 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line) or "text" for reading logs in a terminal
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Records waiting for the writer thread; once full, new records are dropped (and counted) instead of blocking
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+# Per-event sample rates, e.g. "http.request=0.01,webauthn.login.failed=0.1"; events without a rate are always kept
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "http.request=0.01")
+
+REDACTED = "[REDACTED]"
+# Field names (compared case-insensitively, ignoring _ and -) whose values never reach the log
+SENSITIVE_KEYS = {
+    "password", "accesstoken", "refreshtoken", "idtoken", "token", "secret", "secrethash", "clientsecret",
+    "authorization", "session", "credential", "challengeresponses", "assertion", "authenticationresult",
+}
+# JWTs and other bearer tokens that end up inside free-text messages
+_TOKEN_PATTERN = re.compile(r"eyJ[\w-]+\.[\w-]+\.[\w-]*|(?i:bearer)\s+[\w.~+/=-]+")
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+
+def redact(value: Any, depth: int = 0) -> Any:
+    """Copy of a logged value with sensitive fields and embedded tokens masked"""
+    if depth > 6:
+        return "..."
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if _is_sensitive(key) else redact(item, depth + 1)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return [redact(item, depth + 1) for item in value]
+    if isinstance(value, str):
+        return _TOKEN_PATTERN.sub(REDACTED, value)
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return _TOKEN_PATTERN.sub(REDACTED, str(value))
+
+
+def _is_sensitive(key: Any) -> bool:
+    return str(key).lower().replace("_", "").replace("-", "") in SENSITIVE_KEYS
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        event, rate = item.split("=")
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+class ContextFilter(logging.Filter):
+    """Applies sampling, stamps the request id and redacts fields (in the caller's thread, before queueing)"""
+
+    def __init__(self, sample_rates: Dict[str, float]):
+        super().__init__()
+        self.sample_rates = sample_rates
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        event = getattr(record, "event", None)
+        rate = self.sample_rates.get(event) if event else None
+        if rate is not None and rate < 1.0:
+            if random.random() >= rate:
+                self.sampled_out += 1
+                return False
+            record.sample_rate = rate
+        record.request_id = request_id_var.get()
+        # Resolve %-args now: they may be mutated or hold secrets by the time the writer sees them
+        record.msg = _TOKEN_PATTERN.sub(REDACTED, record.getMessage())
+        record.args = None
+        for key, value in list(vars(record).items()):
+            if key not in _RESERVED_ATTRS:
+                setattr(record, key, REDACTED if _is_sensitive(key) else redact(value))
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks the caller and leaves formatting to the listener thread"""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The default formats the message and traceback here, on the request path
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = {k: v for k, v in vars(record).items() if k not in _RESERVED_ATTRS and k != "request_id"}
+        return f"{line} {json.dumps(fields, default=str)}" if fields else line
+
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue_handler: Optional[DroppingQueueHandler] = None
+_context_filter: Optional[ContextFilter] = None
+_lock = threading.Lock()
+
+
+def configure_logging():
+    """Route every logger (root) through a bounded queue to a background writer thread; idempotent"""
+    global _listener, _queue_handler, _context_filter
+    with _lock:
+        if _listener is not None:
+            return
+        writer = logging.StreamHandler(sys.stderr)
+        writer.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+        log_queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+        _queue_handler = DroppingQueueHandler(log_queue)
+        _context_filter = ContextFilter(parse_sample_rates(LOG_SAMPLE_RATES))
+        # Handler filters run in the caller's thread, where the request id context is still visible
+        _queue_handler.addFilter(_context_filter)
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(LOG_LEVEL)
+
+        _listener = logging.handlers.QueueListener(log_queue, writer, respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, exc_info=None, **fields):
+    """Structured record: `event` names what happened (and selects its sample rate); fields become JSON keys"""
+    if logger.isEnabledFor(level):
+        logger.log(level, event, exc_info=exc_info, extra={"event": event, **fields})
+
+
+def stats() -> dict:
+    return {
+        "queued": _queue_handler.queue.qsize() if _queue_handler is not None else 0,
+        "dropped": _queue_handler.dropped if _queue_handler is not None else 0,
+        "sampled_out": _context_filter.sampled_out if _context_filter is not None else 0,
+    }
@@ -0,0 +1,59 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Union
+
+from assertion_verifier import verify_assertion
+
+
+@dataclass
+class AssertionJob:
+    """One assertion of a batch, with everything needed to verify it (picklable for process pools)"""
+    index: int
+    credential_id: str
+    assertion: dict
+    challenge: bytes
+    public_key: bytes
+    sign_count: int
+
+
+@dataclass
+class AssertionOutcome:
+    index: int
+    credential_id: str
+    new_sign_count: Optional[int] = None
+    error: Optional[str] = None
+
+
+def split_jobs(jobs: List[AssertionJob], parts: int) -> List[List[AssertionJob]]:
+    """Spread jobs over at most `parts` chunks, keeping all jobs of one credential in the same chunk"""
+    by_credential: Dict[str, List[AssertionJob]] = {}
+    for job in jobs:
+        by_credential.setdefault(job.credential_id, []).append(job)
+
+    chunks: List[List[AssertionJob]] = [[] for _ in range(max(min(parts, len(by_credential)), 1))]
+    # Largest groups first, each into the currently smallest chunk
+    for group in sorted(by_credential.values(), key=len, reverse=True):
+        min(chunks, key=len).extend(group)
+    return [chunk for chunk in chunks if chunk]
+
+
+def verify_assertions(jobs: List[AssertionJob], rp_id: str, origins: Union[str, List[str]]) -> List[AssertionOutcome]:
+    """Verify a chunk of assertions in order; repeated credentials are checked against the count just verified"""
+    sign_counts: Dict[str, int] = {}
+    outcomes = []
+    for job in jobs:
+        try:
+            verification = verify_assertion(
+                credential=job.assertion,
+                expected_challenge=job.challenge,
+                expected_rp_id=rp_id,
+                expected_origin=origins,
+                credential_public_key=job.public_key,
+                credential_current_sign_count=sign_counts.get(job.credential_id, job.sign_count),
+            )
+        except Exception as e:
+            outcomes.append(AssertionOutcome(job.index, job.credential_id, error=str(e)))
+            continue
+        if verification.new_sign_count:
+            sign_counts[job.credential_id] = verification.new_sign_count
+        outcomes.append(AssertionOutcome(job.index, job.credential_id, new_sign_count=verification.new_sign_count))
+    return outcomes
@@ -0,0 +1,210 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, List, Union
+
+from cryptography.exceptions import InvalidSignature
+from webauthn.authentication.verify_authentication_response import VerifiedAuthentication
+from webauthn.helpers import (
+    bytes_to_base64url,
+    byteslike_to_bytes,
+    decode_credential_public_key,
+    decoded_public_key_to_cryptography,
+    parse_authentication_credential_json,
+    parse_authenticator_data,
+    parse_backup_flags,
+    parse_client_data_json,
+    verify_signature,
+)
+from webauthn.helpers.cose import COSEAlgorithmIdentifier
+from webauthn.helpers.exceptions import InvalidAuthenticationResponse
+from webauthn.helpers.structs import (
+    AuthenticationCredential,
+    ClientDataType,
+    PublicKeyCredentialType,
+    TokenBindingStatus,
+)
+
+# Parsed public keys kept per process (each worker of a process pool has its own cache)
+PUBLIC_KEY_CACHE_SIZE = int(os.getenv("PUBLIC_KEY_CACHE_SIZE", "10000"))
+
+# As in py_webauthn (kept here rather than importing its module-private list)
+EXPECTED_TOKEN_BINDING_STATUSES = [TokenBindingStatus.SUPPORTED, TokenBindingStatus.PRESENT]
+
+
+@dataclass(frozen=True)
+class ParsedPublicKey:
+    cose_key: bytes  # Stored COSE bytes the key was parsed from
+    alg: COSEAlgorithmIdentifier
+    key: Any  # cryptography public key object
+
+
+class PublicKeyCache:
+    """LRU of ready-to-verify public keys keyed by credential_id
+
+    An entry is only reused while the stored COSE bytes are unchanged, so a credential
+    re-registered under the same ID can never be verified against a stale key.
+    """
+
+    def __init__(self, max_entries: int = PUBLIC_KEY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, ParsedPublicKey]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, credential_id: str, cose_key: bytes) -> ParsedPublicKey:
+        with self._lock:
+            parsed = self._entries.get(credential_id)
+            if parsed is not None and parsed.cose_key == cose_key:
+                self._entries.move_to_end(credential_id)
+                self.hits += 1
+                return parsed
+            self.misses += 1
+
+        # Parse outside the lock; a concurrent miss for the same key just parses twice
+        decoded = decode_credential_public_key(cose_key)
+        parsed = ParsedPublicKey(cose_key, decoded.alg, decoded_public_key_to_cryptography(decoded))
+        with self._lock:
+            self._entries[credential_id] = parsed
+            self._entries.move_to_end(credential_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return parsed
+
+    def invalidate(self, credential_id: str):
+        with self._lock:
+            self._entries.pop(credential_id, None)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+public_key_cache = PublicKeyCache()
+
+
+@lru_cache(maxsize=16)
+def _rp_id_hash(rp_id: str) -> bytes:
+    return hashlib.sha256(rp_id.encode("utf-8")).digest()
+
+
+def verify_assertion(
+    *,
+    credential: Union[str, Dict[str, Any], AuthenticationCredential],
+    expected_challenge: bytes,
+    expected_rp_id: str,
+    expected_origin: Union[str, List[str]],
+    credential_public_key: bytes,
+    credential_current_sign_count: int,
+    require_user_verification: bool = False,
+) -> VerifiedAuthentication:
+    """Drop-in for webauthn.verify_authentication_response that verifies with a cached parsed key
+
+    The checks and error messages follow py_webauthn 3.0 (pinned in requirements.txt; the parity
+    tests compare both on valid and tampered assertions); only the COSE decoding and key
+    construction are skipped for credentials already in public_key_cache.
+    """
+    if isinstance(credential, (str, dict)):
+        credential = parse_authentication_credential_json(credential)
+
+    if bytes_to_base64url(credential.raw_id) != credential.id:
+        raise InvalidAuthenticationResponse("id and raw_id were not equivalent")
+
+    if credential.type != PublicKeyCredentialType.PUBLIC_KEY:
+        raise InvalidAuthenticationResponse(
+            f'Unexpected credential type "{credential.type}", expected "public-key"'
+        )
+
+    response = credential.response
+    client_data_bytes = byteslike_to_bytes(response.client_data_json)
+    authenticator_data_bytes = byteslike_to_bytes(response.authenticator_data)
+    signature_bytes = byteslike_to_bytes(response.signature)
+
+    try:
+        client_data = parse_client_data_json(client_data_bytes)
+    except Exception as exc:
+        raise InvalidAuthenticationResponse("clientDataJSON was malformed. See __cause__ for more info") from exc
+
+    if client_data.type != ClientDataType.WEBAUTHN_GET:
+        raise InvalidAuthenticationResponse(
+            f'Unexpected client data type "{client_data.type}", expected "{ClientDataType.WEBAUTHN_GET}"'
+        )
+
+    if expected_challenge != client_data.challenge:
+        raise InvalidAuthenticationResponse("Client data challenge was not expected challenge")
+
+    if isinstance(expected_origin, str):
+        if expected_origin != client_data.origin:
+            raise InvalidAuthenticationResponse(
+                f'Unexpected client data origin "{client_data.origin}", expected "{expected_origin}"'
+            )
+    elif client_data.origin not in expected_origin:
+        raise InvalidAuthenticationResponse(
+            f'Unexpected client data origin "{client_data.origin}", expected one of {expected_origin}'
+        )
+
+    if client_data.token_binding:
+        status = client_data.token_binding.status
+        if status not in EXPECTED_TOKEN_BINDING_STATUSES:
+            raise InvalidAuthenticationResponse(
+                f'Unexpected token_binding status of "{status}", expected one of "{",".join(EXPECTED_TOKEN_BINDING_STATUSES)}"'
+            )
+
+    try:
+        auth_data = parse_authenticator_data(authenticator_data_bytes)
+    except Exception as exc:
+        raise InvalidAuthenticationResponse("authenticatorData was malformed. See __cause__ for more info") from exc
+
+    if auth_data.rp_id_hash != _rp_id_hash(expected_rp_id):
+        raise InvalidAuthenticationResponse("Unexpected RP ID hash")
+
+    if not auth_data.flags.up:
+        raise InvalidAuthenticationResponse("User was not present during authentication")
+
+    if require_user_verification and not auth_data.flags.uv:
+        raise InvalidAuthenticationResponse(
+            "User verification is required but user was not verified during authentication"
+        )
+
+    # A sign count that did not increase may be a replayed or cloned authenticator
+    if (auth_data.sign_count > 0 or credential_current_sign_count > 0) and auth_data.sign_count <= credential_current_sign_count:
+        raise InvalidAuthenticationResponse(
+            f"Response sign count of {auth_data.sign_count} was not greater than current count of {credential_current_sign_count}"
+        )
+
+    signature_base = authenticator_data_bytes + hashlib.sha256(client_data_bytes).digest()
+
+    try:
+        public_key = public_key_cache.get(credential.id, credential_public_key)
+        verify_signature(
+            public_key=public_key.key,
+            signature_alg=public_key.alg,
+            signature=signature_bytes,
+            data=signature_base,
+        )
+    except InvalidSignature:
+        raise InvalidAuthenticationResponse("Could not verify authentication signature")
+
+    backup_flags = parse_backup_flags(auth_data.flags)
+    return VerifiedAuthentication(
+        credential_id=credential.raw_id,
+        new_sign_count=auth_data.sign_count,
+        credential_device_type=backup_flags.credential_device_type,
+        credential_backed_up=backup_flags.credential_backed_up,
+        user_verified=auth_data.flags.uv,
+    )
@@ -0,0 +1,87 @@
+"""Per-assertion CPU cost of WebAuthn verification with and without the parsed public key cache.
+
+Signs assertions with software ES256 authenticators (loadtest/soft_authenticator.py) for a few
+hot credentials, then verifies the same assertions three ways on one thread:
+
+    library   webauthn.verify_authentication_response (CBOR-decodes and rebuilds the key every call)
+    cold      assertion_verifier.verify_assertion with the key cache cleared before every call
+    cached    assertion_verifier.verify_assertion with the keys already parsed
+
+Usage (from backend/):
+    python -m benchmarks.cose_key_cache --credentials 10 --assertions 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "loadtest"))
+
+from webauthn import verify_authentication_response
+from webauthn.helpers import bytes_to_base64url
+
+from assertion_verifier import PublicKeyCache, verify_assertion
+import assertion_verifier
+from soft_authenticator import SoftAuthenticator
+
+RP_ID = "localhost"
+ORIGIN = "http://localhost:3000"
+
+
+def build_assertions(credentials: int, assertions: int):
+    authenticators = [SoftAuthenticator(RP_ID, ORIGIN) for _ in range(credentials)]
+    public_keys = {a.credential_id_b64: a.cose_public_key() for a in authenticators}
+    challenge = os.urandom(32)
+    options = {"challenge": bytes_to_base64url(challenge)}
+    signed = [authenticators[i % credentials].get(options) for i in range(assertions)]
+    return signed, public_keys, challenge
+
+
+def run(name, verify, signed, public_keys, challenge, before_each=None):
+    """Verify every assertion; returns CPU microseconds per assertion"""
+    started = time.process_time()
+    for assertion in signed:
+        if before_each is not None:
+            before_each()
+        verify(
+            credential=assertion,
+            expected_challenge=challenge,
+            expected_rp_id=RP_ID,
+            expected_origin=ORIGIN,
+            credential_public_key=public_keys[assertion["id"]],
+            credential_current_sign_count=0,
+        )
+    per_assertion = (time.process_time() - started) / len(signed) * 1_000_000
+    print(f"{name:<8} {per_assertion:8.1f} us/assertion  ({1_000_000 / per_assertion:8.0f} verifications/s per core)")
+    return per_assertion
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--credentials", type=int, default=10, help="distinct hot credentials")
+    parser.add_argument("--assertions", type=int, default=5000)
+    args = parser.parse_args()
+
+    signed, public_keys, challenge = build_assertions(args.credentials, args.assertions)
+    print(f"{args.assertions} ES256 assertions over {args.credentials} credentials")
+
+    # Warm up imports and OpenSSL before measuring
+    run("warmup", verify_authentication_response, signed[:200], public_keys, challenge)
+    print()
+
+    library = run("library", verify_authentication_response, signed, public_keys, challenge)
+    cold = run("cold", verify_assertion, signed, public_keys, challenge,
+               before_each=lambda: setattr(assertion_verifier, "public_key_cache", PublicKeyCache()))
+    assertion_verifier.public_key_cache = PublicKeyCache()
+    cached = run("cached", verify_assertion, signed, public_keys, challenge)
+
+    stats = assertion_verifier.public_key_cache.stats()
+    print()
+    print(f"key cache: {stats['hits']} hits, {stats['misses']} misses")
+    print(f"saved vs library: {library - cached:.1f} us/assertion ({(library - cached) / library:.0%})")
+    print(f"saved vs cold:    {cold - cached:.1f} us/assertion ({(cold - cached) / cold:.0%})")
+
+
+if __name__ == "__main__":
+    main()
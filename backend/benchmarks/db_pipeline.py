@@ -0,0 +1,103 @@
+"""Side-by-side benchmark of the sync (threadpool) and async (aiosqlite) database paths.
+
+Replays the login-finish lookup (passkey joined with its user) against a throwaway SQLite
+database, once through sync Sessions on a 40-thread pool (Starlette's default threadpool size)
+and once through AsyncSessions on the event loop.
+
+Usage (from backend/):
+    python -m benchmarks.db_pipeline --users 2000 --requests 5000 --concurrency 64
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def report(name, latencies, elapsed):
+    print(
+        f"{name:<6} {len(latencies) / elapsed:>10.1f} req/s"
+        f"  p50 {percentile(latencies, 50) * 1000:7.2f} ms"
+        f"  p95 {percentile(latencies, 95) * 1000:7.2f} ms"
+        f"  p99 {percentile(latencies, 99) * 1000:7.2f} ms"
+        f"  mean {statistics.mean(latencies) * 1000:7.2f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--threads", type=int, default=40)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="fido-bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ.setdefault("DB_POOL_SIZE", str(args.concurrency))
+
+    from sqlalchemy import select
+    from database import AsyncSessionLocal, Base, Passkey, SessionLocal, User, async_engine, engine
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    for i in range(args.users):
+        user = User(username=f"user{i}", password_hash="x", display_name=f"User {i}")
+        user.passkeys.append(Passkey(credential_id=f"cred{i}", public_key="pk", sign_count=0))
+        db.add(user)
+    db.commit()
+    db.close()
+
+    credential_ids = [f"cred{i % args.users}" for i in range(args.requests)]
+    query = lambda cid: select(Passkey, User).join(User, Passkey.user_id == User.id).where(Passkey.credential_id == cid)
+
+    def lookup_sync(cid):
+        started = time.perf_counter()
+        session = SessionLocal()
+        try:
+            session.execute(query(cid)).first()
+        finally:
+            session.close()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        sync_latencies = list(pool.map(lookup_sync, credential_ids))
+    report("sync", sync_latencies, time.perf_counter() - started)
+
+    async def run_async():
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def lookup_async(cid):
+            async with semaphore:
+                started = time.perf_counter()
+                async with AsyncSessionLocal() as session:
+                    (await session.execute(query(cid))).first()
+                return time.perf_counter() - started
+
+        started = time.perf_counter()
+        latencies = await asyncio.gather(*(lookup_async(cid) for cid in credential_ids))
+        elapsed = time.perf_counter() - started
+        await async_engine.dispose()
+        return latencies, elapsed
+
+    async_latencies, elapsed = asyncio.run(run_async())
+    report("async", async_latencies, elapsed)
+
+    engine.dispose()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Time from process start until a backend replica answers /health, per feature profile.
+
+Starts `uvicorn main:app` in a fresh interpreter for every run and polls /health until it
+returns 200, so the figure covers interpreter start, imports, app construction and the startup
+hook (database bootstrap). Each profile is measured against a fresh database (first replica)
+and an already initialized one (every replica after that):
+
+    minimal   Cognito, QR registration and the demo seed user all off
+    default   QR registration and demo seed on; Cognito off (no user pool configured)
+    full      everything on, including the Cognito routes and boto3 client
+
+Usage (from backend/):
+    python -m benchmarks.startup_time --runs 5
+"""
+import argparse
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROFILES = {
+    "minimal": {"COGNITO_ENABLED": "false", "QR_REGISTRATION_ENABLED": "false", "SEED_DEMO_USER": "false"},
+    "default": {"COGNITO_ENABLED": "auto", "QR_REGISTRATION_ENABLED": "true", "SEED_DEMO_USER": "true"},
+    "full": {
+        "COGNITO_ENABLED": "true", "QR_REGISTRATION_ENABLED": "true", "SEED_DEMO_USER": "true",
+        "COGNITO_REGION": "us-east-1", "COGNITO_USER_POOL_ID": "us-east-1_bench", "COGNITO_CLIENT_ID": "bench",
+        "AWS_ACCESS_KEY_ID": "bench", "AWS_SECRET_ACCESS_KEY": "bench",
+    },
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_ready(workdir: str, profile: dict, timeout: float) -> float:
+    """Seconds from spawning a replica until its /health answers 200"""
+    port = free_port()
+    env = {
+        **os.environ,
+        **profile,
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'fido.db')}",
+        "SESSION_STORE_URL": "memory://",
+        "JWT_KEYS_DIR": os.path.join(workdir, "keys"),
+        "COGNITO_JWKS_CACHE_FILE": os.path.join(workdir, "cognito-jwks.json"),
+        "LOG_LEVEL": "WARNING",
+    }
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"replica exited: {process.stderr.read().decode(errors='replace')[-2000:]}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            time.sleep(0.005)
+        raise RuntimeError(f"replica not ready after {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def report(name, database, samples):
+    print(
+        f"{name:<8} {database:<9}"
+        f"  median {statistics.median(samples) * 1000:7.0f} ms"
+        f"  min {min(samples) * 1000:7.0f} ms"
+        f"  max {max(samples) * 1000:7.0f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--profile", action="append", choices=sorted(PROFILES), help="default: all")
+    args = parser.parse_args()
+
+    for name in args.profile or list(PROFILES):
+        profile = PROFILES[name]
+        fresh = []
+        for _ in range(args.runs):
+            workdir = tempfile.mkdtemp(prefix="fido-startup-")
+            try:
+                fresh.append(time_to_ready(workdir, profile, args.timeout))
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+        report(name, "fresh", fresh)
+
+        workdir = tempfile.mkdtemp(prefix="fido-startup-")
+        try:
+            time_to_ready(workdir, profile, args.timeout)  # initializes the database and keys
+            report(name, "existing", [time_to_ready(workdir, profile, args.timeout) for _ in range(args.runs)])
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
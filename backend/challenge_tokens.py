@@ -0,0 +1,231 @@
+import base64
+import contextlib
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional
+
+from session_store import SESSION_STORE_URL, SessionStore, SessionStoreFull, create_session_store
+
+# Comma-separated secrets shared by every replica: the first seals new tokens, all of them open
+# tokens (list the old one second while rotating). Defaults to a key derived from SECRET_KEY.
+CHALLENGE_TOKEN_SECRETS = os.getenv("CHALLENGE_TOKEN_SECRETS", "")
+# Spent tokens (those of ceremonies that succeeded) are remembered until they expire, so none is accepted
+# twice: per worker, and in the session store as well when SESSION_STORE_URL is shared. Entries are never
+# evicted early; when either is full of unexpired tokens, finish requests fail with 503 until some expire.
+# Defaults to room for CHALLENGE_REPLAY_RATE successful ceremonies per second over the token lifetime.
+CHALLENGE_REPLAY_CACHE_SIZE = int(os.getenv("CHALLENGE_REPLAY_CACHE_SIZE", "0")) or None
+CHALLENGE_REPLAY_RATE = float(os.getenv("CHALLENGE_REPLAY_RATE", "500"))
+
+# When the replay cache is full, a full scan for expired entries runs at most this often
+CHALLENGE_REPLAY_SWEEP_SECONDS = 1.0
+CHALLENGE_TOKEN_MAX_LENGTH = 1024
+_KEY_DERIVATION_LABEL = b"fido-demo webauthn challenge token v1"
+
+
+class InvalidChallengeToken(Exception):
+    def __init__(self, message: str, reason: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+class ReplayCacheFull(Exception):
+    """No room to remember another spent token without forgetting one that could still be replayed"""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def derive_secret(secret: str) -> bytes:
+    """Challenge-token key derived from another secret, so the two never share key material"""
+    return hmac.new(secret.encode("utf-8"), _KEY_DERIVATION_LABEL, hashlib.sha256).digest()
+
+
+class ChallengeTokens:
+    """Seals WebAuthn challenges into tokens that the client hands back with the finish request
+
+    A token is base64url(payload) "." base64url(HMAC-SHA256(payload)), where the payload holds
+    the challenge, the ceremony, the user it was issued for and its expiry. Any replica holding
+    the secret can check a finish request, so no challenge is stored anywhere; the only state is
+    the record of spent tokens (per worker, plus replay_store when workers share one).
+
+    open() only checks a token. A finish request spends it with spend() once the ceremony has
+    succeeded, so requests carrying a junk assertion never take up room in the replay record.
+    """
+
+    def __init__(self, secrets: List[bytes], ttl: float, replay_cache_size: Optional[int] = CHALLENGE_REPLAY_CACHE_SIZE,
+                 replay_store: Optional[SessionStore] = None):
+        if not secrets:
+            raise ValueError("At least one challenge token secret is required")
+        self.secrets = secrets
+        self.ttl = ttl
+        self.replay_cache_size = replay_cache_size or replay_cache_size_for(ttl)
+        self.replay_store = replay_store
+        self._used: "OrderedDict[str, int]" = OrderedDict()  # token digest -> exp
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+        self.issued = 0
+        self.accepted = 0
+        self.rejected: dict = {}
+
+    def issue(self, challenge: bytes, ceremony: str, username: Optional[str] = None) -> str:
+        payload = {"c": _b64encode(challenge), "t": ceremony, "u": username, "exp": int(time.time() + self.ttl)}
+        body = _b64encode(json.dumps(payload, separators=(",", ":")).encode("utf-8"))
+        with self._lock:
+            self.issued += 1
+        return f"{body}.{self._sign(self.secrets[0], body)}"
+
+    def open(self, token: str, ceremony: str, username: Optional[str] = None) -> bytes:
+        """Challenge sealed in the token; raises InvalidChallengeToken unless it is genuine, unexpired,
+        not yet spent (on this worker) and was issued for this ceremony (and user, when given)"""
+        try:
+            payload = self._open(token)
+            if payload.get("t") != ceremony or (username is not None and payload.get("u") != username):
+                raise InvalidChallengeToken("Challenge issued for another ceremony or user", "mismatch")
+            with self._lock:
+                if self._used.get(self._digest(token), 0) > time.time():
+                    raise InvalidChallengeToken("Challenge already used", "replayed")
+        except InvalidChallengeToken as e:
+            self._count_rejection(e.reason)
+            raise
+        return _b64decode(payload["c"])
+
+    def spend(self, token: str):
+        """Use up an opened token; raises InvalidChallengeToken if it was spent before (here, or anywhere
+        sharing replay_store) or has expired since, ReplayCacheFull when its use cannot be recorded"""
+        with self._spending(token) as (key, ttl):
+            if self.replay_store is not None and not self.replay_store.add(key, True, ttl=ttl):
+                raise InvalidChallengeToken("Challenge already used", "replayed")
+
+    async def aspend(self, token: str):
+        """spend() for request handlers: a shared replay_store is written off the event loop"""
+        with self._spending(token) as (key, ttl):
+            if self.replay_store is not None and not await self.replay_store.aadd(key, True, ttl=ttl):
+                raise InvalidChallengeToken("Challenge already used", "replayed")
+
+    @contextlib.contextmanager
+    def _spending(self, token: str):
+        """Checks and bookkeeping around spending a token; the body records it in replay_store (atomic
+        across workers: exactly one of two concurrent spends of a token gets in) under the given key/ttl"""
+        try:
+            payload = self._open(token)
+            digest = self._digest(token)
+            now = time.time()
+            self._check_unspent(digest, now)
+            try:
+                yield digest.hex(), max(payload["exp"] - now, 1)
+            except SessionStoreFull as e:
+                raise ReplayCacheFull(str(e))
+            # Remembered until the token's own expiry
+            with self._lock:
+                if self._used.get(digest, 0) > now:
+                    raise InvalidChallengeToken("Challenge already used", "replayed")
+                self._used[digest] = payload["exp"]
+        except InvalidChallengeToken as e:
+            self._count_rejection(e.reason)
+            raise
+        except ReplayCacheFull:
+            self._count_rejection("replay_cache_full")
+            raise
+        with self._lock:
+            self.accepted += 1
+
+    def _open(self, token: str) -> dict:
+        payload = self._verify(token)
+        if payload["exp"] <= time.time():
+            raise InvalidChallengeToken("Challenge expired", "expired")
+        return payload
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode("ascii")).digest()
+
+    def _verify(self, token: str) -> dict:
+        body, _, signature = token.partition(".")
+        if not body or not signature or len(token) > CHALLENGE_TOKEN_MAX_LENGTH or not token.isascii():
+            raise InvalidChallengeToken("Malformed challenge token", "malformed")
+        if not any(hmac.compare_digest(signature, self._sign(secret, body)) for secret in self.secrets):
+            raise InvalidChallengeToken("Invalid challenge token", "signature")
+        try:
+            payload = json.loads(_b64decode(body))
+            if not isinstance(payload.get("c"), str) or not isinstance(payload.get("exp"), int):
+                raise ValueError("missing fields")
+        except (ValueError, AttributeError):
+            raise InvalidChallengeToken("Malformed challenge token", "malformed")
+        return payload
+
+    def _check_unspent(self, digest: bytes, now: float):
+        """Raise unless the token is unspent here and there is room to remember it"""
+        with self._lock:
+            if self._used.get(digest, 0) > now:
+                raise InvalidChallengeToken("Challenge already used", "replayed")
+            if len(self._used) >= self.replay_cache_size:
+                self._purge_expired_locked(now)
+                if len(self._used) >= self.replay_cache_size:
+                    raise ReplayCacheFull(f"{len(self._used)} unexpired challenge tokens in use")
+
+    def _purge_expired_locked(self, now: float):
+        # Entries go in roughly in expiry order (every token lives for the same ttl), so expired ones
+        # usually sit at the front; the full scan catches the rest
+        while self._used and next(iter(self._used.values())) <= now:
+            self._used.popitem(last=False)
+        if len(self._used) >= self.replay_cache_size and now >= self._next_sweep:
+            self._next_sweep = now + CHALLENGE_REPLAY_SWEEP_SECONDS
+            for digest in [d for d, expires_at in self._used.items() if expires_at <= now]:
+                del self._used[digest]
+
+    def _count_rejection(self, reason: str):
+        with self._lock:
+            self.rejected[reason] = self.rejected.get(reason, 0) + 1
+
+    @staticmethod
+    def _sign(secret: bytes, body: str) -> str:
+        return _b64encode(hmac.digest(secret, body.encode("ascii"), "sha256"))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._used)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "ttl_seconds": self.ttl,
+                "secrets": len(self.secrets),
+                "issued": self.issued,
+                "accepted": self.accepted,
+                "rejected": dict(self.rejected),
+                "replay_cache": len(self._used),
+                "replay_cache_size": self.replay_cache_size,
+                "shared_replay_store": len(self.replay_store) if self.replay_store is not None else None,
+            }
+
+    def close(self):
+        if self.replay_store is not None:
+            self.replay_store.close()
+
+
+def replay_cache_size_for(ttl: float) -> int:
+    """Entries needed to remember CHALLENGE_REPLAY_RATE spent tokens per second for their whole lifetime"""
+    return max(int(ttl * CHALLENGE_REPLAY_RATE), 1)
+
+
+def create_challenge_tokens(fallback_secret: str, ttl: float) -> ChallengeTokens:
+    """Token sealer keyed by CHALLENGE_TOKEN_SECRETS, or by a key derived from fallback_secret
+
+    With a shared SESSION_STORE_URL, spent tokens are recorded there too, so a token used on one
+    worker cannot be replayed on another.
+    """
+    secrets = [s.strip() for s in CHALLENGE_TOKEN_SECRETS.split(",") if s.strip()]
+    replay_store = None
+    if not SESSION_STORE_URL.startswith("memory://"):
+        replay_store = create_session_store("used_challenges", ttl, CHALLENGE_REPLAY_CACHE_SIZE or replay_cache_size_for(ttl))
+    return ChallengeTokens([derive_secret(s) for s in secrets or [fallback_secret]], ttl, replay_store=replay_store)
@@ -0,0 +1,278 @@
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import (
+    ClientError,
+    ConnectionClosedError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    HTTPClientError,
+    ReadTimeoutError,
+)
+from botocore.exceptions import ConnectionError as BotocoreConnectionError
+
+import metrics
+from app_logging import log_event
+from cognito_tokens import COGNITO_ENDPOINT_URL, COGNITO_REGION
+
+logger = logging.getLogger(__name__)
+
+COGNITO_MAX_POOL_CONNECTIONS = int(os.getenv("COGNITO_MAX_POOL_CONNECTIONS", "20"))
+COGNITO_CONNECT_TIMEOUT_SECONDS = float(os.getenv("COGNITO_CONNECT_TIMEOUT_SECONDS", "2"))
+COGNITO_READ_TIMEOUT_SECONDS = float(os.getenv("COGNITO_READ_TIMEOUT_SECONDS", "5"))
+# Attempts per call, including the first; waits are full-jitter exponential backoff
+COGNITO_MAX_ATTEMPTS = int(os.getenv("COGNITO_MAX_ATTEMPTS", "3"))
+COGNITO_RETRY_BASE_SECONDS = float(os.getenv("COGNITO_RETRY_BASE_SECONDS", "0.1"))
+COGNITO_RETRY_MAX_SECONDS = float(os.getenv("COGNITO_RETRY_MAX_SECONDS", "2"))
+# Cognito calls run on their own threads so a slow AWS cannot starve the passkey endpoints
+COGNITO_WORKERS = int(os.getenv("COGNITO_WORKERS", "8"))
+COGNITO_MAX_QUEUE = int(os.getenv("COGNITO_MAX_QUEUE", "32"))
+# Consecutive failures that open the circuit, and how long it stays open before a trial call
+COGNITO_BREAKER_FAILURES = int(os.getenv("COGNITO_BREAKER_FAILURES", "5"))
+COGNITO_BREAKER_RESET_SECONDS = float(os.getenv("COGNITO_BREAKER_RESET_SECONDS", "30"))
+
+# The request never reached Cognito, or Cognito asked us to back off: safe to retry any call
+_CONNECT_ERRORS = (ConnectTimeoutError, EndpointConnectionError)
+_THROTTLING_CODES = {"TooManyRequestsException", "ThrottlingException", "LimitExceededException"}
+# The request may have been processed: only retried for calls that are safe to repeat
+_AMBIGUOUS_ERRORS = (ReadTimeoutError, ConnectionClosedError)
+_SERVER_ERROR_CODES = {"InternalErrorException", "ServiceUnavailable", "InternalFailure"}
+# Any other transport failure (SSLError, ProxyConnectionError, ...): counted against Cognito, never retried
+_TRANSPORT_ERRORS = (BotocoreConnectionError, HTTPClientError)
+# Repeating these just starts a new challenge/session
+IDEMPOTENT_OPERATIONS = {"initiate_auth", "start_web_authn_registration"}
+
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CognitoUnavailable(Exception):
+    """Cognito is failing, the circuit is open or the gateway is saturated; the caller should fail fast"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CognitoSaturated(CognitoUnavailable):
+    """This replica has too many Cognito calls in flight; says nothing about Cognito's health"""
+
+
+class CircuitBreaker:
+    """Opens after N consecutive failures; after the reset timeout lets a single trial call through"""
+
+    def __init__(self, failure_threshold: int = COGNITO_BREAKER_FAILURES, reset_timeout: float = COGNITO_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self.opened = 0
+        self.rejected = 0
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state_locked()
+
+    def _state_locked(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        """Raise CognitoUnavailable unless a call may go out now"""
+        with self._lock:
+            state = self._state_locked()
+            if state == "closed":
+                return
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+            self.rejected += 1
+            retry_after = self.reset_timeout - (time.monotonic() - self._opened_at) if state == "open" else 1.0
+        raise CognitoUnavailable("Cognito circuit open", retry_after=max(retry_after, 1.0))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or (self._opened_at is None and self._failures >= self.failure_threshold):
+                self.opened += 1
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def release_trial(self):
+        """The trial call was abandoned (e.g. client disconnected) without an outcome"""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+def _is_server_error(error: ClientError) -> bool:
+    code = error.response.get("Error", {}).get("Code", "")
+    status = error.response.get("ResponseMetadata", {}).get("HTTPStatusCode", 0)
+    return code in _SERVER_ERROR_CODES or status >= 500
+
+
+def _is_throttled(error: ClientError) -> bool:
+    return error.response.get("Error", {}).get("Code", "") in _THROTTLING_CODES
+
+
+class CognitoGateway:
+    """Cognito client with its own connection pool, executor, timeouts, retries and circuit breaker
+
+    Only transport failures, timeouts and 5xx responses trip the circuit breaker. Throttling is
+    retried with backoff but leaves the breaker alone (it is Cognito pacing us, not failing), and a
+    full local queue raises CognitoSaturated without reaching Cognito or the breaker. A ClientError
+    such as NotAuthorizedException is a normal answer and is raised to the caller untouched, as is
+    anything else (e.g. ParamValidationError for a bad argument), which also gives back a half-open
+    trial slot without recording an outcome.
+    """
+
+    def __init__(self, client, workers: int = COGNITO_WORKERS, max_queue: int = COGNITO_MAX_QUEUE,
+                 max_attempts: int = COGNITO_MAX_ATTEMPTS, breaker: Optional[CircuitBreaker] = None):
+        self.client = client
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_attempts = max_attempts
+        self.breaker = breaker or CircuitBreaker()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cognito")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.saturated = 0
+
+    async def call(self, operation: str, **kwargs):
+        """Run client.<operation>(**kwargs) off the event loop, retrying transient failures"""
+        method = getattr(self.client, operation)
+        attempt = 0
+        while True:
+            attempt += 1
+            self.breaker.before_call()
+            try:
+                result = await self._submit(method, kwargs)
+            except asyncio.CancelledError:
+                self.breaker.release_trial()
+                raise
+            except CognitoSaturated:
+                # Nothing was sent, so there is no outcome to record against Cognito
+                self.breaker.release_trial()
+                raise
+            except ClientError as e:
+                if _is_throttled(e):
+                    self.breaker.release_trial()
+                elif _is_server_error(e):
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                    raise
+                retryable = _is_throttled(e) or operation in IDEMPOTENT_OPERATIONS
+                if not retryable or attempt >= self.max_attempts:
+                    self._count_failure()
+                    raise CognitoUnavailable(f"Cognito error: {e.response.get('Error', {}).get('Code', 'unknown')}") from e
+            except _CONNECT_ERRORS as e:
+                self.breaker.record_failure()
+                if attempt >= self.max_attempts:
+                    self._count_failure()
+                    raise CognitoUnavailable(f"Cognito unreachable: {e}")
+            except _AMBIGUOUS_ERRORS as e:
+                self.breaker.record_failure()
+                if operation not in IDEMPOTENT_OPERATIONS or attempt >= self.max_attempts:
+                    self._count_failure()
+                    raise CognitoUnavailable(f"Cognito did not answer: {e}")
+            except _TRANSPORT_ERRORS as e:
+                self.breaker.record_failure()
+                self._count_failure()
+                raise CognitoUnavailable(f"Cognito unreachable: {e}")
+            except Exception:
+                # Says nothing about Cognito's health, but must not hold the half-open trial forever
+                self.breaker.release_trial()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+            with self._lock:
+                self.retries += 1
+            # Full jitter: spreads retries from many workers instead of synchronizing them
+            await asyncio.sleep(random.uniform(0, min(COGNITO_RETRY_MAX_SECONDS, COGNITO_RETRY_BASE_SECONDS * 2 ** (attempt - 1))))
+
+    async def _submit(self, method, kwargs):
+        with self._lock:
+            if self.in_flight >= self.workers + self.max_queue:
+                self.saturated += 1
+                raise CognitoSaturated(f"Cognito gateway saturated ({self.in_flight} calls in flight)")
+            self.in_flight += 1
+            self.calls += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, lambda: method(**kwargs))
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    def _count_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "breaker": self.breaker.state,
+                "breaker_opened": self.breaker.opened,
+                "breaker_rejected": self.breaker.rejected,
+                "workers": self.workers,
+                "in_flight": self.in_flight,
+                "calls": self.calls,
+                "retries": self.retries,
+                "failures": self.failures,
+                "saturated": self.saturated,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False)
+
+
+def create_cognito_client(access_key_id: Optional[str] = None, secret_access_key: Optional[str] = None):
+    """boto3 client sized to the gateway, with explicit timeouts and botocore's own retries turned off"""
+    config = Config(
+        region_name=COGNITO_REGION,
+        max_pool_connections=COGNITO_MAX_POOL_CONNECTIONS,
+        connect_timeout=COGNITO_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=COGNITO_READ_TIMEOUT_SECONDS,
+        retries={"total_max_attempts": 1, "mode": "standard"},
+    )
+    kwargs = {"config": config, "endpoint_url": COGNITO_ENDPOINT_URL}
+    if access_key_id and secret_access_key:
+        kwargs.update(aws_access_key_id=access_key_id, aws_secret_access_key=secret_access_key)
+    # Otherwise role-based authentication or the default profile
+    client = boto3.client("cognito-idp", **kwargs)
+    metrics.instrument_boto3_client(client)
+    return client
+
+
+def create_cognito_gateway(access_key_id: Optional[str] = None, secret_access_key: Optional[str] = None) -> Optional[CognitoGateway]:
+    try:
+        gateway = CognitoGateway(create_cognito_client(access_key_id, secret_access_key))
+    except Exception as e:
+        log_event(logger, "cognito.client_unavailable", logging.WARNING, error=str(e))
+        return None
+    metrics.COGNITO_BREAKER_STATE.set_function(lambda: BREAKER_STATES[gateway.breaker.state])
+    metrics.COGNITO_IN_FLIGHT.set_function(lambda: gateway.in_flight)
+    return gateway
@@ -0,0 +1,345 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+import os
+from typing import Awaitable, Callable, Optional
+
+import jwt
+from botocore.exceptions import ClientError
+from fastapi import APIRouter, FastAPI, HTTPException, Request
+from jwt.exceptions import InvalidTokenError
+from pydantic import BaseModel
+
+from app_logging import log_event
+from cognito_gateway import CognitoUnavailable, create_cognito_gateway
+from cognito_tokens import COGNITO_CLIENT_ID, CognitoTokenVerifier
+
+logger = logging.getLogger(__name__)
+
+# Cognito Configuration
+COGNITO_CLIENT_SECRET = os.getenv("COGNITO_CLIENT_SECRET")
+AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
+AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
+
+router = APIRouter(prefix="/auth/cognito")
+
+
+async def _no_rate_limit(route: str, http_request: Request, username: Optional[str] = None):
+    return None
+
+
+# Set by include_routes: pooled client with timeouts, retries and a circuit breaker (None if it cannot
+# be created), the app's rate limit check and its Cognito token verifier
+cognito_gateway = None
+check_rate_limit: Callable[..., Awaitable[None]] = _no_rate_limit
+cognito_verifier: Optional[CognitoTokenVerifier] = None
+
+
+def include_routes(app: FastAPI, rate_limit: Callable[..., Awaitable[None]], token_verifier: Optional[CognitoTokenVerifier]):
+    """Create the Cognito client and mount the /auth/cognito routes on the app"""
+    global cognito_gateway, check_rate_limit, cognito_verifier
+    cognito_gateway = create_cognito_gateway(AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY)
+    check_rate_limit = rate_limit
+    cognito_verifier = token_verifier
+    app.include_router(router)
+
+
+def stats() -> Optional[dict]:
+    return cognito_gateway.stats() if cognito_gateway is not None else None
+
+
+def shutdown():
+    if cognito_gateway is not None:
+        cognito_gateway.shutdown()
+
+
+def cognito_unavailable(e: CognitoUnavailable) -> HTTPException:
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
+
+
+async def check_cognito_token(token: str):
+    """Reject expired or forged Cognito access tokens locally instead of spending an AWS call on them"""
+    if cognito_verifier is None:
+        return
+    try:
+        if cognito_verifier.fetch_due(token):
+            await asyncio.to_thread(cognito_verifier.decode, token)
+        else:
+            cognito_verifier.decode(token)
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Cognito token expired")
+    except InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid Cognito token")
+
+
+def get_secret_hash(username, client_id, client_secret):
+    msg = username + client_id
+    dig = hmac.new(str(client_secret).encode('utf-8'), 
+                   msg = str(msg).encode('utf-8'), digestmod=hashlib.sha256).digest()
+    d2 = base64.b64encode(dig).decode()
+    return d2
+
+
+class CognitoLoginRequest(BaseModel):
+    username: str
+    password: str
+
+
+class CognitoRegisterStartRequest(BaseModel):
+    access_token: str
+
+
+class CognitoRegisterFinishRequest(BaseModel):
+    access_token: str
+    credential: dict
+
+
+class CognitoLoginStartRequest(BaseModel):
+    username: str
+
+
+class CognitoLoginFinishRequest(BaseModel):
+    username: str
+    challenge_responses: dict
+    session: str
+
+
+@router.post("/login-password")
+async def cognito_password_login(request: CognitoLoginRequest, http_request: Request):
+    """Login to Cognito with username/password to get Access Token"""
+    await check_rate_limit("cognito_login", http_request, request.username)
+    if not cognito_gateway:
+        raise HTTPException(status_code=503, detail="Cognito client not initialized")
+
+    try:
+        auth_params = {
+            'USERNAME': request.username,
+            'PASSWORD': request.password
+        }
+        
+        if COGNITO_CLIENT_SECRET:
+            auth_params['SECRET_HASH'] = get_secret_hash(
+                request.username, COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET
+            )
+
+        response = await cognito_gateway.call(
+            "initiate_auth",
+            ClientId=COGNITO_CLIENT_ID,
+            AuthFlow='USER_PASSWORD_AUTH',
+            AuthParameters=auth_params
+        )
+        log_event(logger, "cognito.login_password", logging.DEBUG, response=response)
+
+        if 'AuthenticationResult' in response:
+            return response['AuthenticationResult']
+        elif 'ChallengeName' in response:
+            return response
+        else:
+            raise KeyError('AuthenticationResult')
+            
+    except CognitoUnavailable as e:
+        raise cognito_unavailable(e)
+    except ClientError as e:
+        log_event(logger, "cognito.client_error", logging.INFO, operation="initiate_auth", error=str(e))
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        log_event(logger, "cognito.error", logging.ERROR, exc_info=True, operation="initiate_auth", error=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/register/start")
+async def cognito_register_start(request: CognitoRegisterStartRequest):
+    """Start WebAuthn registration with Cognito"""
+    if not cognito_gateway:
+        raise HTTPException(status_code=503, detail="Cognito client not initialized")
+    await check_cognito_token(request.access_token)
+
+    try:
+        response = await cognito_gateway.call(
+            "start_web_authn_registration",
+            AccessToken=request.access_token
+        )
+        return response['CredentialCreationOptions']
+    except CognitoUnavailable as e:
+        raise cognito_unavailable(e)
+    except ClientError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/register/finish")
+async def cognito_register_finish(request: CognitoRegisterFinishRequest):
+    """Complete WebAuthn registration with Cognito"""
+    if not cognito_gateway:
+        raise HTTPException(status_code=503, detail="Cognito client not initialized")
+    await check_cognito_token(request.access_token)
+
+    try:
+        kwargs = {
+            'AccessToken': request.access_token,
+            'Credential': request.credential
+        }
+        response = await cognito_gateway.call("complete_web_authn_registration", **kwargs)
+        log_event(logger, "cognito.register_finish", logging.DEBUG, response=response)
+        return {"message": "Passkey registered successfully with Cognito", "details": response}
+    except CognitoUnavailable as e:
+        raise cognito_unavailable(e)
+    except ClientError as e:
+        error_detail = str(e)
+        if hasattr(e, 'response'):
+             error_detail = e.response
+        log_event(
+            logger, "cognito.client_error", logging.WARNING,
+            operation="complete_web_authn_registration", error=str(e), response=error_detail,
+        )
+        raise HTTPException(status_code=400, detail=error_detail)
+    except Exception as e:
+        log_event(
+            logger, "cognito.error", logging.ERROR, exc_info=True,
+            operation="complete_web_authn_registration", error=str(e),
+        )
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/login/start")
+async def cognito_login_start(request: CognitoLoginStartRequest, http_request: Request):
+    """Start WebAuthn login with Cognito (USER_AUTH flow)"""
+    await check_rate_limit("cognito_login", http_request, request.username)
+    if not cognito_gateway:
+        raise HTTPException(status_code=503, detail="Cognito client not initialized")
+
+    try:
+        auth_params = {
+            'USERNAME': request.username,
+            'PREFERRED_CHALLENGE': 'WEB_AUTHN'
+        }
+        
+        if COGNITO_CLIENT_SECRET:
+            auth_params['SECRET_HASH'] = get_secret_hash(
+                request.username, COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET
+            )
+
+        response = await cognito_gateway.call(
+            "initiate_auth",
+            ClientId=COGNITO_CLIENT_ID,
+            AuthFlow='USER_AUTH',
+            AuthParameters=auth_params
+        )
+        return response
+    except CognitoUnavailable as e:
+        raise cognito_unavailable(e)
+    except ClientError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class CognitoSignUpRequest(BaseModel):
+    username: str
+    password: str
+
+
+@router.post("/signup")
+async def cognito_signup(request: CognitoSignUpRequest, http_request: Request):
+    """Sign up a new user in Cognito"""
+    await check_rate_limit("cognito_signup", http_request)
+    if not cognito_gateway:
+        raise HTTPException(status_code=503, detail="Cognito client not initialized")
+
+    try:
+        kwargs = {
+            'ClientId': COGNITO_CLIENT_ID,
+            'Username': request.username,
+            'Password': request.password,
+            'UserAttributes': [
+                {
+                    'Name': 'email',
+                    'Value': request.username
+                }
+            ]
+        }
+        
+        if COGNITO_CLIENT_SECRET:
+            kwargs['SecretHash'] = get_secret_hash(
+                request.username, COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET
+            )
+
+        response = await cognito_gateway.call("sign_up", **kwargs)
+        return response
+    except CognitoUnavailable as e:
+        raise cognito_unavailable(e)
+    except ClientError as e:
+        log_event(logger, "cognito.client_error", logging.INFO, operation="sign_up", error=str(e))
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        log_event(logger, "cognito.error", logging.ERROR, exc_info=True, operation="sign_up", error=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+class CognitoConfirmSignUpRequest(BaseModel):
+    username: str
+    code: str
+
+
+@router.post("/confirm-signup")
+async def cognito_confirm_signup(request: CognitoConfirmSignUpRequest):
+    """Confirm a new user in Cognito with verification code"""
+    if not cognito_gateway:
+        raise HTTPException(status_code=503, detail="Cognito client not initialized")
+
+    try:
+        kwargs = {
+            'ClientId': COGNITO_CLIENT_ID,
+            'Username': request.username,
+            'ConfirmationCode': request.code,
+        }
+        
+        if COGNITO_CLIENT_SECRET:
+            kwargs['SecretHash'] = get_secret_hash(
+                request.username, COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET
+            )
+
+        response = await cognito_gateway.call("confirm_sign_up", **kwargs)
+        return response
+    except CognitoUnavailable as e:
+        raise cognito_unavailable(e)
+    except ClientError as e:
+        log_event(logger, "cognito.client_error", logging.INFO, operation="confirm_sign_up", error=str(e))
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        log_event(logger, "cognito.error", logging.ERROR, exc_info=True, operation="confirm_sign_up", error=str(e))
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/login/finish")
+async def cognito_login_finish(request: CognitoLoginFinishRequest):
+    """Complete WebAuthn login with Cognito"""
+    if not cognito_gateway:
+        raise HTTPException(status_code=503, detail="Cognito client not initialized")
+
+    try:
+        responses = request.challenge_responses.copy()
+        responses['USERNAME'] = request.username
+        
+        if COGNITO_CLIENT_SECRET:
+            responses['SECRET_HASH'] = get_secret_hash(
+                request.username, COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET
+            )
+
+        response = await cognito_gateway.call(
+            "respond_to_auth_challenge",
+            ClientId=COGNITO_CLIENT_ID,
+            ChallengeName='WEB_AUTHN',
+            Session=request.session,
+            ChallengeResponses=responses
+        )
+        return response
+    except CognitoUnavailable as e:
+        raise cognito_unavailable(e)
+    except ClientError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from typing import Dict, Optional
+
+import jwt
+from jwt.exceptions import InvalidTokenError, PyJWKError
+
+from app_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+COGNITO_REGION = os.getenv("COGNITO_REGION")
+COGNITO_USER_POOL_ID = os.getenv("COGNITO_USER_POOL_ID")
+COGNITO_CLIENT_ID = os.getenv("COGNITO_CLIENT_ID")
+# Override for a local stand-in, e.g. a moto server (http://localhost:5000)
+COGNITO_ENDPOINT_URL = os.getenv("COGNITO_ENDPOINT_URL") or None
+# "true", "false" or "auto" (on when a user pool or app client is configured). When off, neither the
+# /auth/cognito routes nor boto3 are loaded and Cognito tokens are not accepted.
+_COGNITO_ENABLED = os.getenv("COGNITO_ENABLED", "auto").lower()
+COGNITO_ENABLED = (
+    bool(COGNITO_USER_POOL_ID or COGNITO_CLIENT_ID) if _COGNITO_ENABLED == "auto" else _COGNITO_ENABLED == "true"
+)
+# Accept Cognito access tokens on our own routes, verified locally against the user pool's JWKS
+COGNITO_ACCEPT_TOKENS = os.getenv("COGNITO_ACCEPT_TOKENS", "true").lower() == "true"
+# Defaults to <issuer>/.well-known/jwks.json (or the same path under COGNITO_ENDPOINT_URL)
+COGNITO_JWKS_URL = os.getenv("COGNITO_JWKS_URL")
+# Last fetched JWKS, so a restart can verify tokens without reaching AWS
+COGNITO_JWKS_CACHE_FILE = os.getenv("COGNITO_JWKS_CACHE_FILE", "./cognito-jwks.json")
+# Fixed JWKS document (offline use and tests); when set the keys are never fetched
+COGNITO_JWKS_PINNED_FILE = os.getenv("COGNITO_JWKS_PINNED_FILE")
+# Cognito rarely rotates its keys; new kids are picked up on first sight anyway
+COGNITO_JWKS_MAX_AGE_SECONDS = float(os.getenv("COGNITO_JWKS_MAX_AGE_SECONDS", "86400"))
+
+# "idp" claim that local_claims adds, telling Cognito tokens apart from our own
+COGNITO_IDP = "cognito"
+
+JWKS_FETCH_TIMEOUT_SECONDS = 3
+# Tokens with an unknown kid trigger at most one fetch per this many seconds
+UNKNOWN_KID_REFRESH_SECONDS = 30.0
+
+
+class CognitoTokenVerifier:
+    """Verifies Cognito access tokens locally against the user pool's JWKS
+
+    Keys come from a pinned file, or from the JWKS URL with the last good document kept on
+    disk and in memory. A token signed by an unknown kid triggers a (rate-limited) refetch,
+    which is how a Cognito key rotation is picked up.
+    """
+
+    def __init__(
+        self,
+        issuer: str,
+        client_id: Optional[str] = None,
+        jwks_url: Optional[str] = None,
+        cache_file: Optional[str] = COGNITO_JWKS_CACHE_FILE,
+        pinned_file: Optional[str] = COGNITO_JWKS_PINNED_FILE,
+        max_age: float = COGNITO_JWKS_MAX_AGE_SECONDS,
+    ):
+        self.issuer = issuer
+        self.client_id = client_id
+        self.jwks_url = jwks_url or f"{issuer}/.well-known/jwks.json"
+        self.cache_file = cache_file
+        self.pinned_file = pinned_file
+        self.max_age = max_age
+        self._keys: Dict[str, jwt.PyJWK] = {}
+        self._lock = threading.Lock()
+        self._fetched_at = 0.0
+        self._last_attempt = 0.0
+        self.fetches = 0
+        self.fetch_failures = 0
+        self.unknown_kids = 0
+
+        if pinned_file:
+            with open(pinned_file) as f:
+                self._install(json.load(f))
+        elif cache_file and os.path.exists(cache_file):
+            try:
+                with open(cache_file) as f:
+                    self._install(json.load(f))
+                self._fetched_at = os.path.getmtime(cache_file)
+            except (OSError, ValueError) as e:
+                log_event(logger, "cognito_jwks.cache_unreadable", logging.WARNING, path=cache_file, error=str(e))
+
+    def issued(self, token: str) -> bool:
+        """Whether the token claims to come from this user pool (not verified yet)"""
+        try:
+            claims = jwt.decode(token, options={"verify_signature": False})
+        except InvalidTokenError:
+            return False
+        return claims.get("iss") == self.issuer
+
+    def fetch_due(self, token: str) -> bool:
+        """Whether decoding this token would fetch the JWKS first (network I/O)"""
+        if self.pinned_file:
+            return False
+        now = time.time()
+        if now - self._last_attempt < UNKNOWN_KID_REFRESH_SECONDS or not self.issued(token):
+            return False
+        try:
+            kid = jwt.get_unverified_header(token).get("kid")
+        except InvalidTokenError:
+            return False
+        return kid not in self._keys or now - self._fetched_at >= self.max_age
+
+    def decode(self, token: str) -> dict:
+        """Verify a Cognito access token and return its claims"""
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid not in self._keys:
+            self.unknown_kids += 1
+        if self.fetch_due(token):
+            self.refresh()
+        key = self._keys.get(kid)
+        if key is None:
+            raise InvalidTokenError("Unknown Cognito signing key")
+        # The algorithm comes from the published key, never from the token header
+        claims = jwt.decode(
+            token,
+            key.key,
+            algorithms=[key.algorithm_name],
+            issuer=self.issuer,
+            options={"require": ["exp", "iss", "token_use", "username"]},
+        )
+        if claims["token_use"] != "access":
+            raise InvalidTokenError("Not a Cognito access token")
+        if self.client_id and claims.get("client_id") != self.client_id:
+            raise InvalidTokenError("Token issued to another app client")
+        return claims
+
+    def refresh(self):
+        """Fetch the JWKS; on failure keep verifying with the keys we already have"""
+        with self._lock:
+            self._last_attempt = time.time()
+            try:
+                with urllib.request.urlopen(self.jwks_url, timeout=JWKS_FETCH_TIMEOUT_SECONDS) as response:
+                    body = response.read()
+                self._install(json.loads(body))
+            except (OSError, ValueError, PyJWKError) as e:
+                self.fetch_failures += 1
+                log_event(logger, "cognito_jwks.fetch_failed", logging.WARNING, url=self.jwks_url, error=str(e))
+                return
+            self.fetches += 1
+            self._fetched_at = time.time()
+            if self.cache_file:
+                self._write_cache(body)
+
+    def _install(self, document: dict):
+        keys = {}
+        for jwk in document.get("keys", []):
+            # Cognito signs with RS256; anything else in the set is not ours to trust
+            if jwk.get("kty") == "RSA" and jwk.get("kid"):
+                keys[jwk["kid"]] = jwt.PyJWK(jwk, algorithm=jwk.get("alg", "RS256"))
+        self._keys = keys
+
+    def _write_cache(self, body: bytes):
+        tmp_path = f"{self.cache_file}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, self.cache_file)
+        except OSError as e:
+            log_event(logger, "cognito_jwks.cache_write_failed", logging.WARNING, path=self.cache_file, error=str(e))
+
+    def stats(self) -> dict:
+        return {
+            "issuer": self.issuer,
+            "keys": len(self._keys),
+            "source": "pinned" if self.pinned_file else "jwks_url",
+            "age_seconds": round(time.time() - self._fetched_at) if self._fetched_at else None,
+            "fetches": self.fetches,
+            "fetch_failures": self.fetch_failures,
+            "unknown_kids": self.unknown_kids,
+        }
+
+
+def local_claims(claims: dict) -> dict:
+    """Cognito access token claims marked as such
+
+    "sub" stays the Cognito user's sub. Anyone can sign up to the user pool under any free username,
+    so a Cognito username says nothing about our accounts: only a link stored in users.cognito_sub does.
+    """
+    return {**claims, "idp": COGNITO_IDP}
+
+
+def create_cognito_verifier() -> Optional[CognitoTokenVerifier]:
+    """Verifier for the configured user pool, or None when Cognito tokens are not accepted"""
+    if not (COGNITO_ENABLED and COGNITO_ACCEPT_TOKENS and COGNITO_USER_POOL_ID and COGNITO_REGION):
+        return None
+    issuer = f"https://cognito-idp.{COGNITO_REGION}.amazonaws.com/{COGNITO_USER_POOL_ID}"
+    jwks_url = COGNITO_JWKS_URL
+    if jwks_url is None and COGNITO_ENDPOINT_URL:
+        jwks_url = f"{COGNITO_ENDPOINT_URL.rstrip('/')}/{COGNITO_USER_POOL_ID}/.well-known/jwks.json"
+    try:
+        return CognitoTokenVerifier(issuer, COGNITO_CLIENT_ID, jwks_url)
+    except (OSError, ValueError, PyJWKError) as e:
+        log_event(logger, "cognito_jwks.disabled", logging.WARNING, error=str(e))
+        return None
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, replace
+from typing import Dict, Optional, Set
+
+CREDENTIAL_CACHE_SIZE = int(os.getenv("CREDENTIAL_CACHE_SIZE", "10000"))
+# Bounds how long another worker's deletes or sign-count updates can go unseen here
+CREDENTIAL_CACHE_TTL_SECONDS = float(os.getenv("CREDENTIAL_CACHE_TTL_SECONDS", "300"))
+
+
+@dataclass(frozen=True)
+class CachedCredential:
+    credential_id: str
+    public_key: bytes  # Decoded COSE public key
+    user_id: int
+    username: str
+    display_name: str
+    sign_count: int
+
+
+class CredentialCache:
+    """LRU + TTL cache of passkey credentials keyed by credential_id"""
+
+    def __init__(self, max_entries: int = CREDENTIAL_CACHE_SIZE, ttl: float = CREDENTIAL_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, credential_id: str) -> Optional[CachedCredential]:
+        with self._lock:
+            item = self._entries.get(credential_id)
+            if item is None or item[0] <= time.monotonic():
+                if item is not None:
+                    self._remove_locked(credential_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(credential_id)
+            self.hits += 1
+            return item[1]
+
+    def put(self, credential: CachedCredential):
+        with self._lock:
+            self._remove_locked(credential.credential_id)
+            while len(self._entries) >= self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove_locked(oldest)
+            self._entries[credential.credential_id] = (time.monotonic() + self.ttl, credential)
+            self._by_user.setdefault(credential.user_id, set()).add(credential.credential_id)
+
+    def update_sign_count(self, credential_id: str, sign_count: int):
+        """Record a newer sign count (never moves backwards)"""
+        with self._lock:
+            item = self._entries.get(credential_id)
+            if item is not None and sign_count > item[1].sign_count:
+                self._entries[credential_id] = (item[0], replace(item[1], sign_count=sign_count))
+
+    def invalidate(self, credential_id: str):
+        with self._lock:
+            self._remove_locked(credential_id)
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for credential_id in list(self._by_user.get(user_id, ())):
+                self._remove_locked(credential_id)
+
+    def _remove_locked(self, credential_id: str):
+        item = self._entries.pop(credential_id, None)
+        if item is not None:
+            user_credentials = self._by_user.get(item[1].user_id)
+            if user_credentials is not None:
+                user_credentials.discard(credential_id)
+                if not user_credentials:
+                    del self._by_user[item[1].user_id]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
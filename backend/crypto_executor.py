@@ -0,0 +1,111 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from metrics import CRYPTO_SECONDS, CRYPTO_WAIT_SECONDS
+
+# "thread" (bounded thread pool; bcrypt and OpenSSL release the GIL) or "process"
+CRYPTO_EXECUTOR = os.getenv("CRYPTO_EXECUTOR", "thread")
+CRYPTO_WORKERS = int(os.getenv("CRYPTO_WORKERS", str(os.cpu_count() or 2)))
+# Jobs allowed to wait for a free worker before new submissions are rejected
+CRYPTO_MAX_QUEUE = int(os.getenv("CRYPTO_MAX_QUEUE", "64"))
+
+
+class CryptoOverloaded(Exception):
+    """Raised when the crypto queue is full and the caller should shed load"""
+
+
+def _run_timed(submitted_at: float, fn, args, kwargs):
+    # Runs inside the worker (thread or process) so the queue wait can be measured there
+    started_at = time.time()
+    result = fn(*args, **kwargs)
+    return started_at - submitted_at, time.time() - started_at, result
+
+
+class CryptoExecutor:
+    """Dedicated executor for CPU-bound crypto (bcrypt, WebAuthn signature verification)"""
+
+    def __init__(self, mode: str = CRYPTO_EXECUTOR, workers: int = CRYPTO_WORKERS, max_queue: int = CRYPTO_MAX_QUEUE):
+        if mode == "process":
+            self._pool = ProcessPoolExecutor(max_workers=workers)
+        elif mode == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="crypto")
+        else:
+            raise ValueError(f"Unsupported CRYPTO_EXECUTOR: {mode}")
+        self.mode = mode
+        self.workers = workers
+        self.max_queue = max_queue
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.run_seconds_total = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return max(self.in_flight - self.workers, 0)
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Queue a job, or raise CryptoOverloaded when too many jobs are already waiting"""
+        with self._lock:
+            if self.in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise CryptoOverloaded(f"Crypto queue full ({self.max_queue} waiting)")
+            self.in_flight += 1
+            self.submitted += 1
+
+        inner = self._pool.submit(_run_timed, time.time(), fn, args, kwargs)
+        outer: Future = Future()
+        operation = getattr(fn, "__name__", "unknown")
+
+        def _done(f: Future):
+            with self._lock:
+                self.in_flight -= 1
+                if f.exception() is not None:
+                    self.failed += 1
+                else:
+                    wait, run, _ = f.result()
+                    self.completed += 1
+                    self.wait_seconds_total += wait
+                    self.wait_seconds_max = max(self.wait_seconds_max, wait)
+                    self.run_seconds_total += run
+            if f.exception() is not None:
+                outer.set_exception(f.exception())
+            else:
+                CRYPTO_WAIT_SECONDS.observe(wait, operation=operation)
+                CRYPTO_SECONDS.observe(run, operation=operation)
+                outer.set_result(f.result()[2])
+
+        inner.add_done_callback(_done)
+        return outer
+
+    async def run(self, fn, *args, **kwargs):
+        """Run a job without blocking the event loop (for async endpoints)"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self) -> dict:
+        with self._lock:
+            finished = self.completed or 1
+            return {
+                "mode": self.mode,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self.in_flight,
+                "queue_depth": self.queue_depth,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "avg_wait_ms": round(self.wait_seconds_total / finished * 1000, 3),
+                "max_wait_ms": round(self.wait_seconds_max * 1000, 3),
+                "avg_run_ms": round(self.run_seconds_total / finished * 1000, 3),
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
@@ -1,15 +1,187 @@
-from sqlalchemy import create_engine, Column, String, Integer, ForeignKey
+from sqlalchemy import create_engine, event, inspect, select, text, Column, String, Integer, ForeignKey
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, relationship
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+import logging
 import os
-import bcrypt
+import random
+import threading
+import time
 
-DATABASE_URL = "sqlite:///./fido.db"
+from app_logging import log_event
+from metrics import instrument_engine
 
-engine = create_engine(
-    DATABASE_URL, connect_args={"check_same_thread": False}
-)
+logger = logging.getLogger(__name__)
+
+# Database configuration (can be overridden by environment variables)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./fido.db")
+# Driver used by the async engine that serves requests; derived from DATABASE_URL unless set
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "-1"))
+
+# SQLite pragmas applied to every new connection
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-20000"))  # negative = KiB
+
+# Workers starting together on a fresh database race to create it; the losers retry
+SCHEMA_CREATE_ATTEMPTS = 8
+SCHEMA_CREATE_BACKOFF_SECONDS = 0.05
+
+# Create the demo account ("user" / "user") when it is missing; turn off outside of demos
+SEED_DEMO_USER = os.getenv("SEED_DEMO_USER", "true").lower() == "true"
+DEMO_USERNAME = "user"
+# bcrypt hash of the demo password "user", precomputed so seeding does no hashing at startup
+DEMO_PASSWORD_HASH = "$2b$12$sV5SxA99E1JAhx.bfsdA0ecmNOu0MyS1IQ3Z1ismOZIFTWdgbd/xK"
+
+
+class PoolMetrics:
+    """Connection checkout latency counters shared by every pool the engine creates"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+
+
+pool_metrics = PoolMetrics()
+
+
+class CheckoutTimingMixin:
+    """Records how long each connection checkout takes"""
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except Exception:
+            pool_metrics.record(time.perf_counter() - started, timed_out=True)
+            raise
+        pool_metrics.record(time.perf_counter() - started)
+        return connection
+
+
+class InstrumentedQueuePool(CheckoutTimingMixin, QueuePool):
+    # Log under sqlalchemy.* so pool messages follow SQLAlchemy's logging configuration
+    _sqla_logger_namespace = "sqlalchemy.pool.impl.InstrumentedQueuePool"
+
+
+class InstrumentedAsyncQueuePool(CheckoutTimingMixin, AsyncAdaptedQueuePool):
+    _sqla_logger_namespace = "sqlalchemy.pool.impl.InstrumentedAsyncQueuePool"
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.close()
+
+
+def _engine_options(url: str, poolclass) -> dict:
+    parsed = make_url(url)
+    options = {}
+    if parsed.get_backend_name() == "sqlite":
+        options["connect_args"] = {"check_same_thread": False}
+        if parsed.database and parsed.database != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(parsed.database)), exist_ok=True)
+
+    if parsed.get_backend_name() != "sqlite" or (parsed.database and parsed.database != ":memory:"):
+        options.update(
+            poolclass=poolclass,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=parsed.get_backend_name() != "sqlite",
+        )
+    return options
+
+
+def create_engine_from_env(url: str = DATABASE_URL):
+    """Build the sync engine from DATABASE_URL and the DB_* / SQLITE_* settings"""
+    new_engine = create_engine(url, **_engine_options(url, InstrumentedQueuePool))
+    if make_url(url).get_backend_name() == "sqlite":
+        event.listen(new_engine, "connect", _apply_sqlite_pragmas)
+    return new_engine
+
+
+def to_async_url(url: str) -> str:
+    """Swap the driver of a sync database URL for its asyncio counterpart"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {backend}; set ASYNC_DATABASE_URL")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+def create_async_engine_from_env(url: str = None):
+    """Build the async engine (aiosqlite for SQLite) with the same pool settings and pragmas"""
+    url = url or ASYNC_DATABASE_URL or to_async_url(DATABASE_URL)
+    new_engine = create_async_engine(url, **_engine_options(url, InstrumentedAsyncQueuePool))
+    if make_url(url).get_backend_name() == "sqlite":
+        event.listen(new_engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    return new_engine
+
+
+def _pool_occupancy(pool) -> dict:
+    stats = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=pool.overflow(),
+        )
+    return stats
+
+
+def pool_stats() -> dict:
+    """Pool occupancy and checkout latency, for sizing workers"""
+    checkouts = pool_metrics.checkouts
+    return {
+        "async": _pool_occupancy(async_engine.pool),
+        "sync": _pool_occupancy(engine.pool),
+        "checkouts": checkouts,
+        "timeouts": pool_metrics.timeouts,
+        "avg_checkout_ms": round(pool_metrics.wait_seconds_total / checkouts * 1000, 3) if checkouts else 0.0,
+        "max_checkout_ms": round(pool_metrics.wait_seconds_max * 1000, 3),
+    }
+
+
+# The sync engine serves startup tasks and background writers; requests use the async engine
+engine = create_engine_from_env()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+async_engine = create_async_engine_from_env()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
 Base = declarative_base()
 
 
@@ -20,6 +192,10 @@ class User(Base):
     username = Column(String, unique=True, index=True, nullable=False)
     password_hash = Column(String, nullable=False)
     display_name = Column(String, nullable=False)
+    # Denormalized number of passkeys, maintained by every registration path and passkey deletion
+    passkey_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Cognito user (its "sub") explicitly linked to this account; only then do its access tokens act as this user
+    cognito_sub = Column(String, unique=True, index=True, nullable=True)
 
     # Relationship to passkeys
     passkeys = relationship("Passkey", back_populates="user", cascade="all, delete-orphan")
@@ -41,34 +217,99 @@ class Passkey(Base):
     user = relationship("User", back_populates="passkeys")
 
 
-def init_db():
-    """Initialize database and create default user"""
-    Base.metadata.create_all(bind=engine)
+def _add_column(column: str, statements):
+    """Run a column migration; tolerates another worker having run it at the same time"""
+    table, name = column.split(".")
+    try:
+        with engine.begin() as connection:
+            for statement in statements:
+                connection.execute(text(statement))
+    except DBAPIError:
+        # Another worker migrated first
+        if name not in {c["name"] for c in inspect(engine).get_columns(table)}:
+            raise
+        return
+    log_event(logger, "db.migrated", column=column)
 
-    db = SessionLocal()
 
-    # Check if default user exists
-    existing_user = db.query(User).filter(User.username == "user").first()
-    if not existing_user:
-        # Create default user with password "user"
-        password_hash = bcrypt.hashpw("user".encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-        default_user = User(
-            username="user",
-            password_hash=password_hash,
-            display_name="Default User"
-        )
-        db.add(default_user)
-        db.commit()
-        print("Default user created: user/user")
-    else:
-        print("Default user already exists")
+def migrate_passkey_count(inspector):
+    """Add and backfill users.passkey_count on databases created before the column existed"""
+    columns = {column["name"] for column in inspector.get_columns("users")}
+    if "passkey_count" in columns:
+        return
+    _add_column("users.passkey_count", [
+        "ALTER TABLE users ADD COLUMN passkey_count INTEGER NOT NULL DEFAULT 0",
+        "UPDATE users SET passkey_count = "
+        "(SELECT COUNT(*) FROM passkeys WHERE passkeys.user_id = users.id)",
+    ])
 
-    db.close()
 
+def migrate_cognito_sub(inspector):
+    """Add users.cognito_sub on databases created before Cognito accounts were linked explicitly"""
+    columns = {column["name"] for column in inspector.get_columns("users")}
+    if "cognito_sub" in columns:
+        return
+    _add_column("users.cognito_sub", [
+        "ALTER TABLE users ADD COLUMN cognito_sub VARCHAR",
+        "CREATE UNIQUE INDEX ix_users_cognito_sub ON users (cognito_sub)",
+    ])
 
-def get_db():
-    db = SessionLocal()
-    try:
+
+def schema_exists(inspector) -> bool:
+    return set(Base.metadata.tables) <= set(inspector.get_table_names())
+
+
+def create_schema():
+    """Create the tables, retrying while other workers are creating them at the same time
+
+    Each worker's create_all checks for a table and then creates it, so a concurrent worker can
+    win in between ("table users already exists") or hold the write lock. Retrying with
+    checkfirst skips whatever now exists and creates the rest; it succeeds once every table does.
+    """
+    for attempt in range(1, SCHEMA_CREATE_ATTEMPTS + 1):
+        try:
+            Base.metadata.create_all(bind=engine, checkfirst=True)
+            break
+        except DBAPIError as e:
+            if attempt == SCHEMA_CREATE_ATTEMPTS:
+                raise
+            log_event(logger, "db.schema_create_retry", logging.DEBUG, attempt=attempt, error=str(e.orig))
+            time.sleep(random.uniform(0, SCHEMA_CREATE_BACKOFF_SECONDS * 2 ** attempt))
+    log_event(logger, "db.schema_created")
+
+
+def seed_demo_user():
+    """Create the default user unless it already exists"""
+    with SessionLocal() as db:
+        if db.scalar(select(User.id).where(User.username == DEMO_USERNAME)) is not None:
+            log_event(logger, "db.default_user_exists", logging.DEBUG, username=DEMO_USERNAME)
+            return
+        db.add(User(username=DEMO_USERNAME, password_hash=DEMO_PASSWORD_HASH, display_name="Default User"))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Another worker seeded it first
+            db.rollback()
+            return
+    log_event(logger, "db.default_user_created", username=DEMO_USERNAME)
+
+
+def init_db(seed: bool = SEED_DEMO_USER):
+    """Bootstrap the database: schema (or pending migrations) and the demo user
+
+    On an initialized database this is a table listing, column checks and, when seeding, one
+    indexed lookup; create_all and its per-table checks only run on a fresh database.
+    """
+    inspector = inspect(engine)
+    if schema_exists(inspector):
+        migrate_passkey_count(inspector)
+        migrate_cognito_sub(inspector)
+    else:
+        create_schema()
+    if seed:
+        seed_demo_user()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
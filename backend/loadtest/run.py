@@ -0,0 +1,331 @@
+"""Load generator replaying full WebAuthn ceremonies against a running backend.
+
+Each scenario is one complete ceremony driven by a software authenticator (soft_authenticator.py):
+
+    password      POST /auth/password/login
+    register      POST /auth/register/start -> /auth/register/finish
+    login         POST /auth/login/start -> /auth/login/finish
+    usernameless  POST /auth/login/usernameless/start -> /auth/login/usernameless/finish
+    qr            POST /auth/register/qr/start, GET /auth/register/qr/{id}/image,
+                  WS /ws/register/{id}, GET /mobile/register/{id}, GET /api/mobile/register/{id}/bootstrap,
+                  POST /api/mobile/register/finish/{id}, then waits for the WebSocket notification
+    batch         --batch-size x POST /auth/login/start -> one POST /auth/login/batch (needs --gateway-key)
+
+Ceremonies are started open-loop at the target rate (so a slow server shows up as latency, not
+as a lower offered load) and latency/error rates are reported per endpoint.
+
+The backend's RP_ID and RP_ORIGINS must accept --rp-id and --origin, and should run with
+RATE_LIMIT_ENABLED=false (all traffic comes from one IP and would exhaust its budgets). Every register/qr ceremony
+adds a passkey to the --username account; login ceremonies only use the --credentials passkeys
+registered during setup, so their allowCredentials list stays the same size. Each of those passkeys
+serves one ceremony at a time (every assertion bumps its sign count, and counts reaching the server
+out of order look like a cloned authenticator), so the batch scenario registers at least --batch-size.
+
+Usage (from backend/, with the backend running):
+    pip install -r loadtest/requirements.txt
+    python -m loadtest.run --rps 50 --duration 30 --scenario login --scenario usernameless
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import re
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from soft_authenticator import SoftAuthenticator
+
+SCENARIOS = ("password", "register", "login", "usernameless", "qr", "batch")
+
+
+class CeremonyFailed(Exception):
+    """A step failed; the failure is already recorded against its endpoint"""
+
+
+class Stats:
+    """Latency samples and error counts per endpoint"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def record(self, endpoint: str, seconds: float, error: str = None):
+        self.latencies[endpoint].append(seconds)
+        if error is not None:
+            self.errors[endpoint][error] += 1
+
+    def report(self, elapsed: float):
+        print(f"\n{'endpoint':<44} {'count':>7} {'rps':>8} {'err%':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for endpoint in sorted(self.latencies):
+            samples = sorted(self.latencies[endpoint])
+            errors = sum(self.errors[endpoint].values())
+            print(
+                f"{endpoint:<44} {len(samples):>7} {len(samples) / elapsed:>8.1f}"
+                f" {errors / len(samples) * 100:>6.2f}%"
+                f" {percentile(samples, 50) * 1000:>9.2f}"
+                f" {percentile(samples, 95) * 1000:>9.2f}"
+                f" {percentile(samples, 99) * 1000:>9.2f}"
+            )
+        for endpoint in sorted(self.errors):
+            for error, count in sorted(self.errors[endpoint].items(), key=lambda item: -item[1]):
+                print(f"  {endpoint}: {count} x {error}")
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.stats = Stats()
+        self.token = None
+        self.credentials: List[SoftAuthenticator] = []
+        self.credential_locks: List[asyncio.Lock] = []
+        self.ws_url = re.sub(r"^http", "ws", args.base_url.rstrip("/"))
+        self.client = httpx.AsyncClient(
+            base_url=args.base_url,
+            headers={"Origin": args.origin},
+            timeout=args.timeout,
+            limits=httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections),
+        )
+
+    def authenticator(self) -> SoftAuthenticator:
+        return SoftAuthenticator(self.args.rp_id, self.args.origin)
+
+    @contextlib.asynccontextmanager
+    async def borrow(self, count: int = 1):
+        """Exclusive use of `count` distinct setup passkeys, held until the ceremony's finish response arrives"""
+        free = [i for i, lock in enumerate(self.credential_locks) if not lock.locked()]
+        pool = free if len(free) >= count else range(len(self.credentials))
+        async with contextlib.AsyncExitStack() as stack:
+            # Acquired in index order, so concurrent batches cannot deadlock on each other
+            indexes = sorted(random.sample(pool, count))
+            for i in indexes:
+                await stack.enter_async_context(self.credential_locks[i])
+            yield [self.credentials[i] for i in indexes]
+
+    async def call(self, method: str, endpoint: str, path: str, **kwargs) -> httpx.Response:
+        """Issue one request, recording its latency and any failure under the endpoint name"""
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+        except httpx.HTTPError as e:
+            self.stats.record(endpoint, time.perf_counter() - started, type(e).__name__)
+            raise CeremonyFailed(endpoint)
+        error = None if response.is_success else f"HTTP {response.status_code}"
+        self.stats.record(endpoint, time.perf_counter() - started, error)
+        if error is not None:
+            raise CeremonyFailed(endpoint)
+        return response
+
+    @property
+    def auth_headers(self) -> dict:
+        return {"Authorization": f"Bearer {self.token}"}
+
+    # Ceremonies
+
+    async def password(self) -> str:
+        response = await self.call(
+            "POST", "POST /auth/password/login", "/auth/password/login",
+            json={"username": self.args.username, "password": self.args.password},
+        )
+        return response.json()["access_token"]
+
+    async def register(self) -> SoftAuthenticator:
+        start = (await self.call(
+            "POST", "POST /auth/register/start", "/auth/register/start",
+            json={"username": self.args.username, "display_name": "Load test"},
+            headers=self.auth_headers,
+        )).json()
+        authenticator = self.authenticator()
+        await self.call(
+            "POST", "POST /auth/register/finish", "/auth/register/finish",
+            json={
+                "credential": authenticator.create(start["options"]),
+                "challenge_token": start["challenge_token"],
+                "display_name": "Load test",
+            },
+            headers=self.auth_headers,
+        )
+        return authenticator
+
+    async def login(self):
+        start = (await self.call(
+            "POST", "POST /auth/login/start", "/auth/login/start",
+            json={"username": self.args.username},
+        )).json()
+        async with self.borrow() as (authenticator,):
+            await self.call(
+                "POST", "POST /auth/login/finish", "/auth/login/finish",
+                json={
+                    "username": self.args.username,
+                    "assertion": authenticator.get(start["options"]),
+                    "challenge_token": start["challenge_token"],
+                },
+            )
+
+    async def usernameless(self):
+        start = (await self.call(
+            "POST", "POST /auth/login/usernameless/start", "/auth/login/usernameless/start",
+            json={},
+        )).json()
+        async with self.borrow() as (authenticator,):
+            await self.call(
+                "POST", "POST /auth/login/usernameless/finish", "/auth/login/usernameless/finish",
+                json={"assertion": authenticator.get(start["options"]), "challenge_token": start["challenge_token"]},
+            )
+
+    async def batch(self):
+        starts = await asyncio.gather(*(
+            self.call("POST", "POST /auth/login/start", "/auth/login/start", json={"username": self.args.username})
+            for _ in range(self.args.batch_size)
+        ))
+        # One passkey per item: the server may verify the items of a batch in any order
+        async with self.borrow(len(starts)) as authenticators:
+            items = []
+            for start, authenticator in zip(starts, authenticators):
+                start = start.json()
+                items.append({
+                    "username": self.args.username,
+                    "assertion": authenticator.get(start["options"]),
+                    "challenge_token": start["challenge_token"],
+                })
+            response = await self.call(
+                "POST", "POST /auth/login/batch", "/auth/login/batch",
+                json={"items": items},
+                headers={"X-Gateway-Key": self.args.gateway_key or ""},
+            )
+        # Items fail individually inside a 200 response; count them per item
+        for result in response.json()["results"]:
+            self.stats.record("batch item", 0.0, None if result["success"] else f"HTTP {result['status']}")
+
+    async def qr(self):
+        start = (await self.call(
+            "POST", "POST /auth/register/qr/start", "/auth/register/qr/start",
+            json={"username": self.args.username, "display_name": "Load test (QR)"},
+            headers=self.auth_headers,
+        )).json()
+        session_id = start["session_id"]
+        await self.call("GET", "GET /auth/register/qr/{id}/image", start["qr_image_url"])
+
+        endpoint = "WS /ws/register/{id}"
+        started = time.perf_counter()
+        try:
+            websocket = await websockets.connect(
+                f"{self.ws_url}/ws/register/{session_id}",
+                origin=self.args.origin,
+                open_timeout=self.args.timeout,
+            )
+        except (OSError, websockets.WebSocketException, asyncio.TimeoutError) as e:
+            self.stats.record(endpoint, time.perf_counter() - started, type(e).__name__)
+            raise CeremonyFailed(endpoint)
+        self.stats.record(endpoint, time.perf_counter() - started)
+
+        async with websocket:
+            await self.receive(websocket, "WS waiting message")
+
+            await self.call("GET", "GET /mobile/register/{id}", f"/mobile/register/{session_id}")
+            bootstrap = (await self.call(
+                "GET", "GET /api/mobile/register/{id}/bootstrap", f"/api/mobile/register/{session_id}/bootstrap",
+            )).json()
+            options = bootstrap["options"]
+
+            finished_at = time.perf_counter()
+            await self.call(
+                "POST", "POST /api/mobile/register/finish/{id}", f"/api/mobile/register/finish/{session_id}",
+                json=self.authenticator().create(options),
+            )
+            # Time from the mobile finish being sent until the desktop hears about it
+            await self.receive(websocket, "WS completion notify", since=finished_at)
+
+    async def receive(self, websocket, endpoint: str, since: float = None):
+        started = time.perf_counter() if since is None else since
+        try:
+            message = json.loads(await asyncio.wait_for(websocket.recv(), self.args.timeout))
+        except (websockets.WebSocketException, asyncio.TimeoutError, ValueError) as e:
+            self.stats.record(endpoint, time.perf_counter() - started, type(e).__name__)
+            raise CeremonyFailed(endpoint)
+        self.stats.record(endpoint, time.perf_counter() - started)
+        return message
+
+    # Driver
+
+    async def setup(self):
+        self.token = await self.password()
+        count = self.args.credentials
+        if "batch" in (self.args.scenario or ()):
+            count = max(count, self.args.batch_size)
+        for _ in range(count):
+            self.credentials.append(await self.register())
+            self.credential_locks.append(asyncio.Lock())
+        self.stats = Stats()
+
+    async def run_one(self, scenario: str, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                await getattr(self, scenario)()
+            except CeremonyFailed:
+                pass
+
+    async def run(self):
+        try:
+            await self.setup()
+        except CeremonyFailed:
+            print("Setup failed:")
+            self.stats.report(1.0)
+            await self.client.aclose()
+            return
+
+        scenarios = self.args.scenario or ["login"]
+        semaphore = asyncio.Semaphore(self.args.max_in_flight)
+        interval = 1.0 / self.args.rps
+        total = int(self.args.rps * self.args.duration)
+        print(f"Offering {self.args.rps} ceremonies/s for {self.args.duration}s: {', '.join(scenarios)}")
+
+        tasks = []
+        started = time.perf_counter()
+        for i in range(total):
+            delay = started + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.run_one(scenarios[i % len(scenarios)], semaphore)))
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+
+        await self.client.aclose()
+        print(f"{total} ceremonies in {elapsed:.1f}s ({total / elapsed:.1f}/s achieved)")
+        self.stats.report(elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", default=os.getenv("LOADTEST_BASE_URL", "http://localhost:8000"))
+    parser.add_argument("--origin", default=os.getenv("LOADTEST_ORIGIN", "http://localhost:3000"))
+    parser.add_argument("--rp-id", default=os.getenv("RP_ID", "localhost"))
+    parser.add_argument("--username", default="user")
+    parser.add_argument("--password", default="user")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS,
+                        help="repeat to mix scenarios round-robin (default: login)")
+    parser.add_argument("--rps", type=float, default=20, help="ceremonies started per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--credentials", type=int, default=5, help="passkeys registered during setup for login scenarios (at least --batch-size with batch)")
+    parser.add_argument("--max-in-flight", type=int, default=500, help="ceremonies allowed to run at once")
+    parser.add_argument("--connections", type=int, default=100, help="HTTP connection pool size")
+    parser.add_argument("--timeout", type=float, default=10)
+    parser.add_argument("--gateway-key", default=os.getenv("GATEWAY_API_KEY"), help="X-Gateway-Key for the batch scenario")
+    parser.add_argument("--batch-size", type=int, default=20, help="assertions per batch request")
+    asyncio.run(LoadTest(parser.parse_args()).run())
+
+
+if __name__ == "__main__":
+    main()
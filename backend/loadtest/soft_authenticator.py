@@ -0,0 +1,115 @@
+"""Software FIDO2 authenticator producing ES256 "none" attestations and assertions.
+
+Only meant for driving the backend at volume in load tests: keys live in memory and user
+presence/verification flags are always set.
+"""
+import base64
+import hashlib
+import json
+import os
+import struct
+from typing import Optional
+
+import cbor2
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+
+FLAG_UP = 0x01
+FLAG_UV = 0x04
+FLAG_AT = 0x40
+COSE_ALG_ES256 = -7
+
+
+def b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+class SoftAuthenticator:
+    """One ES256 credential bound to a relying party"""
+
+    def __init__(self, rp_id: str, origin: str, aaguid: bytes = b"\0" * 16):
+        self.rp_id = rp_id
+        self.origin = origin
+        self.aaguid = aaguid
+        self.private_key = ec.generate_private_key(ec.SECP256R1())
+        self.credential_id = os.urandom(32)
+        self.user_handle: Optional[bytes] = None
+        self.sign_count = 0
+
+    @property
+    def credential_id_b64(self) -> str:
+        return b64url(self.credential_id)
+
+    def _rp_id_hash(self) -> bytes:
+        return hashlib.sha256(self.rp_id.encode("utf-8")).digest()
+
+    def _client_data(self, ceremony: str, challenge: str) -> bytes:
+        return json.dumps({
+            "type": ceremony,
+            "challenge": challenge,
+            "origin": self.origin,
+            "crossOrigin": False,
+        }, separators=(",", ":")).encode("utf-8")
+
+    def cose_public_key(self) -> bytes:
+        numbers = self.private_key.public_key().public_numbers()
+        return cbor2.dumps({
+            1: 2,  # kty: EC2
+            3: COSE_ALG_ES256,
+            -1: 1,  # crv: P-256
+            -2: numbers.x.to_bytes(32, "big"),
+            -3: numbers.y.to_bytes(32, "big"),
+        })
+
+    def create(self, options: dict) -> dict:
+        """Answer navigator.credentials.create() for the given (JSON) registration options"""
+        user_id = options.get("user", {}).get("id")
+        if user_id:
+            self.user_handle = base64.urlsafe_b64decode(user_id + "=" * (-len(user_id) % 4))
+
+        client_data = self._client_data("webauthn.create", options["challenge"])
+        auth_data = (
+            self._rp_id_hash()
+            + bytes([FLAG_UP | FLAG_UV | FLAG_AT])
+            + struct.pack(">I", self.sign_count)
+            + self.aaguid
+            + struct.pack(">H", len(self.credential_id))
+            + self.credential_id
+            + self.cose_public_key()
+        )
+        attestation_object = cbor2.dumps({"fmt": "none", "attStmt": {}, "authData": auth_data})
+        return {
+            "id": self.credential_id_b64,
+            "rawId": self.credential_id_b64,
+            "type": "public-key",
+            "response": {
+                "clientDataJSON": b64url(client_data),
+                "attestationObject": b64url(attestation_object),
+                "transports": ["internal"],
+            },
+            "clientExtensionResults": {},
+        }
+
+    def get(self, options: dict) -> dict:
+        """Answer navigator.credentials.get() for the given (JSON) authentication options"""
+        self.sign_count += 1
+        client_data = self._client_data("webauthn.get", options["challenge"])
+        auth_data = self._rp_id_hash() + bytes([FLAG_UP | FLAG_UV]) + struct.pack(">I", self.sign_count)
+        signature = self.private_key.sign(
+            auth_data + hashlib.sha256(client_data).digest(),
+            ec.ECDSA(hashes.SHA256()),
+        )
+        response = {
+            "clientDataJSON": b64url(client_data),
+            "authenticatorData": b64url(auth_data),
+            "signature": b64url(signature),
+        }
+        if self.user_handle is not None:
+            response["userHandle"] = b64url(self.user_handle)
+        return {
+            "id": self.credential_id_b64,
+            "rawId": self.credential_id_b64,
+            "type": "public-key",
+            "response": response,
+            "clientExtensionResults": {},
+        }
@@ -1,69 +1,221 @@
-from fastapi import FastAPI, Depends, HTTPException, Security, WebSocket, WebSocketDisconnect, Request
+from fastapi import APIRouter, FastAPI, Depends, Header, HTTPException, Security, WebSocket, WebSocketDisconnect, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-import base64
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
+import itertools
+import logging
+import math
 import os
 import json
+import re
 import bcrypt
 import jwt
+import secrets
 from jwt.exceptions import InvalidTokenError
-import qrcode
-import io
 import uuid
+import time
+from dataclasses import dataclass, replace
 from datetime import datetime, timedelta
 from typing import List, Optional, Dict
 from webauthn import (
     generate_registration_options,
     verify_registration_response,
     generate_authentication_options,
-    verify_authentication_response,
 )
 from webauthn.helpers import (
     bytes_to_base64url,
     base64url_to_bytes,
 )
-from database import init_db, get_db, User, Passkey
-import boto3
-from botocore.exceptions import ClientError
+from database import init_db, get_async_db, pool_stats, async_engine, SessionLocal, User, Passkey
+from session_store import create_session_store, MemorySessionStore, SessionStoreFull
+from challenge_tokens import InvalidChallengeToken, ReplayCacheFull, create_challenge_tokens
+from crypto_executor import CryptoExecutor, CryptoOverloaded
+from credential_cache import CredentialCache, CachedCredential
+from sign_count_writer import SignCountWriter, sign_count_update
+from assertion_batch import AssertionJob, split_jobs, verify_assertions
+from assertion_verifier import verify_assertion, public_key_cache
+from notification_bus import create_notification_bus
+from static_assets import StaticAsset, StaticBundle, STATIC_DIR, IMMUTABLE_CACHE_CONTROL
+from token_keys import TokenKeyring, JWT_ALGORITHM, JWT_ACCEPT_LEGACY_HS256, JWKS_MAX_AGE_SECONDS
+from token_cache import TokenCache, token_digest
+from qr_renderer import QRRenderer, QR_IMAGE_FORMAT, MEDIA_TYPES
+from rate_limiter import RateLimited, client_ip, create_rate_limiter
+from app_logging import configure_logging, log_event, request_id_var, stop_logging
+import app_logging
+import metrics
+from cognito_tokens import COGNITO_ENABLED, COGNITO_IDP, create_cognito_verifier, local_claims
+
+# JSON logs written by a background thread (see app_logging.py)
+configure_logging()
+logger = logging.getLogger(__name__)
 
 app = FastAPI(title="FIDO2 Passkey Auth API")
 
+# WebAuthn configuration (can be overridden by environment variables)
+RP_ID = os.getenv("RP_ID", "localhost")
+RP_ORIGINS = os.getenv("RP_ORIGINS", "http://localhost:3000,http://localhost").split(",")
+
+# Origins allowed to call the API from a browser. Credentialed requests (the frontend sends the
+# passkey_hint cookie) need them listed explicitly; defaults to the WebAuthn origins.
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", ",".join(RP_ORIGINS)).split(",") if o.strip()]
+
 # CORS configuration
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# WebAuthn configuration (can be overridden by environment variables)
-RP_ID = os.getenv("RP_ID", "localhost")
-RP_ORIGINS = os.getenv("RP_ORIGINS", "http://localhost:3000,http://localhost").split(",")
+
+REQUEST_ID_PATTERN = re.compile(r"^[\w.-]{1,64}$")
+
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    """Observe request latency labelled by route template (not raw path, to bound cardinality)
+
+    Also tags the request with an id (the caller's X-Request-ID if usable) that every log record
+    written while handling it carries, and that is echoed in the response.
+    """
+    request_id = request.headers.get("x-request-id", "")
+    if not REQUEST_ID_PATTERN.match(request_id):
+        request_id = uuid.uuid4().hex
+    request_id_var.set(request_id)
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        elapsed = time.perf_counter() - started
+        metrics.REQUEST_SECONDS.observe(elapsed, method=request.method, route=route_path, status=status)
+        log_event(
+            logger, "http.request", method=request.method, route=route_path, status=status,
+            duration_ms=round(elapsed * 1000, 2),
+        )
 
 # Base URL for QR code generation (can be overridden by environment variable)
 BASE_URL = os.getenv("BASE_URL", "http://localhost")
 
 # JWT Configuration
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
-ALGORITHM = "HS256"
+ALGORITHM = JWT_ALGORITHM
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
+# Trust the uid/name claims of our own signed tokens instead of re-reading the user row
+TRUST_TOKEN_CLAIMS = os.getenv("TRUST_TOKEN_CLAIMS", "true").lower() == "true"
+# How long a resolved identity (including its passkey count) is reused without touching the DB
+IDENTITY_CACHE_TTL_SECONDS = int(os.getenv("IDENTITY_CACHE_TTL_SECONDS", "60"))
+
+# Usernameless login runs in discoverable-credential mode (empty allowCredentials).
+# Clients may still send credential hints (body or device cookie); at most this many are echoed back.
+USERNAMELESS_HINT_LIMIT = int(os.getenv("USERNAMELESS_HINT_LIMIT", "10"))
+PASSKEY_HINT_COOKIE = "passkey_hint"
+PASSKEY_HINT_MAX_AGE = 60 * 60 * 24 * 365  # 1 year
+
+# Batch assertion verification for a trusted gateway; the endpoint is disabled while no key is set
+GATEWAY_API_KEY = os.getenv("GATEWAY_API_KEY")
+BATCH_ASSERTION_LIMIT = int(os.getenv("BATCH_ASSERTION_LIMIT", "100"))
 
 security = HTTPBearer()
 
-# Store active WebSocket connections, pending registrations, and challenges
-active_websockets: Dict[str, WebSocket] = {}
-pending_registrations: Dict[str, dict] = {}
-challenges: Dict[str, dict] = {}
+# Lifetime of issued WebAuthn challenges and QR registration sessions
+CHALLENGE_TTL_SECONDS = int(os.getenv("CHALLENGE_TTL_SECONDS", "300"))
+QR_SESSION_TTL_SECONDS = int(os.getenv("QR_SESSION_TTL_SECONDS", "300"))
+# Longest a long-poll status request is held; SSE streams send a keepalive this often
+QR_STATUS_MAX_WAIT_SECONDS = float(os.getenv("QR_STATUS_MAX_WAIT_SECONDS", "30"))
+QR_EVENTS_HEARTBEAT_SECONDS = float(os.getenv("QR_EVENTS_HEARTBEAT_SECONDS", "15"))
+QR_EVENTS_RETRY_MS = 3000
+# Cross-device (QR code + mobile page) registration; when off its routes are not mounted and qrcode/PIL never load
+QR_REGISTRATION_ENABLED = os.getenv("QR_REGISTRATION_ENABLED", "true").lower() == "true"
+
+# WebAuthn challenges travel to the client and back inside HMAC-sealed tokens, so any worker
+# (or replica) can finish a ceremony that another one started
+challenge_tokens = create_challenge_tokens(SECRET_KEY, CHALLENGE_TTL_SECONDS)
+
+# Pending QR registrations live in the configured session store (TTL + size cap)
+pending_registrations = create_session_store("qr", QR_SESSION_TTL_SECONDS)
+
+# Registration-complete events reach the WebSocket subscribers on whichever worker holds them
+notification_bus = create_notification_bus()
+
+# Verified access-token claims (keyed by token digest), so a token's signature is checked once per worker
+token_cache = TokenCache()
+# Digests of revoked tokens until they expire; revocations are also broadcast so every worker drops its cached copy.
+# Never evicted early (a forgotten revocation would make the token valid again): sized for TOKEN_REVOCATION_RATE
+# logouts per second over a token's lifetime, and logout fails with 503 when it is full.
+TOKEN_REVOCATION_RATE = float(os.getenv("TOKEN_REVOCATION_RATE", "10"))
+revoked_tokens = create_session_store(
+    "revoked", ACCESS_TOKEN_EXPIRE_MINUTES * 60, int(ACCESS_TOKEN_EXPIRE_MINUTES * 60 * TOKEN_REVOCATION_RATE)
+)
+TOKEN_REVOCATION_CHANNEL = "token-revocations"
+# Deleted passkeys are broadcast so every worker drops them from its credential and public key caches
+CREDENTIAL_DELETION_CHANNEL = "credential-deletions"
+# Tasks that keep this worker's caches in step with revocations and deletions on other workers
+cache_listeners: List[asyncio.Task] = []
+
+# bcrypt and WebAuthn verification run here instead of Starlette's shared threadpool / the event loop
+crypto_executor = CryptoExecutor()
+
+# credential_id -> decoded public key, owner and sign count for the login finish paths
+credential_cache = CredentialCache()
+
+# Sign counts from successful logins are coalesced in memory and written to the DB in batches
+sign_count_writer = SignCountWriter(SessionLocal)
+
+# user_id -> Identity with passkey_count, so /auth/me can be answered without a DB round trip
+identity_cache = MemorySessionStore(IDENTITY_CACHE_TTL_SECONDS)
+
+# Asymmetric access-token signing keys, published at /.well-known/jwks.json (None in HS256 mode)
+token_keyring = None
+if ALGORITHM != "HS256":
+    token_keyring = TokenKeyring(
+        token_ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        legacy_secret=SECRET_KEY if JWT_ACCEPT_LEGACY_HS256 else None,
+    )
+
+# Cognito access tokens are accepted too, verified against the user pool's JWKS (None when not configured)
+cognito_verifier = create_cognito_verifier()
+
+# Per-IP and per-username token buckets in front of the endpoints that do DB and crypto work (None when disabled)
+rate_limiter = create_rate_limiter()
+
+# QR code images, rendered off the request path and cached by (url, format)
+qr_renderer = QRRenderer() if QR_REGISTRATION_ENABLED else None
+
+# Mobile registration page shell and assets, loaded and precompressed once at startup
+mobile_static = StaticBundle(os.path.join(STATIC_DIR, "mobile"), "/mobile/static") if QR_REGISTRATION_ENABLED else None
+
+# Routes of the QR registration flow, mounted on the app only when it is enabled
+qr_router = APIRouter()
+
+# The Cognito routes module (and boto3 with it) is imported only when Cognito is enabled
+cognito_routes = None
+
+metrics.SESSION_STORE_ENTRIES.set_function(lambda: len(challenge_tokens), store="used_challenges")
+metrics.SESSION_STORE_ENTRIES.set_function(lambda: len(pending_registrations), store="pending_registrations")
+metrics.NOTIFICATION_SUBSCRIBERS.set_function(notification_bus.subscriber_count)
+metrics.CRYPTO_IN_FLIGHT.set_function(lambda: crypto_executor.in_flight)
 
 
 class UsernameRequest(BaseModel):
     username: str
 
 
+class UsernamelessStartRequest(BaseModel):
+    credential_ids: List[str] = []  # Optional hints, e.g. credentials recently used on this device
+
+
 class PasswordLoginRequest(BaseModel):
     username: str
     password: str
@@ -83,14 +235,14 @@ class CredentialResponse(BaseModel):
     username: Optional[str] = None  # Now optional - use authenticated user
     display_name: Optional[str] = None
     credential: dict
-    challenge: str
+    challenge_token: str  # Issued by the matching start endpoint
     session_id: Optional[str] = None
 
 
 class AssertionResponse(BaseModel):
     username: str
     assertion: dict
-    challenge: str
+    challenge_token: str  # Issued by the matching start endpoint
 
 
 class TokenResponse(BaseModel):
@@ -100,41 +252,345 @@ class TokenResponse(BaseModel):
     display_name: str
 
 
+@dataclass(frozen=True)
+class Identity:
+    """Authenticated user for the current request"""
+    user_id: int
+    username: str
+    display_name: str
+    passkey_count: Optional[int] = None  # None when not loaded yet
+
+
 # JWT Functions
+def create_identity_token(user_id: int, username: str, display_name: str) -> str:
+    """Access token carrying the claims get_identity needs to skip the user lookup"""
+    return create_access_token({"sub": username, "uid": user_id, "name": display_name})
+
+
 def create_access_token(data: dict):
     to_encode = data.copy()
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
+    if token_keyring is not None:
+        return token_keyring.encode(to_encode)
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Security(security)) -> str:
-    """Verify JWT token and return username"""
+def decode_access_token(token: str) -> dict:
+    """Verify an access token's signature and expiry and return its claims"""
+    if cognito_verifier is not None and cognito_verifier.issued(token):
+        return local_claims(cognito_verifier.decode(token))
+    if token_keyring is not None:
+        return token_keyring.decode(token)
+    return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+
+
+async def verify_token_claims(credentials: HTTPAuthorizationCredentials = Security(security)) -> dict:
+    """Verify JWT token and return its claims (cached until the token expires)"""
+    token = credentials.credentials
+    cached = token_cache.get(token)
+    if cached is not None:
+        return cached
+
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        return username
+        if cognito_verifier is not None and cognito_verifier.fetch_due(token):
+            # Fetching the Cognito JWKS is network I/O: keep it off the event loop
+            payload = await asyncio.to_thread(decode_access_token, token)
+        else:
+            payload = decode_access_token(token)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get("sub") is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if await revoked_tokens.aget(token_digest(token)) is not None:
+        raise HTTPException(status_code=401, detail="Token revoked")
+
+    token_cache.put(token, payload)
+    return payload
+
+
+async def revoke_token(token: str, claims: dict):
+    """Reject a token from now on, on every worker, until it would have expired anyway"""
+    digest = token_digest(token)
+    ttl = max(claims["exp"] - time.time(), 1)
+    try:
+        await revoked_tokens.aadd(digest, True, ttl=ttl)
+    except SessionStoreFull:
+        # Making room would forget a revocation that still matters; the token stays valid, so say so
+        log_event(logger, "auth.revocation_store_full", logging.WARNING, entries=revoked_tokens.max_entries)
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+    token_cache.invalidate_digest(digest)
+    notification_bus.publish(TOKEN_REVOCATION_CHANNEL, {"digest": digest})
+
+
+async def drop_revoked_tokens():
+    """Evict tokens revoked on other workers from this worker's token cache"""
+    async with notification_bus.subscribe(TOKEN_REVOCATION_CHANNEL) as subscription:
+        while True:
+            message = await subscription.get()
+            token_cache.invalidate_digest(message["digest"])
+
+
+def forget_credentials(user_id: int, credential_ids: List[str]):
+    """Drop deleted passkeys from this worker's caches"""
+    credential_cache.invalidate_user(user_id)
+    for credential_id in credential_ids:
+        credential_cache.invalidate(credential_id)
+        public_key_cache.invalidate(credential_id)
+    identity_cache.delete(user_id)
+
+
+async def drop_deleted_credentials():
+    """Evict passkeys deleted on other workers, so their cached copies stop verifying assertions"""
+    async with notification_bus.subscribe(CREDENTIAL_DELETION_CHANNEL) as subscription:
+        while True:
+            message = await subscription.get()
+            forget_credentials(message["user_id"], message["credential_ids"])
+
+
+def issue_challenge(challenge: bytes, ceremony: str, username: Optional[str] = None) -> str:
+    """Seal a freshly generated challenge (with its ceremony, user and expiry) into a challenge token"""
+    return challenge_tokens.issue(challenge, ceremony, username)
+
+
+def open_challenge(token: str, ceremony: str, username: Optional[str] = None) -> bytes:
+    """Open a challenge token and check it belongs to this ceremony; spend_challenge uses it up"""
+    try:
+        return challenge_tokens.open(token, ceremony, username)
+    except InvalidChallengeToken as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def spend_challenge(token: str):
+    """Use up a challenge token once its ceremony has succeeded, so it cannot be replayed
+
+    Spending only successful ceremonies keeps finish requests with junk assertions from filling the
+    replay record; a replayed ceremony still verifies, but only one of its copies can spend the token.
+    """
+    try:
+        await challenge_tokens.aspend(token)
+    except InvalidChallengeToken as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ReplayCacheFull:
+        # Forgetting a live token would let it be replayed; refuse until some expire
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+
+
+async def run_crypto(fn, *args, **kwargs):
+    """Run CPU-bound crypto on the dedicated executor; 503 when its queue is full"""
+    try:
+        return await crypto_executor.run(fn, *args, **kwargs)
+    except CryptoOverloaded:
+        raise HTTPException(status_code=503, detail="Server busy, please retry", headers={"Retry-After": "1"})
+
+
+async def load_credential(db: AsyncSession, credential_id: str) -> Optional[CachedCredential]:
+    """Resolve a credential and its owner, from the cache or with one joined query"""
+    cached = credential_cache.get(credential_id)
+    if cached is not None:
+        return cached
+
+    row = (await db.execute(
+        select(Passkey, User).join(User, Passkey.user_id == User.id).where(
+            Passkey.credential_id == credential_id
+        )
+    )).first()
+    if not row:
+        return None
+
+    return cache_credential(*row)
+
+
+async def load_credentials(db: AsyncSession, credential_ids: List[str]) -> Dict[str, CachedCredential]:
+    """Resolve many credentials: cache hits first, then one IN query for all the misses"""
+    found = {}
+    missing = []
+    for credential_id in dict.fromkeys(credential_ids):
+        cached = credential_cache.get(credential_id)
+        if cached is not None:
+            found[credential_id] = cached
+        else:
+            missing.append(credential_id)
+
+    if missing:
+        rows = await db.execute(
+            select(Passkey, User).join(User, Passkey.user_id == User.id).where(
+                Passkey.credential_id.in_(missing)
+            )
+        )
+        for passkey, user in rows:
+            found[passkey.credential_id] = cache_credential(passkey, user)
+    return found
+
+
+def cache_credential(passkey: Passkey, user: User) -> CachedCredential:
+    """Build the cached form of a passkey row and its owner"""
+    # A count still waiting in the write-behind buffer is newer than the stored one
+    pending_sign_count = sign_count_writer.current(passkey.credential_id)
+    credential = CachedCredential(
+        credential_id=passkey.credential_id,
+        public_key=base64url_to_bytes(passkey.public_key),
+        user_id=user.id,
+        username=user.username,
+        display_name=user.display_name,
+        sign_count=max(passkey.sign_count or 0, pending_sign_count or 0),
+    )
+    credential_cache.put(credential)
+    return credential
 
 
-def get_current_user(username: str = Depends(verify_token), db: Session = Depends(get_db)) -> User:
-    """Get current authenticated user"""
-    user = db.query(User).filter(User.username == username).first()
+def record_sign_count(credential_id: str, sign_count: int):
+    """Record a new sign count; it is written to the DB by the next batch flush"""
+    sign_count_writer.record(credential_id, sign_count)
+    credential_cache.update_sign_count(credential_id, sign_count)
+
+
+async def commit_sign_counts(db: AsyncSession, counts: Dict[str, int]):
+    """Write several sign counts in one transaction, bypassing the write-behind buffer"""
+    connection = await db.connection()
+    await connection.execute(*sign_count_update(counts))
+    await db.commit()
+    for credential_id, sign_count in counts.items():
+        credential_cache.update_sign_count(credential_id, sign_count)
+
+
+async def check_rate_limit(route: str, http_request: Request, username: Optional[str] = None):
+    """Reject callers over their budget (429) before any DB or crypto work"""
+    if rate_limiter is None:
+        return
+    peer = http_request.client.host if http_request.client else None
+    clients = {
+        "ip": client_ip(peer, http_request.headers.get("x-forwarded-for")),
+        "username": username.strip().lower()[:256] if username else None,
+    }
+    try:
+        if rate_limiter.blocking:
+            # A shared SQLite limiter may wait on the file lock: keep that off the event loop
+            await asyncio.to_thread(rate_limiter.check, route, **clients)
+        else:
+            rate_limiter.check(route, **clients)
+    except RateLimited as e:
+        metrics.RATE_LIMIT_REJECTIONS.inc(route=e.route, scope=e.scope)
+        raise HTTPException(
+            status_code=429, detail="Too many requests, please retry later",
+            headers={"Retry-After": str(math.ceil(e.retry_after))},
+        )
+
+
+def verify_gateway_key(x_gateway_key: Optional[str] = Header(None)):
+    """Only the configured gateway may call the batch endpoints"""
+    if not GATEWAY_API_KEY:
+        raise HTTPException(status_code=404, detail="Not found")
+    if not x_gateway_key or not secrets.compare_digest(x_gateway_key, GATEWAY_API_KEY):
+        raise HTTPException(status_code=401, detail="Invalid gateway key")
+
+
+async def get_identity(claims: dict = Depends(verify_token_claims), db: AsyncSession = Depends(get_async_db)) -> Identity:
+    """Resolve the caller once per request (FastAPI caches dependencies per request)"""
+    if claims.get("idp") == COGNITO_IDP:
+        return await linked_identity(claims, db)
+    if TRUST_TOKEN_CLAIMS and "uid" in claims and "name" in claims:
+        cached = identity_cache.get(claims["uid"])
+        if cached is not None:
+            return cached
+        return Identity(user_id=claims["uid"], username=claims["sub"], display_name=claims["name"])
+
+    # Tokens issued before uid/name claims existed need one lookup
+    user = await db.scalar(select(User).where(User.username == claims["sub"]))
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return user
+    identity = Identity(
+        user_id=user.id,
+        username=user.username,
+        display_name=user.display_name,
+        passkey_count=user.passkey_count,
+    )
+    identity_cache.set(user.id, identity)
+    return identity
+
+
+async def linked_identity(claims: dict, db: AsyncSession) -> Identity:
+    """Local account a Cognito user was linked to through POST /auth/cognito/link"""
+    user = await db.scalar(select(User).where(User.cognito_sub == claims["sub"]))
+    if not user:
+        raise HTTPException(status_code=403, detail="Cognito account is not linked to a local account")
+    return Identity(
+        user_id=user.id,
+        username=user.username,
+        display_name=user.display_name,
+        passkey_count=user.passkey_count,
+    )
+
+
+async def add_passkey(db: AsyncSession, passkey: Passkey):
+    """Insert a passkey and bump its owner's passkey_count in the same transaction"""
+    db.add(passkey)
+    await db.execute(
+        update(User).where(User.id == passkey.user_id).values(passkey_count=User.passkey_count + 1)
+    )
+    await db.commit()
+    credential_cache.invalidate(passkey.credential_id)
+    identity_cache.delete(passkey.user_id)
+
+
+def read_passkey_hints(http_request: Request, extra: Optional[List[str]] = None) -> List[str]:
+    """Collect credential ID hints from the request body and device cookie (deduplicated, capped)"""
+    candidates = list(extra or [])
+    candidates.extend(http_request.cookies.get(PASSKEY_HINT_COOKIE, "").split("."))
+
+    hints = []
+    for cid in candidates:
+        if cid and len(cid) <= 1024 and cid not in hints:
+            hints.append(cid)
+        if len(hints) >= USERNAMELESS_HINT_LIMIT:
+            break
+    return hints
+
+
+def remember_passkey(response: Response, http_request: Request, credential_id: str):
+    """Put a successfully used credential at the front of the device hint cookie"""
+    hints = [credential_id] + [cid for cid in read_passkey_hints(http_request) if cid != credential_id]
+    response.set_cookie(
+        PASSKEY_HINT_COOKIE,
+        ".".join(hints[:USERNAMELESS_HINT_LIMIT]),
+        max_age=PASSKEY_HINT_MAX_AGE,
+        httponly=True,
+        samesite="lax",
+    )
 
 
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    sign_count_writer.start()
+    cache_listeners.append(asyncio.create_task(drop_revoked_tokens()))
+    cache_listeners.append(asyncio.create_task(drop_deleted_credentials()))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for listener in cache_listeners:
+        listener.cancel()
+    for store in (pending_registrations, identity_cache, revoked_tokens):
+        store.close()
+    challenge_tokens.close()
+    notification_bus.close()
+    if rate_limiter is not None:
+        rate_limiter.close()
+    crypto_executor.shutdown()
+    if qr_renderer is not None:
+        qr_renderer.shutdown()
+    if cognito_routes is not None:
+        cognito_routes.shutdown()
+    await async_engine.dispose()
+    try:
+        sign_count_writer.stop()
+    except Exception as e:
+        log_event(logger, "sign_counts.flush_failed", logging.WARNING, error=str(e))
+    stop_logging()
 
 
 @app.get("/")
@@ -144,27 +600,62 @@ def read_root():
 
 @app.get("/health")
 def health_check():
-    return {"status": "healthy"}
+    return {
+        "status": "healthy",
+        "crypto_executor": crypto_executor.stats(),
+        "credential_cache": credential_cache.stats(),
+        "public_key_cache": public_key_cache.stats(),
+        "token_cache": token_cache.stats(),
+        "challenge_tokens": challenge_tokens.stats(),
+        "token_keys": token_keyring.stats() if token_keyring is not None else {"algorithm": ALGORITHM},
+        "qr_renderer": qr_renderer.stats() if qr_renderer is not None else None,
+        "cognito": cognito_routes.stats() if cognito_routes is not None else None,
+        "cognito_tokens": cognito_verifier.stats() if cognito_verifier is not None else None,
+        "rate_limiter": rate_limiter.stats() if rate_limiter is not None else None,
+        "logging": app_logging.stats(),
+        "sign_count_writer": sign_count_writer.stats(),
+        "db_pool": pool_stats(),
+    }
+
+
+_EMPTY_JWKS = {"keys": []}
+_jwks_asset = (None, None)
+
+
+@app.get("/.well-known/jwks.json")
+def jwks(http_request: Request):
+    """Public keys for verifying access tokens locally (empty in HS256 mode)"""
+    global _jwks_asset
+    document = token_keyring.jwks() if token_keyring is not None else _EMPTY_JWKS
+    if _jwks_asset[0] is not document:
+        _jwks_asset = (document, StaticAsset.build("jwks.json", json.dumps(document).encode("utf-8")))
+    return _jwks_asset[1].response(http_request, f"public, max-age={JWKS_MAX_AGE_SECONDS}")
+
+
+@app.get("/metrics")
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
 
 
 # Password authentication endpoints
 @app.post("/auth/password/login")
-def password_login(request: PasswordLoginRequest, db: Session = Depends(get_db)):
+async def password_login(request: PasswordLoginRequest, http_request: Request, db: AsyncSession = Depends(get_async_db)):
     """Login with username/password (fallback)"""
-    user = db.query(User).filter(User.username == request.username).first()
+    await check_rate_limit("password_login", http_request, request.username)
+    user = await db.scalar(select(User).where(User.username == request.username))
 
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
-    if not bcrypt.checkpw(request.password.encode('utf-8'), user.password_hash.encode('utf-8')):
+    if not await run_crypto(bcrypt.checkpw, request.password.encode('utf-8'), user.password_hash.encode('utf-8')):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
     # Check if user has passkeys
-    passkeys = db.query(Passkey).filter(Passkey.user_id == user.id).all()
-    has_passkey = len(passkeys) > 0
+    has_passkey = user.passkey_count > 0
 
     # Create JWT token
-    access_token = create_access_token({"sub": user.username})
+    access_token = create_identity_token(user.id, user.username, user.display_name)
 
     return {
         "access_token": access_token,
@@ -177,17 +668,11 @@ def password_login(request: PasswordLoginRequest, db: Session = Depends(get_db))
 
 # Passkey registration endpoints
 @app.post("/auth/register/start")
-def register_start(
+async def register_start(
     request: RegisterStartRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    user: Identity = Depends(get_identity)
 ):
     """Start WebAuthn registration - requires authentication"""
-    user = db.query(User).filter(User.username == current_user.username).first()
-
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     # Generate registration options
     options = generate_registration_options(
         rp_id=RP_ID,
@@ -215,6 +700,8 @@ def register_start(
         "timeout": options.timeout,
         "attestation": options.attestation,
         "authenticatorSelection": {
+            "residentKey": "preferred",
+            "requireResidentKey": False,
             "userVerification": "preferred",
         }
     }
@@ -225,27 +712,23 @@ def register_start(
 
     return {
         "challenge": bytes_to_base64url(options.challenge),
+        "challenge_token": issue_challenge(options.challenge, "registration", user.username),
         "options": options_dict
     }
 
 
 @app.post("/auth/register/finish")
-def register_finish(
+async def register_finish(
     request: CredentialResponse,
     http_request: Request,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    user: Identity = Depends(get_identity),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """Complete WebAuthn registration - requires authentication"""
     # Use authenticated user's username instead of request body
-    username = current_user.username
+    username = user.username
     credential = request.credential
-    challenge = base64url_to_bytes(request.challenge)
-
-    user = db.query(User).filter(User.username == current_user.username).first()
-
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    challenge = open_challenge(request.challenge_token, "registration", username)
 
     # Get actual origin from request headers
     origin = http_request.headers.get("origin", "")
@@ -266,20 +749,23 @@ def register_finish(
 
     try:
         # The webauthn library expects JSON-serialized credential
-        verification = verify_registration_response(
+        verification = await run_crypto(
+            verify_registration_response,
             credential=credential,
             expected_challenge=challenge,
             expected_rp_id=RP_ID,
             expected_origin=origin,
         )
 
+        await spend_challenge(request.challenge_token)
+
         # Get credential ID from the verified credential
         credential_id_bytes = verification.credential_id
         credential_id = bytes_to_base64url(credential_id_bytes)
 
         # Create new passkey record
         new_passkey = Passkey(
-            user_id=user.id,
+            user_id=user.user_id,
             credential_id=credential_id,
             public_key=bytes_to_base64url(verification.credential_public_key),
             sign_count=verification.sign_count,
@@ -287,33 +773,27 @@ def register_finish(
             name=request.display_name or "Registered Passkey",
             created_at=datetime.utcnow().isoformat()
         )
-        db.add(new_passkey)
-        db.commit()
+        await add_passkey(db, new_passkey)
 
         return {
             "message": "Passkey registered successfully",
             "credential_id": credential_id
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log_event(logger, "webauthn.registration.failed", logging.WARNING, exc_info=True, error=str(e))
         raise HTTPException(status_code=400, detail=f"Registration failed: {str(e)}")
 
 
 # Cross-device passkey registration with QR code
-@app.post("/auth/register/qr/start")
-def register_qr_start(
+@qr_router.post("/auth/register/qr/start")
+async def register_qr_start(
     request: QRRegisterRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    user: Identity = Depends(get_identity)
 ):
     """Start QR code registration for cross-device passkey"""
-    user = db.query(User).filter(User.username == current_user.username).first()
-
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     # Generate unique session ID
     session_id = str(uuid.uuid4())
 
@@ -328,8 +808,8 @@ def register_qr_start(
         authenticator_selection=None,
     )
 
-    # Store pending registration
-    pending_registrations[session_id] = {
+    # Store pending registration (expires after QR_SESSION_TTL_SECONDS)
+    await pending_registrations.aset(session_id, {
         "username": user.username,
         "display_name": request.display_name,
         "challenge": bytes_to_base64url(options.challenge),
@@ -347,43 +827,87 @@ def register_qr_start(
             "pubKeyCredParams": [{"type": "public-key", "alg": alg.alg} for alg in options.pub_key_cred_params],
             "timeout": options.timeout,
             "attestation": options.attestation,
+            "authenticatorSelection": {
+                "residentKey": "preferred",
+                "requireResidentKey": False,
+                "userVerification": "preferred",
+            },
         },
         "completed": False,
         "created_at": datetime.utcnow().isoformat()
-    }
-
-    # Generate QR code data (URL that mobile device will open)
-    # Point to backend endpoint where mobile registration page is hosted
-    # Use BASE_URL from environment variable for production deployment
-    qr_data = f"{BASE_URL}/mobile/register/{session_id}"
+    })
 
-    # Generate QR code image
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(qr_data)
-    qr.make(fit=True)
-
-    img = qr.make_image(fill_color="black", back_color="white")
-
-    # Convert to base64
-    buffer = io.BytesIO()
-    img.save(buffer, format='PNG')
-    qr_code_base64 = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    # Start rendering now so the image is usually cached before the browser asks for it
+    qr_data = mobile_register_url(session_id)
+    qr_renderer.prerender(qr_data)
 
     return {
         "session_id": session_id,
-        "qr_code": f"data:image/png;base64,{qr_code_base64}",
         "qr_data": qr_data,
-        "expires_in": 300  # 5 minutes
+        "qr_image_url": f"/auth/register/qr/{session_id}/image",
+        "expires_in": QR_SESSION_TTL_SECONDS
     }
 
 
-@app.get("/auth/register/qr/{session_id}")
-def get_qr_status(session_id: str):
-    """Get QR registration status (for polling)"""
-    if session_id not in pending_registrations:
+def mobile_register_url(session_id: str) -> str:
+    """URL encoded in the QR code: the mobile registration page on BASE_URL"""
+    return f"{BASE_URL}/mobile/register/{session_id}"
+
+
+def qr_channel(session_id: str) -> str:
+    """Notification bus channel for one QR registration session"""
+    return f"qr:{session_id}"
+
+
+@qr_router.get("/auth/register/qr/{session_id}/image")
+async def get_qr_image(session_id: str, http_request: Request, format: str = QR_IMAGE_FORMAT):
+    """QR code image for a pending registration (SVG or PNG), cacheable for the session lifetime"""
+    if format not in MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"Unsupported format, expected one of: {', '.join(MEDIA_TYPES)}")
+    if await pending_registrations.aget(session_id) is None:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    registration = pending_registrations[session_id]
+    image = await qr_renderer.get(mobile_register_url(session_id), format)
+    # The image for a session never changes, so browsers and proxies can keep it until the session expires
+    headers = {
+        "ETag": image.etag,
+        "Cache-Control": f"private, max-age={QR_SESSION_TTL_SECONDS}, immutable",
+    }
+    if http_request.headers.get("if-none-match") == image.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=image.body, media_type=image.media_type, headers=headers)
+
+
+def qr_seconds_left(registration: dict) -> float:
+    """Time until a pending registration expires (from its created_at)"""
+    age = datetime.utcnow() - datetime.fromisoformat(registration["created_at"])
+    return max(QR_SESSION_TTL_SECONDS - age.total_seconds(), 0.0)
+
+
+async def wait_for_qr_update(session_id: str, timeout: float) -> Optional[dict]:
+    """Return the registration once it completes or timeout passes (None if the session is gone)"""
+    # Subscribe before reading the session so a completion in between is not missed
+    async with notification_bus.subscribe(qr_channel(session_id)) as subscription:
+        registration = await pending_registrations.aget(session_id)
+        if registration is None or registration["completed"]:
+            return registration
+        try:
+            # Wake up at expiry too (with a small floor so an expiring session cannot spin)
+            await asyncio.wait_for(subscription.get(), max(min(timeout, qr_seconds_left(registration)), 0.1))
+        except asyncio.TimeoutError:
+            pass
+        return await pending_registrations.aget(session_id)
+
+
+@qr_router.get("/auth/register/qr/{session_id}")
+async def get_qr_status(session_id: str, wait: float = 0):
+    """Get QR registration status; with wait > 0, hold the request until it completes (long-poll)"""
+    if wait > 0:
+        registration = await wait_for_qr_update(session_id, min(wait, QR_STATUS_MAX_WAIT_SECONDS))
+    else:
+        registration = await pending_registrations.aget(session_id)
+    if registration is None:
+        raise HTTPException(status_code=404, detail="Session not found")
 
     return {
         "session_id": session_id,
@@ -392,244 +916,87 @@ def get_qr_status(session_id: str):
     }
 
 
-# Mobile-friendly endpoint for QR code registration
-@app.get("/mobile/register/{session_id}")
-def mobile_register_page(session_id: str):
-    """Mobile-friendly HTML page for completing registration"""
-    if session_id not in pending_registrations:
-        return JSONResponse(status_code=404, content={"error": "Session not found or expired"})
-
-    registration = pending_registrations[session_id]
-
-    if registration["completed"]:
-        return JSONResponse(content={"success": True, "message": "Registration completed!"})
-
-    # Return HTML page
-    html_content = r"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>Register Passkey</title>
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <style>
-            body {
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
-                margin: 0;
-                padding: 20px;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                min-height: 100vh;
-                display: flex;
-                align-items: center;
-                justify-content: center;
-            }
-            .container {
-                background: white;
-                border-radius: 16px;
-                padding: 30px;
-                max-width: 400px;
-                width: 100%;
-                box-shadow: 0 20px 60px rgba(0,0,0,0.3);
-            }
-            h1 {
-                color: #333;
-                margin-bottom: 10px;
-                font-size: 1.5rem;
-            }
-            p {
-                color: #666;
-                margin-bottom: 20px;
-            }
-            .user-info {
-                background: #f5f5f5;
-                padding: 15px;
-                border-radius: 8px;
-                margin-bottom: 20px;
-            }
-            .user-info p {
-                margin: 5px 0;
-            }
-            button {
-                width: 100%;
-                padding: 15px;
-                border: none;
-                border-radius: 8px;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                font-size: 16px;
-                font-weight: 600;
-                cursor: pointer;
-            }
-            button:hover {
-                transform: translateY(-2px);
-                box-shadow: 0 5px 20px rgba(102, 126, 234, 0.4);
-            }
-            button:disabled {
-                opacity: 0.6;
-                cursor: not-allowed;
-            }
-            .success {
-                color: #28a745;
-                text-align: center;
-                padding: 20px;
-            }
-            .error {
-                color: #dc3545;
-                text-align: center;
-                padding: 20px;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>Register Passkey</h1>
-            <div class="user-info">
-                <p><strong>Username:</strong> """ + registration['username'] + r"""</p>
-                <p><strong>Display Name:</strong> """ + registration['display_name'] + r"""</p>
-            </div>
-            <p>Tap the button below to register a passkey on this device.</p>
-            <button id="registerBtn" onclick="registerPasskey()">Register Passkey</button>
-            <div id="result"></div>
-        </div>
-
-        <script>
-            const sessionId = '""" + session_id + r"""';
-            const options = """ + json.dumps(registration['options']) + r""";
-
-            function base64urlToBytes(base64url) {
-                const padding = '='.repeat((4 - (base64url.length % 4)) % 4);
-                const base64 = (base64url + padding).replace(/-/g, '+').replace(/_/g, '/');
-                const binaryString = atob(base64);
-                const bytes = new Uint8Array(binaryString.length);
-                for (let i = 0; i < binaryString.length; i++) {
-                    bytes[i] = binaryString.charCodeAt(i);
-                }
-                return bytes;
-            }
-
-            function bytesToBase64url(bytes) {
-                let binary = '';
-                for (const byte of bytes) {
-                    binary += String.fromCharCode(byte);
-                }
-                return btoa(binary)
-                    .replace(/\+/g, '-')
-                    .replace(/\//g, '_')
-                    .replace(/=/g, '');
-            }
-
-            // Check WebAuthn support and HTTPS requirement
-            function checkWebAuthnSupport() {
-                const resultDiv = document.getElementById('result');
-
-                // Check if WebAuthn is available
-                if (!window.navigator || !window.navigator.credentials) {
-                    resultDiv.innerHTML = '<div class="error">⚠️ Your browser does not support WebAuthn. Please use a modern browser like Safari (iOS 16.3+), Chrome, or Firefox.</div>';
-                    return false;
-                }
-
-                // Check if served over HTTPS (required for WebAuthn)
-                const isHttps = window.location.protocol === 'https:';
-                const isLocalhost = window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1';
-
-                if (!isHttps && !isLocalhost) {
-                    resultDiv.innerHTML = '<div class="error">⚠️ WebAuthn requires HTTPS. This page is served over HTTP. Please access this page via HTTPS or localhost.</div>';
-                    return false;
-                }
-
-                return true;
-            }
+@qr_router.get("/auth/register/qr/{session_id}/events")
+async def qr_status_events(session_id: str):
+    """Server-Sent Events stream of QR registration status: waiting, then completed or expired"""
+    registration = await pending_registrations.aget(session_id)
+    if registration is None:
+        raise HTTPException(status_code=404, detail="Session not found")
 
-            // Check WebAuthn support on page load
-            window.addEventListener('DOMContentLoaded', function() {
-                checkWebAuthnSupport();
-            });
+    def event(name: str, data: dict) -> str:
+        return f"event: {name}\ndata: {json.dumps(data)}\n\n"
 
-            async function registerPasskey() {
-                const btn = document.getElementById('registerBtn');
-                const result = document.getElementById('result');
+    async def stream():
+        yield f"retry: {QR_EVENTS_RETRY_MS}\n" + event("waiting", {"session_id": session_id})
+        while True:
+            current = await wait_for_qr_update(session_id, QR_EVENTS_HEARTBEAT_SECONDS)
+            if current is None:
+                yield event("expired", {"session_id": session_id})
+                return
+            if current["completed"]:
+                yield event("completed", {"session_id": session_id, "message": "Passkey registered successfully!"})
+                return
+            # Comment line keeps proxies from closing an idle connection
+            yield ": keepalive\n\n"
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-                // Check requirements before proceeding
-                if (!checkWebAuthnSupport()) {
-                    btn.disabled = true;
-                    btn.textContent = 'Not Supported';
-                    return;
-                }
 
-                btn.disabled = true;
-                btn.textContent = 'Registering...';
-
-                try {
-                    const credential = await navigator.credentials.create({
-                        publicKey: {
-                            challenge: base64urlToBytes(options.challenge),
-                            rp: options.rp,
-                            user: {
-                                id: base64urlToBytes(options.user.id),
-                                name: options.user.name,
-                                displayName: options.user.displayName,
-                            },
-                            pubKeyCredParams: options.pubKeyCredParams,
-                            timeout: options.timeout,
-                            attestation: options.attestation,
-                            authenticatorSelection: options.authenticatorSelection,
-                        },
-                    });
-
-                    const credentialData = {
-                        id: credential.id,
-                        rawId: bytesToBase64url(new Uint8Array(credential.rawId)),
-                        type: credential.type,
-                        response: {
-                            clientDataJSON: bytesToBase64url(new Uint8Array(credential.response.clientDataJSON)),
-                            attestationObject: bytesToBase64url(new Uint8Array(credential.response.attestationObject)),
-                        },
-                    };
-
-                    const response = await fetch('/api/mobile/register/finish/' + sessionId, {
-                        method: 'POST',
-                        headers: { 'Content-Type': 'application/json' },
-                        body: JSON.stringify(credentialData)
-                    });
-
-                    if (response.ok) {
-                        result.innerHTML = '<div class="success">✓ Passkey registered successfully!<br><br>You can close this page.</div>';
-                        btn.style.display = 'none';
-                    } else {
-                        const error = await response.json();
-                        result.innerHTML = '<div class="error">✗ Registration failed: ' + (error.detail || 'Unknown error') + '</div>';
-                        btn.disabled = false;
-                        btn.textContent = 'Try Again';
-                    }
-                } catch (error) {
-                    result.innerHTML = '<div class="error">✗ Error: ' + error.message + '</div>';
-                    btn.disabled = false;
-                    btn.textContent = 'Try Again';
-                }
-            }
-        </script>
-    </body>
-    </html>
-    """
+# Mobile-friendly endpoint for QR code registration
+@qr_router.get("/mobile/register/{session_id}")
+def mobile_register_page(session_id: str, http_request: Request):
+    """Mobile registration page: one static shell for every session (session data comes from the bootstrap)"""
+    # The shell lives at a per-session URL, so it is revalidated by ETag rather than cached blindly
+    return mobile_static.page("register.html").response(http_request, "no-cache")
+
+
+@qr_router.get("/mobile/static/{name}")
+def mobile_static_asset(name: str, http_request: Request):
+    """Fingerprinted, precompressed JS/CSS for the mobile page"""
+    asset = mobile_static.asset(name)
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return asset.response(http_request, IMMUTABLE_CACHE_CONTROL)
+
+
+@qr_router.get("/api/mobile/register/{session_id}/bootstrap")
+def mobile_register_bootstrap(session_id: str):
+    """Per-session data for the mobile page: who is registering and the WebAuthn options"""
+    registration = pending_registrations.get(session_id)
+    if registration is None:
+        raise HTTPException(status_code=404, detail="Session not found or expired")
 
-    from fastapi.responses import HTMLResponse
-    return HTMLResponse(content=html_content)
+    return JSONResponse(
+        content={
+            "session_id": session_id,
+            "username": registration["username"],
+            "display_name": registration["display_name"],
+            "completed": registration["completed"],
+            "options": None if registration["completed"] else registration["options"],
+        },
+        headers={"Cache-Control": "no-store"},
+    )
 
 
-@app.post("/api/mobile/register/finish/{session_id}")
-async def mobile_register_finish(session_id: str, credential: dict, http_request: Request, db: Session = Depends(get_db)):
+@qr_router.post("/api/mobile/register/finish/{session_id}")
+async def mobile_register_finish(session_id: str, credential: dict, http_request: Request, db: AsyncSession = Depends(get_async_db)):
     """Complete registration from mobile device"""
-    if session_id not in pending_registrations:
+    await check_rate_limit("mobile_register_finish", http_request)
+    registration = await pending_registrations.aget(session_id)
+    if registration is None:
         raise HTTPException(status_code=404, detail="Session not found or expired")
 
-    registration = pending_registrations[session_id]
-
     if registration["completed"]:
         raise HTTPException(status_code=400, detail="Registration already completed")
 
     username = registration["username"]
     challenge = base64url_to_bytes(registration["challenge"])
 
-    user = db.query(User).filter(User.username == username).first()
+    user = await db.scalar(select(User).where(User.username == username))
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -653,7 +1020,8 @@ async def mobile_register_finish(session_id: str, credential: dict, http_request
 
     try:
         # Verify registration
-        verification = verify_registration_response(
+        verification = await run_crypto(
+            verify_registration_response,
             credential=credential,
             expected_challenge=challenge,
             expected_rp_id=RP_ID,
@@ -674,77 +1042,89 @@ async def mobile_register_finish(session_id: str, credential: dict, http_request
             name=registration.get("display_name", "Mobile Passkey"),
             created_at=datetime.utcnow().isoformat()
         )
-        db.add(new_passkey)
-        db.commit()
+        await add_passkey(db, new_passkey)
 
-        # Mark as completed
+        # Mark as completed (the session keeps its original expiry)
         registration["completed"] = True
+        await pending_registrations.aset(session_id, registration, keep_ttl=True)
 
-        # Notify via WebSocket if connected
-        if session_id in active_websockets:
-            websocket = active_websockets[session_id]
-            try:
-                await websocket.send_json({"success": True, "message": "Passkey registered successfully!"})
-            except:
-                pass
+        # Notify every WebSocket watching this session, on any worker
+        notification_bus.publish(qr_channel(session_id), {
+            "success": True,
+            "status": "completed",
+            "message": "Passkey registered successfully!"
+        })
 
         return {
             "success": True,
             "message": "Passkey registered successfully"
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log_event(logger, "webauthn.registration.failed", logging.WARNING, exc_info=True, error=str(e))
         raise HTTPException(status_code=400, detail=f"Registration failed: {str(e)}")
 
 
 # WebSocket endpoint for QR registration
-@app.websocket("/ws/register/{session_id}")
+@qr_router.websocket("/ws/register/{session_id}")
 async def websocket_register(websocket: WebSocket, session_id: str):
     """WebSocket endpoint for real-time updates during QR registration"""
     await websocket.accept()
-    active_websockets[session_id] = websocket
+    completed = {"status": "completed", "message": "Passkey registered successfully!"}
+
+    # Subscribe before checking the session so a completion in between is not missed
+    async with notification_bus.subscribe(qr_channel(session_id)) as subscription:
+        listener = asyncio.ensure_future(subscription.get())
+        receiver = None
+        try:
+            registration = await pending_registrations.aget(session_id)
+            if registration is not None:
+                if registration["completed"]:
+                    await websocket.send_json(completed)
+                    return
+                # Send initial status
+                await websocket.send_json({
+                    "status": "waiting",
+                    "message": "Waiting for passkey registration..."
+                })
+
+            # Wait for the completion event; client messages act as status checks
+            receiver = asyncio.ensure_future(websocket.receive_text())
+            while True:
+                done, _ = await asyncio.wait({listener, receiver}, return_when=asyncio.FIRST_COMPLETED)
+                if listener in done:
+                    await websocket.send_json(listener.result())
+                    break
 
-    try:
-        # Send initial status
-        if session_id in pending_registrations:
-            await websocket.send_json({
-                "status": "waiting",
-                "message": "Waiting for passkey registration..."
-            })
-
-        # Keep connection alive and listen for messages
-        while True:
-            data = await websocket.receive_text()
-
-            # Check if registration is completed
-            if session_id in pending_registrations:
-                if pending_registrations[session_id]["completed"]:
-                    await websocket.send_json({
-                        "status": "completed",
-                        "message": "Passkey registered successfully!"
-                    })
+                receiver.result()
+                registration = await pending_registrations.aget(session_id)
+                if registration is not None and registration["completed"]:
+                    await websocket.send_json(completed)
                     break
+                receiver = asyncio.ensure_future(websocket.receive_text())
 
-    except WebSocketDisconnect:
-        pass
-    finally:
-        if session_id in active_websockets:
-            del active_websockets[session_id]
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in (listener, receiver):
+                if task is not None:
+                    task.cancel()
 
 
 # Passkey authentication endpoints
 @app.post("/auth/login/start")
-def login_start(request: UsernameRequest, db: Session = Depends(get_db)):
+async def login_start(request: UsernameRequest, http_request: Request, db: AsyncSession = Depends(get_async_db)):
     """Start WebAuthn authentication"""
-    user = db.query(User).filter(User.username == request.username).first()
+    await check_rate_limit("login_start", http_request, request.username)
+    user = await db.scalar(select(User).where(User.username == request.username))
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
     # Get user's passkeys from Passkey table
-    passkeys = db.query(Passkey).filter(Passkey.user_id == user.id).all()
+    passkeys = (await db.scalars(select(Passkey).where(Passkey.user_id == user.id))).all()
 
     if not passkeys:
         raise HTTPException(status_code=400, detail="No passkey registered. Please register a passkey first.")
@@ -780,43 +1160,29 @@ def login_start(request: UsernameRequest, db: Session = Depends(get_db)):
 
     return {
         "challenge": bytes_to_base64url(options.challenge),
+        "challenge_token": issue_challenge(options.challenge, "authentication", user.username),
         "options": options_dict
     }
 
 
 @app.post("/auth/login/finish")
-def login_finish(request: AssertionResponse, http_request: Request, db: Session = Depends(get_db)):
+async def login_finish(request: AssertionResponse, http_request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
     """Complete WebAuthn authentication"""
+    await check_rate_limit("login_finish", http_request, request.username)
     username = request.username
     assertion = request.assertion
-    challenge = base64url_to_bytes(request.challenge)
-
-    user = db.query(User).filter(User.username == username).first()
-
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+    challenge = open_challenge(request.challenge_token, "authentication", username)
 
     # Get credential ID from assertion
     credential_id = assertion.get("id", "")
 
     if not credential_id:
         raise HTTPException(status_code=400, detail="Credential ID missing in assertion")
-    
-    # ... (rest of local login_finish logic) ...
-    # Note: Cutting short here to append Cognito logic below, will need to be careful with line matching.
-    # Actually, it's better to append the new Cognito code at the END of the file or in a cleaner block.
-    # Let me re-read the file to append correctly instead of replacing a huge chunk and potentially missing "rest of function".
-    # I will cancel this replace and do a cleaner append or insert.
-
-        raise HTTPException(status_code=400, detail="Invalid assertion: missing credential ID")
 
-    # Find passkey by credential_id
-    passkey = db.query(Passkey).filter(
-        Passkey.credential_id == credential_id,
-        Passkey.user_id == user.id
-    ).first()
+    # Find passkey (and its owner) by credential_id
+    credential = await load_credential(db, credential_id)
 
-    if not passkey:
+    if not credential or credential.username != username:
         raise HTTPException(status_code=404, detail="Passkey not found")
 
     # Get actual origin from request headers
@@ -838,83 +1204,92 @@ def login_finish(request: AssertionResponse, http_request: Request, db: Session
 
     try:
         # The webauthn library expects JSON-serialized assertion
-        verification = verify_authentication_response(
+        verification = await run_crypto(
+            verify_assertion,
             credential=assertion,
             expected_challenge=challenge,
             expected_rp_id=RP_ID,
             expected_origin=origin,
-            credential_public_key=base64url_to_bytes(passkey.public_key),
-            credential_current_sign_count=passkey.sign_count,
+            credential_public_key=credential.public_key,
+            credential_current_sign_count=credential.sign_count,
         )
+        await spend_challenge(request.challenge_token)
 
         # Update sign count
-        passkey.sign_count = verification.new_sign_count
-        db.commit()
+        record_sign_count(credential_id, verification.new_sign_count)
+
+        # Remember this credential as a hint for the next usernameless login on this device
+        remember_passkey(response, http_request, credential_id)
 
         # Create JWT token
-        access_token = create_access_token({"sub": user.username})
+        access_token = create_identity_token(credential.user_id, credential.username, credential.display_name)
 
         return {
             "access_token": access_token,
             "token_type": "bearer",
             "message": "Authentication successful",
-            "username": user.username,
-            "display_name": user.display_name
+            "username": credential.username,
+            "display_name": credential.display_name
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log_event(logger, "webauthn.login.failed", logging.WARNING, exc_info=True, error=str(e))
         raise HTTPException(status_code=400, detail=f"Authentication failed: {str(e)}")
 
 
 # Usernameless authentication endpoints
 @app.post("/auth/login/usernameless/start")
-def login_usernameless_start(db: Session = Depends(get_db)):
+async def login_usernameless_start(
+    http_request: Request,
+    request: Optional[UsernamelessStartRequest] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
     """Start usernameless WebAuthn authentication - no username required"""
-    # Get all registered passkeys for allowCredentials list
-    passkeys = db.query(Passkey).all()
-
-    if not passkeys:
-        raise HTTPException(status_code=400, detail="No passkeys registered yet")
+    await check_rate_limit("usernameless_start", http_request)
+    # Discoverable-credential mode: the authenticator offers its resident keys, so the
+    # server does not enumerate credentials. Only hinted credentials (capped) are echoed.
+    hints = read_passkey_hints(http_request, request.credential_ids if request else None)
+
+    allow_credential_ids = []
+    if hints:
+        rows = await db.scalars(
+            select(Passkey.credential_id).where(
+                Passkey.credential_id.in_(hints)
+            ).limit(USERNAMELESS_HINT_LIMIT)
+        )
+        known = set(rows.all())
+        allow_credential_ids = [cid for cid in hints if cid in known]
 
     from webauthn.helpers.structs import PublicKeyCredentialDescriptor
 
-    # Create allowCredentials list from all passkeys
-    allow_credentials = [
-        PublicKeyCredentialDescriptor(
-            id=base64url_to_bytes(pk.credential_id),
-            type="public-key"
-        )
-        for pk in passkeys
-    ]
-
     # Generate authentication options
     options = generate_authentication_options(
         rp_id=RP_ID,
-        allow_credentials=allow_credentials,
+        allow_credentials=[
+            PublicKeyCredentialDescriptor(
+                id=base64url_to_bytes(cid),
+                type="public-key"
+            )
+            for cid in allow_credential_ids
+        ],
         user_verification="preferred",
     )
 
-    # Store challenge in session (using in-memory for demo)
-    # In production, use Redis or proper session store
-    challenges[bytes_to_base64url(options.challenge)] = {
-        "challenge": options.challenge,
-        "timestamp": datetime.utcnow().isoformat()
-    }
-
     return {
         "challenge": bytes_to_base64url(options.challenge),
+        "challenge_token": issue_challenge(options.challenge, "authentication"),
         "options": {
             "challenge": bytes_to_base64url(options.challenge),
             "rpId": options.rp_id,
             "timeout": options.timeout,
             "allowCredentials": [
                 {
-                    "id": pk.credential_id,
+                    "id": cid,
                     "type": "public-key"
                 }
-                for pk in passkeys
+                for cid in allow_credential_ids
             ],
             "userVerification": (options.user_verification if isinstance(options.user_verification, str) else options.user_verification.value) if options.user_verification else "preferred"
         }
@@ -923,14 +1298,15 @@ def login_usernameless_start(db: Session = Depends(get_db)):
 
 class AssertionResponseUsernameless(BaseModel):
     assertion: dict
-    challenge: str
+    challenge_token: str  # Issued by the matching start endpoint
 
 
 @app.post("/auth/login/usernameless/finish")
-def login_usernameless_finish(request: AssertionResponseUsernameless, http_request: Request, db: Session = Depends(get_db)):
+async def login_usernameless_finish(request: AssertionResponseUsernameless, http_request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
     """Complete usernameless WebAuthn authentication"""
+    await check_rate_limit("usernameless_finish", http_request)
     assertion = request.assertion
-    challenge = base64url_to_bytes(request.challenge)
+    challenge = open_challenge(request.challenge_token, "authentication")
 
     # Get credential ID from assertion
     credential_id = assertion.get("id", "")
@@ -939,16 +1315,11 @@ def login_usernameless_finish(request: AssertionResponseUsernameless, http_reque
         raise HTTPException(status_code=400, detail="Invalid assertion: missing credential ID")
 
     # Find passkey and user by credential ID
-    passkey = db.query(Passkey).filter(Passkey.credential_id == credential_id).first()
+    credential = await load_credential(db, credential_id)
 
-    if not passkey:
+    if not credential:
         raise HTTPException(status_code=404, detail="Passkey not found")
 
-    user = db.query(User).filter(User.id == passkey.user_id).first()
-
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-
     # Get actual origin from request headers
     origin = http_request.headers.get("origin", "")
     if not origin:
@@ -968,42 +1339,139 @@ def login_usernameless_finish(request: AssertionResponseUsernameless, http_reque
 
     try:
         # Verify authentication
-        verification = verify_authentication_response(
+        verification = await run_crypto(
+            verify_assertion,
             credential=assertion,
             expected_challenge=challenge,
             expected_rp_id=RP_ID,
             expected_origin=origin,
-            credential_public_key=base64url_to_bytes(passkey.public_key),
-            credential_current_sign_count=passkey.sign_count,
+            credential_public_key=credential.public_key,
+            credential_current_sign_count=credential.sign_count,
         )
+        await spend_challenge(request.challenge_token)
 
         # Update sign count
-        passkey.sign_count = verification.new_sign_count
-        db.commit()
+        record_sign_count(credential_id, verification.new_sign_count)
+
+        # Remember this credential as a hint for the next usernameless login on this device
+        remember_passkey(response, http_request, credential_id)
 
         # Create JWT token
-        access_token = create_access_token({"sub": user.username})
+        access_token = create_identity_token(credential.user_id, credential.username, credential.display_name)
 
         return {
             "access_token": access_token,
             "token_type": "bearer",
             "message": "Authentication successful",
-            "username": user.username,
-            "display_name": user.display_name
+            "username": credential.username,
+            "display_name": credential.display_name
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log_event(logger, "webauthn.login.failed", logging.WARNING, exc_info=True, error=str(e))
         raise HTTPException(status_code=400, detail=f"Authentication failed: {str(e)}")
 
 
+class BatchAssertionItem(BaseModel):
+    assertion: dict
+    challenge_token: str  # Issued by the matching start endpoint
+    username: Optional[str] = None  # None for usernameless challenges
+
+
+class BatchAssertionRequest(BaseModel):
+    items: List[BatchAssertionItem]
+
+
+@app.post("/auth/login/batch", dependencies=[Depends(verify_gateway_key)])
+async def login_batch(request: BatchAssertionRequest, db: AsyncSession = Depends(get_async_db)):
+    """Verify many assertions for the gateway: per-item results, one sign-count transaction"""
+    if len(request.items) > BATCH_ASSERTION_LIMIT:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_ASSERTION_LIMIT} assertions per batch")
+
+    results: List[Optional[dict]] = [None] * len(request.items)
+
+    def fail(index: int, status: int, detail: str):
+        results[index] = {"index": index, "success": False, "status": status, "detail": detail}
+
+    # Challenges are checked up front but only spent by the items that verify
+    accepted = []
+    for index, item in enumerate(request.items):
+        credential_id = item.assertion.get("id", "")
+        if not credential_id:
+            fail(index, 400, "Credential ID missing in assertion")
+            continue
+        try:
+            challenge = open_challenge(item.challenge_token, "authentication", item.username)
+        except HTTPException as e:
+            fail(index, e.status_code, e.detail)
+            continue
+        accepted.append((index, item, credential_id, challenge))
+
+    credentials = await load_credentials(db, [credential_id for _, _, credential_id, _ in accepted])
+
+    jobs = []
+    for index, item, credential_id, challenge in accepted:
+        credential = credentials.get(credential_id)
+        if not credential or (item.username is not None and credential.username != item.username):
+            fail(index, 404, "Passkey not found")
+            continue
+        jobs.append(AssertionJob(
+            index=index,
+            credential_id=credential_id,
+            assertion=item.assertion,
+            challenge=challenge,
+            public_key=credential.public_key,
+            sign_count=credential.sign_count,
+        ))
+
+    # One executor job per chunk, so a batch uses every crypto worker without flooding the queue
+    chunks = split_jobs(jobs, crypto_executor.workers)
+    outcomes = await asyncio.gather(*(run_crypto(verify_assertions, chunk, RP_ID, RP_ORIGINS) for chunk in chunks))
+
+    verified = []
+    sign_counts: Dict[str, int] = {}
+    for outcome in itertools.chain.from_iterable(outcomes):
+        if outcome.error is not None:
+            fail(outcome.index, 400, f"Authentication failed: {outcome.error}")
+            continue
+        try:
+            await spend_challenge(request.items[outcome.index].challenge_token)
+        except HTTPException as e:
+            fail(outcome.index, e.status_code, e.detail)
+            continue
+        verified.append(outcome)
+        if outcome.new_sign_count:
+            sign_counts[outcome.credential_id] = max(sign_counts.get(outcome.credential_id, 0), outcome.new_sign_count)
+
+    if sign_counts:
+        await commit_sign_counts(db, sign_counts)
+
+    for outcome in verified:
+        credential = credentials[outcome.credential_id]
+        results[outcome.index] = {
+            "index": outcome.index,
+            "success": True,
+            "access_token": create_identity_token(credential.user_id, credential.username, credential.display_name),
+            "token_type": "bearer",
+            "username": credential.username,
+            "display_name": credential.display_name,
+        }
+
+    return {
+        "results": results,
+        "succeeded": len(verified),
+        "failed": len(results) - len(verified),
+    }
+
+
 # Passkey management endpoints
 @app.get("/auth/passkeys")
-def list_passkeys(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def list_passkeys(current_user: Identity = Depends(get_identity), db: AsyncSession = Depends(get_async_db)):
     """List all passkeys for current user"""
     # Get all passkeys for current user
-    passkeys = db.query(Passkey).filter(Passkey.user_id == current_user.id).all()
+    passkeys = (await db.scalars(select(Passkey).where(Passkey.user_id == current_user.user_id))).all()
 
     return {
         "username": current_user.username,
@@ -1021,11 +1489,20 @@ def list_passkeys(current_user: User = Depends(get_current_user), db: Session =
 
 
 @app.delete("/auth/passkeys")
-def delete_passkey(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def delete_passkey(current_user: Identity = Depends(get_identity), db: AsyncSession = Depends(get_async_db)):
     """Delete all passkeys for current user"""
     # Delete all passkeys for current user
-    deleted_count = db.query(Passkey).filter(Passkey.user_id == current_user.id).delete()
-    db.commit()
+    result = await db.execute(
+        delete(Passkey).where(Passkey.user_id == current_user.user_id).returning(Passkey.credential_id)
+    )
+    deleted_ids = result.scalars().all()
+    await db.execute(update(User).where(User.id == current_user.user_id).values(passkey_count=0))
+    await db.commit()
+    deleted_count = len(deleted_ids)
+    forget_credentials(current_user.user_id, deleted_ids)
+    notification_bus.publish(
+        CREDENTIAL_DELETION_CHANNEL, {"user_id": current_user.user_id, "credential_ids": deleted_ids}
+    )
 
     if deleted_count == 0:
         raise HTTPException(status_code=404, detail="No passkeys found")
@@ -1036,9 +1513,9 @@ def delete_passkey(current_user: User = Depends(get_current_user), db: Session =
 
 
 @app.get("/auth/user/{username}")
-def get_user(username: str, db: Session = Depends(get_db)):
+async def get_user(username: str, db: AsyncSession = Depends(get_async_db)):
     """Get user info (public endpoint)"""
-    user = db.query(User).filter(User.username == username).first()
+    user = await db.scalar(select(User).where(User.username == username))
 
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -1046,314 +1523,84 @@ def get_user(username: str, db: Session = Depends(get_db)):
     return {
         "username": user.username,
         "display_name": user.display_name,
-        "has_passkey": len(db.query(Passkey).filter(Passkey.user_id == user.id).all()) > 0
+        "has_passkey": user.passkey_count > 0
     }
 
 
 @app.get("/auth/me")
-def get_me(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def get_me(current_user: Identity = Depends(get_identity), db: AsyncSession = Depends(get_async_db)):
     """Get current authenticated user info"""
-    # Check if user has passkeys
-    has_passkey = len(db.query(Passkey).filter(Passkey.user_id == current_user.id).all()) > 0
+    # Check if user has passkeys (from the cached identity when available)
+    if current_user.passkey_count is None:
+        passkey_count = await db.scalar(select(User.passkey_count).where(User.id == current_user.user_id))
+        if passkey_count is None:
+            raise HTTPException(status_code=404, detail="User not found")
+        current_user = replace(current_user, passkey_count=passkey_count)
+        identity_cache.set(current_user.user_id, current_user)
+
     return {
         "username": current_user.username,
         "display_name": current_user.display_name,
-        "has_passkey": has_passkey
+        "has_passkey": current_user.passkey_count > 0
     }
 
 
-# ==========================================
-# AWS Cognito Integration
-# ==========================================
-
-# Cognito Configuration
-COGNITO_USER_POOL_ID = os.getenv("COGNITO_USER_POOL_ID")
-COGNITO_CLIENT_ID = os.getenv("COGNITO_CLIENT_ID")
-COGNITO_CLIENT_SECRET = os.getenv("COGNITO_CLIENT_SECRET")
-COGNITO_REGION = os.getenv("COGNITO_REGION")
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-
-# Initialize Cognito Client
-try:
-    if AWS_ACCESS_KEY_ID and AWS_SECRET_ACCESS_KEY:
-        cognito_client = boto3.client(
-            'cognito-idp',
-            region_name=COGNITO_REGION,
-            aws_access_key_id=AWS_ACCESS_KEY_ID,
-            aws_secret_access_key=AWS_SECRET_ACCESS_KEY
-        )
-    else:
-        # Use role-based authentication or default profile
-        cognito_client = boto3.client('cognito-idp', region_name=COGNITO_REGION)
-except Exception as e:
-    print(f"Warning: Failed to initialize Cognito client: {e}")
-    cognito_client = None
-
-
-import hmac
-import hashlib
-
-def get_secret_hash(username, client_id, client_secret):
-    msg = username + client_id
-    dig = hmac.new(str(client_secret).encode('utf-8'), 
-                   msg = str(msg).encode('utf-8'), digestmod=hashlib.sha256).digest()
-    d2 = base64.b64encode(dig).decode()
-    return d2
-
-
-class CognitoLoginRequest(BaseModel):
-    username: str
-    password: str
-
-
-class CognitoRegisterStartRequest(BaseModel):
-    access_token: str
-
-
-class CognitoRegisterFinishRequest(BaseModel):
-    access_token: str
-    credential: dict
-
-
-class CognitoLoginStartRequest(BaseModel):
-    username: str
+@app.post("/auth/logout")
+async def logout(
+    credentials: HTTPAuthorizationCredentials = Security(security),
+    claims: dict = Depends(verify_token_claims),
+):
+    """Revoke the presented access token"""
+    await revoke_token(credentials.credentials, claims)
+    return {"message": "Logged out"}
 
 
-class CognitoLoginFinishRequest(BaseModel):
-    username: str
-    challenge_responses: dict
-    session: str
+class CognitoLinkRequest(BaseModel):
+    access_token: str  # Cognito access token of the user to link
 
 
-@app.post("/auth/cognito/login-password")
-def cognito_password_login(request: CognitoLoginRequest):
-    """Login to Cognito with username/password to get Access Token"""
-    if not cognito_client:
-        raise HTTPException(status_code=503, detail="Cognito client not initialized")
+@app.post("/auth/cognito/link")
+async def link_cognito_account(
+    request: CognitoLinkRequest,
+    claims: dict = Depends(verify_token_claims),
+    current_user: Identity = Depends(get_identity),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Link a Cognito user to the caller's account, after which its access tokens act as this account
 
+    Needs both sides proven: a local access token (password or passkey login) in the Authorization
+    header and the Cognito user's access token in the body.
+    """
+    if cognito_verifier is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    if claims.get("idp") == COGNITO_IDP:
+        raise HTTPException(status_code=403, detail="Sign in to the local account to link a Cognito account")
     try:
-        auth_params = {
-            'USERNAME': request.username,
-            'PASSWORD': request.password
-        }
-        
-        if COGNITO_CLIENT_SECRET:
-            auth_params['SECRET_HASH'] = get_secret_hash(
-                request.username, COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET
-            )
-        
-        import sys
-        print(f"DEBUG: Calling initiate_auth with params: {auth_params}", file=sys.stderr, flush=True)
-
-        response = cognito_client.initiate_auth(
-            ClientId=COGNITO_CLIENT_ID,
-            AuthFlow='USER_PASSWORD_AUTH',
-            AuthParameters=auth_params
-        )
-        print(f"DEBUG_COGNITO_RESPONSE: {response}", file=sys.stderr, flush=True)
-        
-        if 'AuthenticationResult' in response:
-            return response['AuthenticationResult']
-        elif 'ChallengeName' in response:
-            return response
+        if cognito_verifier.fetch_due(request.access_token):
+            cognito_claims = await asyncio.to_thread(cognito_verifier.decode, request.access_token)
         else:
-            raise KeyError('AuthenticationResult')
-            
-    except ClientError as e:
-        print(f"DEBUG: ClientError: {e}", file=sys.stderr, flush=True)
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        print(f"DEBUG: Exception: {e}", file=sys.stderr, flush=True)
-        # Import tracebaack to print stack trace
-        import traceback
-        traceback.print_exc(file=sys.stderr)
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@app.post("/auth/cognito/register/start")
-def cognito_register_start(request: CognitoRegisterStartRequest):
-    """Start WebAuthn registration with Cognito"""
-    if not cognito_client:
-        raise HTTPException(status_code=503, detail="Cognito client not initialized")
-
-    try:
-        response = cognito_client.start_web_authn_registration(
-            AccessToken=request.access_token
-        )
-        return response['CredentialCreationOptions']
-    except ClientError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-import logging
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    force=True
-)
-logger = logging.getLogger(__name__)
-
-@app.post("/auth/cognito/register/finish")
-def cognito_register_finish(request: CognitoRegisterFinishRequest):
-    """Complete WebAuthn registration with Cognito"""
-    if not cognito_client:
-        logger.error("Cognito client not initialized")
-        raise HTTPException(status_code=503, detail="Cognito client not initialized")
-
-    try:
-        kwargs = {
-            'AccessToken': request.access_token,
-            'Credential': request.credential
-        }
-        logger.info(f"Calling complete_web_authn_registration with: {kwargs}")
-
-        response = cognito_client.complete_web_authn_registration(**kwargs)
-        logger.info(f"Response from complete_web_authn_registration: {response}")
-        return {"message": "Passkey registered successfully with Cognito", "details": response}
-    except ClientError as e:
-        logger.error(f"ClientError in complete_web_authn_registration: {e}")
-        error_detail = str(e)
-        if hasattr(e, 'response'):
-             logger.error(f"Full AWS Error Response: {e.response}")
-             error_detail = e.response
-        raise HTTPException(status_code=400, detail=error_detail)
-    except Exception as e:
-        logger.exception(f"Unexpected exception in complete_web_authn_registration: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@app.post("/auth/cognito/login/start")
-def cognito_login_start(request: CognitoLoginStartRequest):
-    """Start WebAuthn login with Cognito (USER_AUTH flow)"""
-    if not cognito_client:
-        raise HTTPException(status_code=503, detail="Cognito client not initialized")
-
-    try:
-        auth_params = {
-            'USERNAME': request.username,
-            'PREFERRED_CHALLENGE': 'WEB_AUTHN'
-        }
-        
-        if COGNITO_CLIENT_SECRET:
-            auth_params['SECRET_HASH'] = get_secret_hash(
-                request.username, COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET
-            )
-
-        response = cognito_client.initiate_auth(
-            ClientId=COGNITO_CLIENT_ID,
-            AuthFlow='USER_AUTH',
-            AuthParameters=auth_params
-        )
-        return response
-    except ClientError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-class CognitoSignUpRequest(BaseModel):
-    username: str
-    password: str
-
-
-@app.post("/auth/cognito/signup")
-def cognito_signup(request: CognitoSignUpRequest):
-    """Sign up a new user in Cognito"""
-    if not cognito_client:
-        raise HTTPException(status_code=503, detail="Cognito client not initialized")
-
-    try:
-        kwargs = {
-            'ClientId': COGNITO_CLIENT_ID,
-            'Username': request.username,
-            'Password': request.password,
-            'UserAttributes': [
-                {
-                    'Name': 'email',
-                    'Value': request.username
-                }
-            ]
-        }
-        
-        if COGNITO_CLIENT_SECRET:
-            kwargs['SecretHash'] = get_secret_hash(
-                request.username, COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET
-            )
-
-        response = cognito_client.sign_up(**kwargs)
-        return response
-    except ClientError as e:
-        print(f"DEBUG: ClientError: {e}", file=sys.stderr, flush=True)
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        print(f"DEBUG: Exception: {e}", file=sys.stderr, flush=True)
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-class CognitoConfirmSignUpRequest(BaseModel):
-    username: str
-    code: str
-
-
-@app.post("/auth/cognito/confirm-signup")
-def cognito_confirm_signup(request: CognitoConfirmSignUpRequest):
-    """Confirm a new user in Cognito with verification code"""
-    if not cognito_client:
-        raise HTTPException(status_code=503, detail="Cognito client not initialized")
+            cognito_claims = cognito_verifier.decode(request.access_token)
+    except InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid Cognito access token")
+    if not cognito_claims.get("sub"):
+        raise HTTPException(status_code=401, detail="Invalid Cognito access token")
 
     try:
-        kwargs = {
-            'ClientId': COGNITO_CLIENT_ID,
-            'Username': request.username,
-            'ConfirmationCode': request.code,
-        }
-        
-        if COGNITO_CLIENT_SECRET:
-            kwargs['SecretHash'] = get_secret_hash(
-                request.username, COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET
-            )
+        await db.execute(update(User).where(User.id == current_user.user_id).values(cognito_sub=cognito_claims["sub"]))
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Cognito account is already linked to another account")
+    log_event(logger, "cognito.account_linked", username=current_user.username, cognito_username=cognito_claims["username"])
+    return {"message": "Cognito account linked", "username": current_user.username}
 
-        response = cognito_client.confirm_sign_up(**kwargs)
-        return response
-    except ClientError as e:
-        print(f"DEBUG: ClientError: {e}", file=sys.stderr, flush=True)
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        print(f"DEBUG: Exception: {e}", file=sys.stderr, flush=True)
-        raise HTTPException(status_code=500, detail=str(e))
-
-
-@app.post("/auth/cognito/login/finish")
-def cognito_login_finish(request: CognitoLoginFinishRequest):
-    """Complete WebAuthn login with Cognito"""
-    if not cognito_client:
-        raise HTTPException(status_code=503, detail="Cognito client not initialized")
 
-    try:
-        responses = request.challenge_responses.copy()
-        responses['USERNAME'] = request.username
-        
-        if COGNITO_CLIENT_SECRET:
-            responses['SECRET_HASH'] = get_secret_hash(
-                request.username, COGNITO_CLIENT_ID, COGNITO_CLIENT_SECRET
-            )
+if QR_REGISTRATION_ENABLED:
+    app.include_router(qr_router)
 
-        response = cognito_client.respond_to_auth_challenge(
-            ClientId=COGNITO_CLIENT_ID,
-            ChallengeName='WEB_AUTHN',
-            Session=request.session,
-            ChallengeResponses=responses
-        )
-        return response
-    except ClientError as e:
-        raise HTTPException(status_code=400, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+if COGNITO_ENABLED:
+    import cognito_routes
+    cognito_routes.include_routes(app, check_rate_limit, cognito_verifier)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,227 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+
+from sqlalchemy import event
+
+# Seconds; spans in-memory lookups up to slow bcrypt rounds and AWS round trips
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram with a fixed set of labels"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, List] = {}  # label values -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((key, [list(s[0]), s[1], s[2]]) for key, s in self._series.items())
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            inf = _format_labels(self.labelnames, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{inf} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose value is read from a callback at scrape time"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._callbacks: Dict[Tuple, Callable[[], float]] = {}
+
+    def set_function(self, fn: Callable[[], float], **labels):
+        self._callbacks[tuple(labels.get(name, "") for name in self.labelnames)] = fn
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge"]
+        for key, fn in sorted(self._callbacks.items(), key=lambda item: item[0]):
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter with a fixed set of labels"""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        metric = Histogram(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        metric = Gauge(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        metric = Counter(*args, **kwargs)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_SECONDS = registry.histogram(
+    "fido_http_request_duration_seconds", "HTTP request latency by route template", ("method", "route", "status"),
+)
+DB_QUERY_SECONDS = registry.histogram(
+    "fido_db_query_duration_seconds", "Database statement execution time", ("engine", "operation"),
+)
+CRYPTO_SECONDS = registry.histogram(
+    "fido_crypto_duration_seconds", "CPU-bound crypto run time inside the crypto executor", ("operation",),
+)
+CRYPTO_WAIT_SECONDS = registry.histogram(
+    "fido_crypto_queue_wait_seconds", "Time crypto jobs wait for a free worker", ("operation",),
+)
+QR_RENDER_SECONDS = registry.histogram(
+    "fido_qr_render_duration_seconds", "QR code image rendering time", ("format",),
+)
+COGNITO_SECONDS = registry.histogram(
+    "fido_cognito_call_duration_seconds", "boto3 Cognito API call latency", ("operation", "outcome"),
+)
+RATE_LIMIT_REJECTIONS = registry.counter(
+    "fido_rate_limit_rejections_total", "Requests rejected by the rate limiter before any DB or crypto work", ("route", "scope"),
+)
+SESSION_STORE_ENTRIES = registry.gauge(
+    "fido_session_store_entries", "Entries currently held by each session store", ("store",),
+)
+NOTIFICATION_SUBSCRIBERS = registry.gauge(
+    "fido_notification_subscribers", "QR registration WebSocket subscribers connected to this worker",
+)
+CRYPTO_IN_FLIGHT = registry.gauge(
+    "fido_crypto_in_flight", "Crypto jobs running or queued",
+)
+COGNITO_IN_FLIGHT = registry.gauge(
+    "fido_cognito_in_flight", "Cognito calls running or queued on the gateway executor",
+)
+COGNITO_BREAKER_STATE = registry.gauge(
+    "fido_cognito_circuit_state", "Cognito circuit breaker state (0 closed, 1 half-open, 2 open)",
+)
+
+
+def instrument_engine(engine, name: str):
+    """Time every statement executed through a (sync) engine"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started, engine=name, operation=operation)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        connection = exception_context.connection
+        if connection is not None and connection.info.get("query_started"):
+            connection.info["query_started"].pop()
+
+
+def instrument_boto3_client(client):
+    """Time every API call made through a boto3 client, including failed ones"""
+
+    def _before(model, context, **kwargs):
+        context["metrics_call"] = (model.name, time.perf_counter())
+
+    # after-call-error (connection failures, timeouts) carries no model, so the name comes from context
+    def _after(context, http_response=None, exception=None, **kwargs):
+        call = context.pop("metrics_call", None)
+        if call is None:
+            return
+        failed = exception is not None or (http_response is not None and http_response.status_code >= 300)
+        COGNITO_SECONDS.observe(time.perf_counter() - call[1], operation=call[0], outcome="error" if failed else "ok")
+
+    client.meta.events.register("before-call.*.*", _before)
+    client.meta.events.register("after-call.*.*", _after)
+    client.meta.events.register("after-call-error.*.*", _after)
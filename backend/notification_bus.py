@@ -0,0 +1,199 @@
+import abc
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Set
+
+from app_logging import log_event
+from session_store import SESSION_STORE_URL
+
+logger = logging.getLogger(__name__)
+
+# "memory://" (single process) or "sqlite:///path/to/bus.db" (every worker that can reach the file).
+# Follows the session store by default, since sharing one without the other breaks QR registration.
+NOTIFY_BUS_URL = os.getenv("NOTIFY_BUS_URL", SESSION_STORE_URL)
+# How often the SQLite backend looks for events published by other workers
+NOTIFY_POLL_SECONDS = float(os.getenv("NOTIFY_POLL_SECONDS", "0.1"))
+NOTIFY_RETENTION_SECONDS = float(os.getenv("NOTIFY_RETENTION_SECONDS", "60"))
+
+
+class Subscription:
+    """Queue of messages for one subscriber on one channel, bound to the subscriber's event loop"""
+
+    def __init__(self, bus: "NotificationBus", channel: str):
+        self.bus = bus
+        self.channel = channel
+        self._loop = asyncio.get_running_loop()
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def _deliver(self, message: Any):
+        # Called from whichever thread received the event
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, message)
+        except RuntimeError:
+            pass  # Loop already closed
+
+    async def get(self) -> Any:
+        return await self._queue.get()
+
+    async def __aenter__(self) -> "Subscription":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.bus.unsubscribe(self)
+
+
+class NotificationBus(abc.ABC):
+    """Publish/subscribe for small JSON events, fanned out to every subscriber of a channel"""
+
+    def __init__(self):
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, channel: str) -> Subscription:
+        """Register a subscriber (must be called from a running event loop)"""
+        subscription = Subscription(self, channel)
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+    @abc.abstractmethod
+    def publish(self, channel: str, message: Any):
+        """Deliver a message to the channel's subscribers in every process sharing the bus"""
+
+    def _deliver_local(self, channel: str, message: Any):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+            self.delivered += len(subscribers)
+        for subscription in subscribers:
+            subscription._deliver(message)
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subscribers) for subscribers in self._subscribers.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "channels": len(self._subscribers),
+                "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+                "published": self.published,
+                "delivered": self.delivered,
+            }
+
+    def close(self):
+        pass
+
+
+class MemoryNotificationBus(NotificationBus):
+    """Delivers only to subscribers in this process"""
+
+    def publish(self, channel: str, message: Any):
+        self.published += 1
+        self._deliver_local(channel, message)
+
+
+class SQLiteNotificationBus(NotificationBus):
+    """Bus shared between worker processes through a SQLite file
+
+    Events are appended to a table and every worker polls for rows it has not seen yet.
+    Local subscribers are notified immediately; other workers pick the event up on their
+    next poll.
+    """
+
+    def __init__(self, path: str, poll_interval: float = NOTIFY_POLL_SECONDS,
+                 retention: float = NOTIFY_RETENTION_SECONDS):
+        super().__init__()
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._origin = uuid.uuid4().hex
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS notifications ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT, channel TEXT NOT NULL, payload TEXT NOT NULL,"
+            " origin TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_notifications_created_at ON notifications (created_at)"
+        )
+        self._conn_lock = threading.Lock()
+        # Only events published from now on are delivered
+        self._last_id = self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM notifications").fetchone()[0]
+        self._stop = threading.Event()
+        self._poller = threading.Thread(target=self._poll_loop, name="notification-bus", daemon=True)
+        self._poller.start()
+
+    def publish(self, channel: str, message: Any):
+        with self._conn_lock:
+            self._conn.execute(
+                "INSERT INTO notifications (channel, payload, origin, created_at) VALUES (?, ?, ?, ?)",
+                (channel, json.dumps(message), self._origin, time.time()),
+            )
+        self.published += 1
+        self._deliver_local(channel, message)
+
+    def poll(self) -> int:
+        """Deliver events published by other workers since the last poll"""
+        with self._conn_lock:
+            rows = self._conn.execute(
+                "SELECT id, channel, payload, origin FROM notifications WHERE id > ? ORDER BY id",
+                (self._last_id,),
+            ).fetchall()
+        delivered = 0
+        for row_id, channel, payload, origin in rows:
+            self._last_id = row_id
+            if origin != self._origin:
+                self._deliver_local(channel, json.loads(payload))
+                delivered += 1
+        return delivered
+
+    def purge_old(self) -> int:
+        with self._conn_lock:
+            return self._conn.execute(
+                "DELETE FROM notifications WHERE created_at <= ?", (time.time() - self.retention,)
+            ).rowcount
+
+    def _poll_loop(self):
+        last_purge = time.monotonic()
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+                if time.monotonic() - last_purge >= self.retention:
+                    self.purge_old()
+                    last_purge = time.monotonic()
+            except Exception as e:
+                log_event(logger, "notification_bus.poll_failed", logging.WARNING, error=str(e))
+
+    def close(self):
+        self._stop.set()
+        self._poller.join()
+        with self._conn_lock:
+            self._conn.close()
+
+
+def create_notification_bus(url: str = NOTIFY_BUS_URL) -> NotificationBus:
+    """Create the bus configured by NOTIFY_BUS_URL"""
+    if url.startswith("sqlite:///"):
+        return SQLiteNotificationBus(url[len("sqlite:///"):])
+    if url.startswith("memory://"):
+        return MemoryNotificationBus()
+    raise ValueError(f"Unsupported NOTIFY_BUS_URL: {url}")
@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+
+from metrics import QR_RENDER_SECONDS
+
+# "png" (1-bit, optimized; smallest) or "svg" (scales crisply)
+QR_IMAGE_FORMAT = os.getenv("QR_IMAGE_FORMAT", "png")
+QR_RENDER_CACHE_SIZE = int(os.getenv("QR_RENDER_CACHE_SIZE", "256"))
+QR_RENDER_WORKERS = int(os.getenv("QR_RENDER_WORKERS", "2"))
+
+MEDIA_TYPES = {"svg": "image/svg+xml", "png": "image/png"}
+
+
+@dataclass(frozen=True)
+class RenderedQR:
+    body: bytes
+    media_type: str
+    etag: str
+
+
+def _matrix_to_svg(matrix) -> bytes:
+    """One path of horizontal runs in module units; far smaller than qrcode's per-module SVG output"""
+    size = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            runs.append(f"M{start} {y}h{x - start}v1H{start}z")
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {size} {size}" shape-rendering="crispEdges">'
+        f'<rect width="{size}" height="{size}" fill="#fff"/><path d="{"".join(runs)}"/></svg>'
+    ).encode("utf-8")
+
+
+def render_qr(data: str, fmt: str) -> RenderedQR:
+    """Encode data as a QR code image (CPU-bound)"""
+    # Imported on first use: qrcode pulls in PIL, which deployments without QR registration never need
+    import qrcode
+
+    with QR_RENDER_SECONDS.time(format=fmt):
+        qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, box_size=8, border=4)
+        qr.add_data(data)
+        qr.make(fit=True)
+
+        if fmt == "svg":
+            body = _matrix_to_svg(qr.get_matrix())
+        else:
+            buffer = io.BytesIO()
+            qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG", optimize=True)
+            body = buffer.getvalue()
+    return RenderedQR(body=body, media_type=MEDIA_TYPES[fmt], etag='"' + hashlib.sha256(body).hexdigest()[:32] + '"')
+
+
+class QRRenderer:
+    """Renders QR images on a small dedicated pool and keeps recent results in an LRU cache
+
+    prerender() starts the work as soon as a session is created, so by the time the browser
+    requests the image it is usually already cached.
+    """
+
+    def __init__(self, max_entries: int = QR_RENDER_CACHE_SIZE, workers: int = QR_RENDER_WORKERS):
+        self.max_entries = max_entries
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="qr-render")
+        self._entries: "OrderedDict[tuple, Future]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def prerender(self, data: str, fmt: str = QR_IMAGE_FORMAT) -> Future:
+        if fmt not in MEDIA_TYPES:
+            raise ValueError(f"Unsupported QR image format: {fmt}")
+        key = (data, fmt)
+        with self._lock:
+            future = self._entries.get(key)
+            if future is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return future
+            self.misses += 1
+            future = self._pool.submit(render_qr, data, fmt)
+            self._entries[key] = future
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        def _drop_failed(f: Future):
+            if f.exception() is not None:
+                with self._lock:
+                    if self._entries.get(key) is f:
+                        del self._entries[key]
+
+        future.add_done_callback(_drop_failed)
+        return future
+
+    async def get(self, data: str, fmt: str = QR_IMAGE_FORMAT) -> RenderedQR:
+        return await asyncio.wrap_future(self.prerender(data, fmt))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
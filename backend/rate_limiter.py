@@ -0,0 +1,240 @@
+import abc
+import ipaddress
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from session_store import SESSION_STORE_URL
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+# "memory://" (per process, so each worker has its own budget) or "sqlite:///path/to/limits.db"
+# (shared by every worker that can reach the file). Follows the session store by default.
+RATE_LIMIT_URL = os.getenv("RATE_LIMIT_URL", SESSION_STORE_URL)
+# Overrides for DEFAULT_RATE_LIMITS, e.g. "password_login.ip=10/60,password_login.username=3/60"
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+# Proxies (addresses or CIDRs) whose X-Forwarded-For is trusted to name the client, e.g. the nginx container
+RATE_LIMIT_TRUSTED_PROXIES = os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_SWEEP_SECONDS = 60.0
+
+# route -> scope -> "<capacity>/<seconds>": a bucket holds `capacity` requests and refills over `seconds`
+DEFAULT_RATE_LIMITS = {
+    "password_login": {"ip": "30/60", "username": "10/60"},
+    "login_start": {"ip": "120/60", "username": "30/60"},
+    "login_finish": {"ip": "120/60", "username": "30/60"},
+    "usernameless_start": {"ip": "60/60"},
+    "usernameless_finish": {"ip": "60/60"},
+    "mobile_register_finish": {"ip": "30/60"},
+    "cognito_login": {"ip": "30/60", "username": "10/60"},
+    "cognito_signup": {"ip": "10/60"},
+}
+
+
+@dataclass(frozen=True)
+class Budget:
+    capacity: float
+    per_seconds: float
+
+    @property
+    def rate(self) -> float:
+        return self.capacity / self.per_seconds
+
+    @classmethod
+    def parse(cls, spec: str) -> "Budget":
+        capacity, per_seconds = spec.split("/")
+        return cls(float(capacity), float(per_seconds))
+
+
+def parse_budgets(defaults: Dict[str, Dict[str, str]], overrides: str) -> Dict[str, Dict[str, Budget]]:
+    budgets = {route: {scope: Budget.parse(spec) for scope, spec in scopes.items()} for route, scopes in defaults.items()}
+    for item in filter(None, (part.strip() for part in overrides.split(","))):
+        name, spec = item.split("=")
+        route, scope = name.strip().split(".")
+        budgets.setdefault(route, {})[scope] = Budget.parse(spec.strip())
+    return budgets
+
+
+class RateLimited(Exception):
+    def __init__(self, route: str, scope: str, retry_after: float):
+        super().__init__(f"Rate limit exceeded for {route} ({scope})")
+        self.route = route
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class RateLimiter(abc.ABC):
+    """Token buckets keyed by route, scope and client (IP or username)"""
+
+    # True when check() may block on shared storage, so async callers should run it on a thread
+    blocking = False
+
+    def __init__(self, budgets: Dict[str, Dict[str, Budget]]):
+        self.budgets = budgets
+        self._stats_lock = threading.Lock()
+        self.allowed = 0
+        self.rejected: Dict[str, int] = {}
+
+    def check(self, route: str, **clients: Optional[str]):
+        """Take one token from each of the route's buckets; raise RateLimited on the first empty one"""
+        for scope, client in clients.items():
+            budget = self.budgets.get(route, {}).get(scope)
+            if budget is None or not client:
+                continue
+            wait = self._take(f"{route}:{scope}:{client}", budget)
+            if wait > 0:
+                with self._stats_lock:
+                    name = f"{route}.{scope}"
+                    self.rejected[name] = self.rejected.get(name, 0) + 1
+                raise RateLimited(route, scope, wait)
+        with self._stats_lock:
+            self.allowed += 1
+
+    @abc.abstractmethod
+    def _take(self, key: str, budget: Budget) -> float:
+        """0 if a token was taken, otherwise seconds until one is available"""
+
+    def close(self):
+        pass
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {"allowed": self.allowed, "rejected": dict(self.rejected)}
+
+
+class MemoryRateLimiter(RateLimiter):
+    """Buckets in this process only"""
+
+    def __init__(self, budgets: Dict[str, Dict[str, Budget]], max_keys: int = RATE_LIMIT_MAX_KEYS):
+        super().__init__(budgets)
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()  # key -> (tokens, updated)
+        self._lock = threading.Lock()
+        self._longest_window = max((b.per_seconds for s in budgets.values() for b in s.values()), default=0)
+        self._next_sweep = 0.0
+
+    def _take(self, key: str, budget: Budget) -> float:
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (budget.capacity, now))
+            tokens = min(budget.capacity, tokens + (now - updated) * budget.rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            if len(self._buckets) >= self.max_keys:
+                self._evict_locked(now)
+            self._buckets[key] = (tokens, now)
+        return 0.0 if allowed else (1 - tokens) / budget.rate
+
+    def _evict_locked(self, now: float):
+        # A bucket idle for the longest window is full again, the same as not having one
+        if now >= self._next_sweep:
+            self._next_sweep = now + RATE_LIMIT_SWEEP_SECONDS
+            for key in [k for k, (_, updated) in self._buckets.items() if now - updated >= self._longest_window]:
+                del self._buckets[key]
+        while len(self._buckets) >= self.max_keys:
+            self._buckets.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._buckets)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", "buckets": len(self), **super().stats()}
+
+
+class SQLiteRateLimiter(RateLimiter):
+    """Buckets shared between worker processes through a SQLite file; one statement per check"""
+
+    blocking = True
+
+    # Refill since the last update, then take a token if there is one; `allowed` records which happened
+    _TAKE = (
+        "INSERT INTO rate_limit_buckets (key, tokens, updated_at, allowed) VALUES (?1, ?2 - 1, ?3, 1) "
+        "ON CONFLICT (key) DO UPDATE SET "
+        " allowed = MIN(?2, tokens + (?3 - updated_at) * ?4) >= 1,"
+        " tokens = MIN(?2, tokens + (?3 - updated_at) * ?4) - (MIN(?2, tokens + (?3 - updated_at) * ?4) >= 1),"
+        " updated_at = ?3 "
+        "RETURNING tokens, allowed"
+    )
+
+    def __init__(self, path: str, budgets: Dict[str, Dict[str, Budget]]):
+        super().__init__(budgets)
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_buckets ("
+            " key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, allowed INTEGER NOT NULL)"
+        )
+        self._lock = threading.Lock()
+        self._longest_window = max((b.per_seconds for s in budgets.values() for b in s.values()), default=0)
+        self._next_sweep = 0.0
+
+    def _take(self, key: str, budget: Budget) -> float:
+        now = time.time()
+        with self._lock:
+            tokens, allowed = self._conn.execute(self._TAKE, (key, budget.capacity, now, budget.rate)).fetchone()
+            if now >= self._next_sweep:
+                self._next_sweep = now + RATE_LIMIT_SWEEP_SECONDS
+                self._conn.execute("DELETE FROM rate_limit_buckets WHERE updated_at < ?", (now - self._longest_window,))
+        return 0.0 if allowed else (1 - tokens) / budget.rate
+
+    def stats(self) -> dict:
+        return {"backend": "sqlite", **super().stats()}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def _networks(spec: str):
+    return [ipaddress.ip_network(part.strip(), strict=False) for part in spec.split(",") if part.strip()]
+
+
+_trusted_proxies = _networks(RATE_LIMIT_TRUSTED_PROXIES)
+
+
+def _is_trusted(address: str) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in _trusted_proxies)
+
+
+def client_ip(peer: Optional[str], forwarded_for: Optional[str]) -> str:
+    """Rate-limit key for the caller: the peer address, or the first untrusted X-Forwarded-For hop behind our proxies"""
+    address = peer or "unknown"
+    if forwarded_for and _is_trusted(address):
+        for hop in reversed([h.strip() for h in forwarded_for.split(",")]):
+            address = hop
+            if not _is_trusted(hop):
+                break
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return address
+    if ip.version == 6:
+        if ip.ipv4_mapped:
+            return str(ip.ipv4_mapped)
+        # One IPv6 client usually owns a whole /64
+        return str(ipaddress.ip_network(f"{ip}/64", strict=False))
+    return str(ip)
+
+
+def create_rate_limiter() -> Optional[RateLimiter]:
+    """Limiter using the backend configured by RATE_LIMIT_URL (None when rate limiting is disabled)"""
+    if not RATE_LIMIT_ENABLED:
+        return None
+    budgets = parse_budgets(DEFAULT_RATE_LIMITS, RATE_LIMITS)
+    if RATE_LIMIT_URL.startswith("sqlite:///"):
+        return SQLiteRateLimiter(RATE_LIMIT_URL[len("sqlite:///"):], budgets)
+    if RATE_LIMIT_URL.startswith("memory://"):
+        return MemoryRateLimiter(budgets)
+    raise ValueError(f"Unsupported RATE_LIMIT_URL: {RATE_LIMIT_URL}")
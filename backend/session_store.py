@@ -0,0 +1,345 @@
+import abc
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+from app_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+# Backend selection: "memory://" (per process) or "sqlite:///path/to/sessions.db" (shared by
+# every worker that can reach the file, e.g. through the /app/data volume)
+SESSION_STORE_URL = os.getenv("SESSION_STORE_URL", "memory://")
+SESSION_STORE_MAX_ENTRIES = int(os.getenv("SESSION_STORE_MAX_ENTRIES", "10000"))
+SESSION_STORE_SWEEP_SECONDS = float(os.getenv("SESSION_STORE_SWEEP_SECONDS", "30"))
+
+
+class SessionStoreFull(Exception):
+    """add() found the store full of entries that have not expired"""
+
+
+class SessionStore(abc.ABC):
+    """Key/value store with per-entry TTL and a maximum number of entries
+
+    The a-prefixed methods are for request handlers: on stores that do I/O (blocking = True)
+    they run the call on a thread so the event loop keeps serving other requests.
+    """
+
+    blocking = False
+
+    def __init__(self, default_ttl: float, max_entries: int, sweep_interval: float):
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.evictions = 0
+        self._stop = threading.Event()
+        self._sweeper = threading.Thread(target=self._sweep_loop, args=(sweep_interval,), daemon=True)
+        self._sweeper.start()
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        ...
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, keep_ttl: bool = False):
+        """Store a value; keep_ttl preserves the expiry of an existing entry"""
+
+    @abc.abstractmethod
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Atomically store a value unless the key already holds one; False if it does
+
+        Unlike set(), never evicts a live entry: raises SessionStoreFull when there is no room.
+        """
+
+    @abc.abstractmethod
+    def pop(self, key: str) -> Optional[Any]:
+        """Atomically remove and return a value (None if missing or expired)"""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        ...
+
+    @abc.abstractmethod
+    def purge_expired(self) -> int:
+        ...
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        ...
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def close(self):
+        self._stop.set()
+
+    async def _offload(self, fn, *args, **kwargs):
+        if self.blocking:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        return await self._offload(self.get, key)
+
+    async def aset(self, key: str, value: Any, ttl: Optional[float] = None, keep_ttl: bool = False):
+        return await self._offload(self.set, key, value, ttl=ttl, keep_ttl=keep_ttl)
+
+    async def aadd(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        return await self._offload(self.add, key, value, ttl=ttl)
+
+    async def apop(self, key: str) -> Optional[Any]:
+        return await self._offload(self.pop, key)
+
+    async def adelete(self, key: str):
+        return await self._offload(self.delete, key)
+
+    def _sweep_loop(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.purge_expired()
+            except Exception:
+                log_event(logger, "session_store.sweep_failed", logging.WARNING, exc_info=True,
+                          store=type(self).__name__)
+
+
+class MemorySessionStore(SessionStore):
+    """In-process store; values may be arbitrary objects (e.g. live WebSocket connections)"""
+
+    def __init__(self, default_ttl: float, max_entries: int = SESSION_STORE_MAX_ENTRIES,
+                 sweep_interval: float = SESSION_STORE_SWEEP_SECONDS):
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        super().__init__(default_ttl, max_entries, sweep_interval)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, keep_ttl: bool = False):
+        now = time.monotonic()
+        with self._lock:
+            existing = self._data.pop(key, None)
+            if keep_ttl and existing is not None and existing[0] > now:
+                expires_at = existing[0]
+            else:
+                expires_at = now + (ttl if ttl is not None else self.default_ttl)
+
+            if len(self._data) >= self.max_entries:
+                self._purge_locked(now)
+            while len(self._data) >= self.max_entries:
+                # Evict the least recently written entry
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+            self._data[key] = (expires_at, value)
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            existing = self._data.get(key)
+            if existing is not None and existing[0] > now:
+                return False
+            self._data.pop(key, None)
+            if len(self._data) >= self.max_entries and self._purge_locked(now) == 0:
+                raise SessionStoreFull(f"{len(self._data)} live entries")
+            self._data[key] = (now + (ttl if ttl is not None else self.default_ttl), value)
+            return True
+
+    def pop(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return entry[1]
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            return self._purge_locked(time.monotonic())
+
+    def _purge_locked(self, now: float) -> int:
+        expired = [key for key, (expires_at, _) in self._data.items() if expires_at <= now]
+        for key in expired:
+            del self._data[key]
+        return len(expired)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+class SQLiteSessionStore(SessionStore):
+    """Store shared between worker processes through a SQLite file; values must be JSON-serializable"""
+
+    blocking = True
+
+    def __init__(self, path: str, namespace: str, default_ttl: float,
+                 max_entries: int = SESSION_STORE_MAX_ENTRIES,
+                 sweep_interval: float = SESSION_STORE_SWEEP_SECONDS):
+        self.namespace = namespace
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_store ("
+            " namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL, PRIMARY KEY (namespace, key))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_session_store_expiry ON session_store (namespace, expires_at)"
+        )
+        self._lock = threading.Lock()
+        super().__init__(default_ttl, max_entries, sweep_interval)
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM session_store WHERE namespace = ? AND key = ? AND expires_at > ?",
+                (self.namespace, key, time.time()),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None, keep_ttl: bool = False):
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.default_ttl)
+        payload = json.dumps(value)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if keep_ttl:
+                    row = self._conn.execute(
+                        "SELECT expires_at FROM session_store WHERE namespace = ? AND key = ? AND expires_at > ?",
+                        (self.namespace, key, now),
+                    ).fetchone()
+                    if row:
+                        expires_at = row[0]
+
+                count = self._conn.execute(
+                    "SELECT COUNT(*) FROM session_store WHERE namespace = ?", (self.namespace,)
+                ).fetchone()[0]
+                if count >= self.max_entries:
+                    count -= self._conn.execute(
+                        "DELETE FROM session_store WHERE namespace = ? AND expires_at <= ?",
+                        (self.namespace, now),
+                    ).rowcount
+                    excess = count - self.max_entries + 1
+                    if excess > 0:
+                        # Evict the entries closest to expiry until there is room for one more
+                        self._conn.execute(
+                            "DELETE FROM session_store WHERE namespace = ? AND key IN ("
+                            " SELECT key FROM session_store WHERE namespace = ? AND key != ?"
+                            " ORDER BY expires_at LIMIT ?)",
+                            (self.namespace, self.namespace, key, excess),
+                        )
+                        self.evictions += excess
+
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO session_store (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, payload, expires_at),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def add(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        now = time.time()
+        expires_at = now + (ttl if ttl is not None else self.default_ttl)
+        payload = json.dumps(value)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                live = self._conn.execute(
+                    "SELECT 1 FROM session_store WHERE namespace = ? AND key = ? AND expires_at > ?",
+                    (self.namespace, key, now),
+                ).fetchone()
+                if live:
+                    self._conn.execute("COMMIT")
+                    return False
+                count = self._conn.execute(
+                    "SELECT COUNT(*) FROM session_store WHERE namespace = ?", (self.namespace,)
+                ).fetchone()[0]
+                if count >= self.max_entries:
+                    count -= self._conn.execute(
+                        "DELETE FROM session_store WHERE namespace = ? AND expires_at <= ?", (self.namespace, now)
+                    ).rowcount
+                    if count >= self.max_entries:
+                        raise SessionStoreFull(f"{count} live entries")
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO session_store (namespace, key, value, expires_at) VALUES (?, ?, ?, ?)",
+                    (self.namespace, key, payload, expires_at),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return True
+
+    def pop(self, key: str) -> Optional[Any]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM session_store WHERE namespace = ? AND key = ?",
+                    (self.namespace, key),
+                ).fetchone()
+                if row:
+                    self._conn.execute(
+                        "DELETE FROM session_store WHERE namespace = ? AND key = ?", (self.namespace, key)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        if not row or row[1] <= time.time():
+            return None
+        return json.loads(row[0])
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM session_store WHERE namespace = ? AND key = ?", (self.namespace, key))
+
+    def purge_expired(self) -> int:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM session_store WHERE namespace = ? AND expires_at <= ?", (self.namespace, time.time())
+            )
+            return cursor.rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM session_store WHERE namespace = ? AND expires_at > ?",
+                (self.namespace, time.time()),
+            ).fetchone()[0]
+
+    def close(self):
+        super().close()
+        with self._lock:
+            self._conn.close()
+
+
+def create_session_store(namespace: str, default_ttl: float, max_entries: int = SESSION_STORE_MAX_ENTRIES) -> SessionStore:
+    """Create a store for one namespace using the backend configured by SESSION_STORE_URL"""
+    if SESSION_STORE_URL.startswith("sqlite:///"):
+        return SQLiteSessionStore(SESSION_STORE_URL[len("sqlite:///"):], namespace, default_ttl, max_entries)
+    if SESSION_STORE_URL.startswith("memory://"):
+        return MemorySessionStore(default_ttl, max_entries)
+    raise ValueError(f"Unsupported SESSION_STORE_URL: {SESSION_STORE_URL}")
@@ -0,0 +1,132 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+from sqlalchemy import bindparam, update
+
+from app_logging import log_event
+from database import Passkey
+
+logger = logging.getLogger(__name__)
+
+# Pending sign counts are flushed every interval, or sooner once this many credentials are dirty
+SIGN_COUNT_FLUSH_SECONDS = float(os.getenv("SIGN_COUNT_FLUSH_SECONDS", "2"))
+SIGN_COUNT_FLUSH_BATCH = int(os.getenv("SIGN_COUNT_FLUSH_BATCH", "500"))
+
+
+def sign_count_update(counts: Dict[str, int]):
+    """Executemany UPDATE for credential_id -> sign_count; a stored count never moves backwards"""
+    statement = update(Passkey).where(
+        Passkey.credential_id == bindparam("b_credential_id"),
+        Passkey.sign_count < bindparam("b_sign_count"),
+    ).values(sign_count=bindparam("b_sign_count"))
+    return statement, [{"b_credential_id": cid, "b_sign_count": count} for cid, count in counts.items()]
+
+
+class SignCountWriter:
+    """Write-behind buffer that coalesces sign-count updates per credential and flushes them in batches
+
+    Until a value is committed, the in-memory count is authoritative: callers read it through
+    current() so clone detection always compares against the highest count seen.
+    """
+
+    def __init__(self, session_factory, interval: float = SIGN_COUNT_FLUSH_SECONDS, batch_size: int = SIGN_COUNT_FLUSH_BATCH):
+        self._session_factory = session_factory
+        self.interval = interval
+        self.batch_size = batch_size
+        self._pending: Dict[str, int] = {}
+        self._flushing: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.flushes = 0
+        self.rows_written = 0
+        self.failures = 0
+        self.last_flush_ms = 0.0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="sign-count-writer", daemon=True)
+            self._thread.start()
+
+    def record(self, credential_id: str, sign_count: int):
+        """Queue a new sign count; counts only ever move forward"""
+        with self._lock:
+            if sign_count > self._pending.get(credential_id, -1):
+                self._pending[credential_id] = sign_count
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def current(self, credential_id: str) -> Optional[int]:
+        """Latest sign count not yet committed to the database, if any"""
+        with self._lock:
+            pending = self._pending.get(credential_id)
+            flushing = self._flushing.get(credential_id)
+        if pending is None:
+            return flushing
+        return pending if flushing is None else max(pending, flushing)
+
+    def flush(self) -> int:
+        """Write all pending counts in one transaction; returns the number of credentials flushed"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                batch, self._pending = self._pending, {}
+                self._flushing = batch
+
+            started = time.perf_counter()
+            db = self._session_factory()
+            try:
+                db.connection().execute(*sign_count_update(batch))
+                db.commit()
+                self.flushes += 1
+                self.rows_written += len(batch)
+            except Exception:
+                db.rollback()
+                self.failures += 1
+                # Put the batch back so the next flush retries it
+                with self._lock:
+                    for cid, count in batch.items():
+                        if count > self._pending.get(cid, -1):
+                            self._pending[cid] = count
+                raise
+            finally:
+                db.close()
+                with self._lock:
+                    self._flushing = {}
+                self.last_flush_ms = round((time.perf_counter() - started) * 1000, 3)
+            return len(batch)
+
+    def stop(self):
+        """Stop the background thread and flush whatever is still pending"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                log_event(logger, "sign_counts.flush_failed", logging.WARNING, error=str(e), will_retry=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "failures": self.failures,
+            "last_flush_ms": self.last_flush_ms,
+        }
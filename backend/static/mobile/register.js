@@ -0,0 +1,163 @@
+// Session-independent script for the mobile registration page.
+// Session data (user, WebAuthn options) comes from /api/mobile/register/{sessionId}/bootstrap.
+(function () {
+    const sessionId = decodeURIComponent(window.location.pathname.split('/').filter(Boolean).pop() || '');
+    let options = null;
+
+    function base64urlToBytes(base64url) {
+        const padding = '='.repeat((4 - (base64url.length % 4)) % 4);
+        const base64 = (base64url + padding).replace(/-/g, '+').replace(/_/g, '/');
+        const binaryString = atob(base64);
+        const bytes = new Uint8Array(binaryString.length);
+        for (let i = 0; i < binaryString.length; i++) {
+            bytes[i] = binaryString.charCodeAt(i);
+        }
+        return bytes;
+    }
+
+    function bytesToBase64url(bytes) {
+        let binary = '';
+        for (const byte of bytes) {
+            binary += String.fromCharCode(byte);
+        }
+        return btoa(binary)
+            .replace(/\+/g, '-')
+            .replace(/\//g, '_')
+            .replace(/=/g, '');
+    }
+
+    // Messages are always set as text, never parsed as HTML
+    function showResult(kind, lines) {
+        const result = document.getElementById('result');
+        const box = document.createElement('div');
+        box.className = kind;
+        lines.forEach(function (line, index) {
+            if (index > 0) {
+                box.appendChild(document.createElement('br'));
+                box.appendChild(document.createElement('br'));
+            }
+            box.appendChild(document.createTextNode(line));
+        });
+        result.replaceChildren(box);
+    }
+
+    // Check WebAuthn support and HTTPS requirement
+    function checkWebAuthnSupport() {
+        // Check if WebAuthn is available
+        if (!window.navigator || !window.navigator.credentials) {
+            showResult('error', ['⚠️ Your browser does not support WebAuthn. Please use a modern browser like Safari (iOS 16.3+), Chrome, or Firefox.']);
+            return false;
+        }
+
+        // Check if served over HTTPS (required for WebAuthn)
+        const isHttps = window.location.protocol === 'https:';
+        const isLocalhost = window.location.hostname === 'localhost' || window.location.hostname === '127.0.0.1';
+
+        if (!isHttps && !isLocalhost) {
+            showResult('error', ['⚠️ WebAuthn requires HTTPS. This page is served over HTTP. Please access this page via HTTPS or localhost.']);
+            return false;
+        }
+
+        return true;
+    }
+
+    async function loadSession() {
+        const btn = document.getElementById('registerBtn');
+        let response;
+        try {
+            response = await fetch('/api/mobile/register/' + encodeURIComponent(sessionId) + '/bootstrap', {
+                cache: 'no-store'
+            });
+        } catch (error) {
+            showResult('error', ['✗ Error: ' + error.message]);
+            btn.textContent = 'Unavailable';
+            return;
+        }
+
+        if (!response.ok) {
+            showResult('error', ['✗ Session not found or expired. Generate a new QR code and scan it again.']);
+            btn.textContent = 'Unavailable';
+            return;
+        }
+
+        const session = await response.json();
+        document.getElementById('username').textContent = session.username;
+        document.getElementById('displayName').textContent = session.display_name;
+        document.getElementById('userInfo').hidden = false;
+
+        if (session.completed) {
+            showResult('success', ['✓ Passkey registered successfully!', 'You can close this page.']);
+            btn.style.display = 'none';
+            return;
+        }
+
+        options = session.options;
+        btn.textContent = 'Register Passkey';
+        btn.disabled = !checkWebAuthnSupport();
+    }
+
+    async function registerPasskey() {
+        const btn = document.getElementById('registerBtn');
+
+        // Check requirements before proceeding
+        if (!options || !checkWebAuthnSupport()) {
+            btn.disabled = true;
+            btn.textContent = 'Not Supported';
+            return;
+        }
+
+        btn.disabled = true;
+        btn.textContent = 'Registering...';
+
+        try {
+            const credential = await navigator.credentials.create({
+                publicKey: {
+                    challenge: base64urlToBytes(options.challenge),
+                    rp: options.rp,
+                    user: {
+                        id: base64urlToBytes(options.user.id),
+                        name: options.user.name,
+                        displayName: options.user.displayName,
+                    },
+                    pubKeyCredParams: options.pubKeyCredParams,
+                    timeout: options.timeout,
+                    attestation: options.attestation,
+                    authenticatorSelection: options.authenticatorSelection,
+                },
+            });
+
+            const credentialData = {
+                id: credential.id,
+                rawId: bytesToBase64url(new Uint8Array(credential.rawId)),
+                type: credential.type,
+                response: {
+                    clientDataJSON: bytesToBase64url(new Uint8Array(credential.response.clientDataJSON)),
+                    attestationObject: bytesToBase64url(new Uint8Array(credential.response.attestationObject)),
+                },
+            };
+
+            const response = await fetch('/api/mobile/register/finish/' + encodeURIComponent(sessionId), {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify(credentialData)
+            });
+
+            if (response.ok) {
+                showResult('success', ['✓ Passkey registered successfully!', 'You can close this page.']);
+                btn.style.display = 'none';
+            } else {
+                const error = await response.json();
+                showResult('error', ['✗ Registration failed: ' + (error.detail || 'Unknown error')]);
+                btn.disabled = false;
+                btn.textContent = 'Try Again';
+            }
+        } catch (error) {
+            showResult('error', ['✗ Error: ' + error.message]);
+            btn.disabled = false;
+            btn.textContent = 'Try Again';
+        }
+    }
+
+    document.getElementById('registerBtn').addEventListener('click', registerPasskey);
+    loadSession();
+})();
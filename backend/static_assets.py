@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, Optional
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # Optional: gzip alone still covers every browser
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+# Fingerprinted assets never change under the same URL
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+MEDIA_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".js": "text/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".json": "application/json",
+}
+# Preferred first
+ENCODINGS = ("br", "gzip")
+
+
+@dataclass
+class StaticAsset:
+    """A file held in memory with its precompressed variants"""
+
+    name: str
+    media_type: str
+    body: bytes
+    etag: str
+    encoded: Dict[str, bytes] = field(default_factory=dict)
+
+    @classmethod
+    def build(cls, name: str, body: bytes) -> "StaticAsset":
+        asset = cls(
+            name=name,
+            media_type=MEDIA_TYPES.get(os.path.splitext(name)[1], "application/octet-stream"),
+            body=body,
+            etag=hashlib.sha256(body).hexdigest()[:20],
+        )
+        asset.encoded["gzip"] = gzip.compress(body, compresslevel=9, mtime=0)
+        if brotli is not None:
+            asset.encoded["br"] = brotli.compress(body, quality=11)
+        # Keep a compressed variant only when it actually saves bytes
+        asset.encoded = {enc: data for enc, data in asset.encoded.items() if len(data) < len(body)}
+        return asset
+
+    def response(self, request: Request, cache_control: str) -> Response:
+        accepted = _accepted_encodings(request.headers.get("accept-encoding", ""))
+        encoding = next((enc for enc in ENCODINGS if enc in accepted and enc in self.encoded), None)
+        etag = f'"{self.etag}-{encoding}"' if encoding else f'"{self.etag}"'
+        headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+        if etag in _parse_if_none_match(request.headers.get("if-none-match", "")):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+            return Response(self.encoded[encoding], media_type=self.media_type, headers=headers)
+        return Response(self.body, media_type=self.media_type, headers=headers)
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in header.split(","):
+        token, _, params = part.strip().partition(";")
+        if token and not re.search(r"q=0(\.0*)?$", params.replace(" ", "")):
+            accepted.add(token.lower())
+    return accepted
+
+
+def _parse_if_none_match(header: str) -> set:
+    return {tag.strip() for tag in header.split(",") if tag.strip()}
+
+
+class StaticBundle:
+    """Loads one static directory at startup: fingerprints assets and renders the HTML shells
+
+    HTML files may reference sibling assets as {{name.ext}}; those placeholders are replaced
+    with fingerprinted URLs under url_prefix, so the assets can be cached forever.
+    """
+
+    def __init__(self, directory: str, url_prefix: str):
+        self.url_prefix = url_prefix.rstrip("/")
+        self.assets: Dict[str, StaticAsset] = {}
+        self.pages: Dict[str, StaticAsset] = {}
+        self.urls: Dict[str, str] = {}
+
+        files = sorted(os.listdir(directory))
+        for name in files:
+            if name.endswith(".html"):
+                continue
+            with open(os.path.join(directory, name), "rb") as f:
+                asset = StaticAsset.build(name, f.read())
+            stem, ext = os.path.splitext(name)
+            fingerprinted = f"{stem}.{asset.etag[:10]}{ext}"
+            self.assets[fingerprinted] = asset
+            self.urls[name] = f"{self.url_prefix}/{fingerprinted}"
+
+        for name in files:
+            if not name.endswith(".html"):
+                continue
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                html = f.read()
+            html = re.sub(r"\{\{([\w.-]+)\}\}", lambda m: self.urls[m.group(1)], html)
+            self.pages[name] = StaticAsset.build(name, html.encode("utf-8"))
+
+    def asset(self, fingerprinted_name: str) -> Optional[StaticAsset]:
+        return self.assets.get(fingerprinted_name)
+
+    def page(self, name: str) -> StaticAsset:
+        return self.pages[name]
@@ -0,0 +1,77 @@
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+
+import pytest
+
+# The backend modules are flat top-level modules (imported as `main`, `cognito_gateway`, ...)
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+# The app reads its settings at import time: point it at a scratch database and key directory
+# before any test module imports it
+_workdir = tempfile.mkdtemp(prefix="fido-demo-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_workdir}/fido.db",
+    "JWT_KEYS_DIR": os.path.join(_workdir, "jwt-keys"),
+    "COGNITO_ENABLED": "false",
+    "RATE_LIMIT_ENABLED": "false",
+    "SESSION_STORE_URL": "memory://",
+    "RP_ID": "localhost",
+    "RP_ORIGINS": "http://localhost",
+    "LOG_LEVEL": "WARNING",
+})
+
+ORIGIN = "http://localhost"
+
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+@pytest.fixture(scope="session")
+def main():
+    import main
+    return main
+
+
+@pytest.fixture(scope="session")
+def client(main):
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.app, headers={"Origin": ORIGIN}) as client:
+        yield client
+
+
+@pytest.fixture
+def user(main, client):
+    """A fresh account (password "user"), logged in: (username, Authorization headers)"""
+    from database import DEMO_PASSWORD_HASH, SessionLocal, User
+
+    username = f"user-{uuid.uuid4().hex[:8]}"
+    with SessionLocal() as db:
+        db.add(User(username=username, password_hash=DEMO_PASSWORD_HASH, display_name=username))
+        db.commit()
+    response = client.post("/auth/password/login", json={"username": username, "password": "user"})
+    assert response.status_code == 200, response.text
+    return username, {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def passkey(client, user):
+    """A software authenticator registered to `user`"""
+    from loadtest.soft_authenticator import SoftAuthenticator
+
+    username, headers = user
+    start = client.post("/auth/register/start", json={"username": username, "display_name": "Test"}, headers=headers)
+    assert start.status_code == 200, start.text
+    authenticator = SoftAuthenticator("localhost", ORIGIN)
+    finish = client.post("/auth/register/finish", headers=headers, json={
+        "credential": authenticator.create(start.json()["options"]),
+        "challenge_token": start.json()["challenge_token"],
+        "display_name": "Test",
+    })
+    assert finish.status_code == 200, finish.text
+    return authenticator
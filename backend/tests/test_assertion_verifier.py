@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import struct
+
+import pytest
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from webauthn import verify_authentication_response
+from webauthn.helpers.exceptions import InvalidAuthenticationResponse
+
+from assertion_verifier import verify_assertion
+from loadtest.soft_authenticator import FLAG_UP, FLAG_UV, SoftAuthenticator, b64url
+
+RP_ID = "localhost"
+ORIGIN = "http://localhost"
+CHALLENGE = os.urandom(32)
+CURRENT_SIGN_COUNT = 5
+
+
+def assertion(authenticator: SoftAuthenticator, *, ceremony="webauthn.get", challenge=CHALLENGE, origin=ORIGIN,
+              rp_id=RP_ID, flags=FLAG_UP | FLAG_UV, sign_count=CURRENT_SIGN_COUNT + 1, token_binding=None,
+              tamper_signature=False) -> dict:
+    """An assertion from the authenticator's key with every signed field under the test's control"""
+    client_data = {"type": ceremony, "challenge": b64url(challenge), "origin": origin, "crossOrigin": False}
+    if token_binding:
+        client_data["tokenBinding"] = {"status": token_binding}
+    client_data = json.dumps(client_data).encode("utf-8")
+    auth_data = hashlib.sha256(rp_id.encode("utf-8")).digest() + bytes([flags]) + struct.pack(">I", sign_count)
+    signature = authenticator.private_key.sign(auth_data + hashlib.sha256(client_data).digest(), ec.ECDSA(hashes.SHA256()))
+    if tamper_signature:
+        signature = authenticator.private_key.sign(b"something else", ec.ECDSA(hashes.SHA256()))
+    return {
+        "id": authenticator.credential_id_b64,
+        "rawId": authenticator.credential_id_b64,
+        "type": "public-key",
+        "response": {
+            "clientDataJSON": b64url(client_data),
+            "authenticatorData": b64url(auth_data),
+            "signature": b64url(signature),
+        },
+        "clientExtensionResults": {},
+    }
+
+
+CASES = {
+    "valid": {},
+    "valid_first_use_without_counter": {"sign_count": 0, "current_sign_count": 0},
+    "bad_signature": {"tamper_signature": True},
+    "wrong_origin": {"origin": "https://evil.example"},
+    "wrong_rp_id": {"rp_id": "evil.example"},
+    "wrong_challenge": {"challenge": os.urandom(32)},
+    "registration_client_data": {"ceremony": "webauthn.create"},
+    "user_not_present": {"flags": FLAG_UV},
+    "uv_missing_when_required": {"flags": FLAG_UP, "require_user_verification": True},
+    "uv_missing_when_not_required": {"flags": FLAG_UP},
+    "lower_sign_count": {"sign_count": CURRENT_SIGN_COUNT - 1},
+    "same_sign_count": {"sign_count": CURRENT_SIGN_COUNT},
+    "token_binding_supported": {"token_binding": "supported"},
+    "token_binding_unknown": {"token_binding": "not-supported"},
+}
+
+
+ACCEPTED = {"valid", "valid_first_use_without_counter", "uv_missing_when_not_required", "token_binding_supported"}
+
+
+def outcome(verify, **kwargs):
+    try:
+        return "ok", verify(**kwargs)
+    except InvalidAuthenticationResponse as e:
+        return "rejected", str(e)
+    except Exception as e:
+        return "error", type(e).__name__
+
+
+@pytest.mark.parametrize("case", CASES)
+def test_matches_py_webauthn(case):
+    options = dict(CASES[case])
+    require_user_verification = options.pop("require_user_verification", False)
+    current_sign_count = options.pop("current_sign_count", CURRENT_SIGN_COUNT)
+    authenticator = SoftAuthenticator(RP_ID, ORIGIN)
+    kwargs = dict(
+        credential=assertion(authenticator, **options),
+        expected_challenge=CHALLENGE,
+        expected_rp_id=RP_ID,
+        expected_origin=ORIGIN,
+        credential_public_key=authenticator.cose_public_key(),
+        credential_current_sign_count=current_sign_count,
+        require_user_verification=require_user_verification,
+    )
+    ours = outcome(verify_assertion, **kwargs)
+    # Twice, so the second run goes through the cached public key
+    assert outcome(verify_assertion, **kwargs) == ours
+    assert ours == outcome(verify_authentication_response, **kwargs)
+    assert ours[0] == ("ok" if case in ACCEPTED else "rejected")
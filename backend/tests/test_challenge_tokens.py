@@ -0,0 +1,141 @@
+import asyncio
+import base64
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from challenge_tokens import ChallengeTokens, InvalidChallengeToken, ReplayCacheFull, derive_secret, replay_cache_size_for
+from session_store import SQLiteSessionStore
+
+SECRETS = [derive_secret("test")]
+
+
+def issue(tokens: ChallengeTokens) -> str:
+    return tokens.issue(os.urandom(32), "authentication", "user")
+
+
+def use(tokens: ChallengeTokens, token: str):
+    tokens.open(token, "authentication", "user")
+    tokens.spend(token)
+
+
+def test_token_is_spent_once():
+    tokens = ChallengeTokens(SECRETS, ttl=60)
+    token = issue(tokens)
+    use(tokens, token)
+    with pytest.raises(InvalidChallengeToken) as e:
+        tokens.open(token, "authentication", "user")
+    assert e.value.reason == "replayed"
+    with pytest.raises(InvalidChallengeToken) as e:
+        tokens.spend(token)
+    assert e.value.reason == "replayed"
+
+
+def test_opening_without_spending_takes_no_room():
+    # Finish requests whose assertion fails never spend their token
+    tokens = ChallengeTokens(SECRETS, ttl=60, replay_cache_size=2)
+    for _ in range(10):
+        tokens.open(issue(tokens), "authentication", "user")
+    assert len(tokens) == 0
+    use(tokens, issue(tokens))
+    assert len(tokens) == 1
+
+
+def test_spent_tokens_are_remembered_until_their_own_expiry():
+    tokens = ChallengeTokens(SECRETS, ttl=60)
+    token = issue(tokens)
+    use(tokens, token)
+    assert next(iter(tokens._used.values())) == json.loads(base64.urlsafe_b64decode(token.split(".")[0] + "=="))["exp"]
+
+
+def test_default_size_follows_ttl():
+    assert ChallengeTokens(SECRETS, ttl=300, replay_cache_size=None).replay_cache_size == replay_cache_size_for(300)
+    assert replay_cache_size_for(600) == 2 * replay_cache_size_for(300)
+
+
+def test_full_cache_fails_closed_instead_of_forgetting_live_tokens():
+    tokens = ChallengeTokens(SECRETS, ttl=60, replay_cache_size=3)
+    used = [issue(tokens) for _ in range(3)]
+    for token in used:
+        use(tokens, token)
+
+    with pytest.raises(ReplayCacheFull):
+        use(tokens, issue(tokens))
+    # Every live token is still remembered
+    for token in used:
+        with pytest.raises(InvalidChallengeToken):
+            tokens.open(token, "authentication", "user")
+    assert tokens.stats()["rejected"]["replay_cache_full"] == 1
+
+
+def test_expired_entries_make_room():
+    tokens = ChallengeTokens(SECRETS, ttl=1, replay_cache_size=2)
+    for _ in range(2):
+        use(tokens, issue(tokens))
+    time.sleep(1.1)
+    use(tokens, issue(tokens))
+    assert len(tokens) == 1
+
+
+def test_token_used_on_one_worker_is_rejected_on_another(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    worker_a = ChallengeTokens(SECRETS, ttl=60, replay_store=SQLiteSessionStore(path, "used_challenges", 60))
+    worker_b = ChallengeTokens(SECRETS, ttl=60, replay_store=SQLiteSessionStore(path, "used_challenges", 60))
+    try:
+        token = issue(worker_a)
+        use(worker_a, token)
+        # Worker B cannot tell the token was spent until it tries to spend it
+        worker_b.open(token, "authentication", "user")
+        with pytest.raises(InvalidChallengeToken) as e:
+            worker_b.spend(token)
+        assert e.value.reason == "replayed"
+    finally:
+        worker_a.close()
+        worker_b.close()
+
+
+def test_full_shared_store_fails_closed(tmp_path):
+    store = SQLiteSessionStore(str(tmp_path / "sessions.db"), "used_challenges", 60, max_entries=2)
+    tokens = ChallengeTokens(SECRETS, ttl=60, replay_store=store)
+    try:
+        for _ in range(2):
+            use(tokens, issue(tokens))
+        with pytest.raises(ReplayCacheFull):
+            use(tokens, issue(tokens))
+        assert len(store) == 2
+    finally:
+        tokens.close()
+
+
+def test_aspend_records_in_the_shared_store_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    tokens = ChallengeTokens(SECRETS, ttl=60, replay_store=SQLiteSessionStore(path, "used_challenges", 60))
+    token = issue(tokens)
+    tokens.open(token, "authentication", "user")
+    # Another worker holds the write lock for a while
+    holder = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    holder.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.3, holder.rollback).start()
+
+    async def scenario():
+        spend = asyncio.create_task(tokens.aspend(token))
+        ticks = 0
+        while not spend.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        await spend
+        with pytest.raises(InvalidChallengeToken) as e:
+            await tokens.aspend(token)
+        assert e.value.reason == "replayed"
+        return ticks
+
+    try:
+        assert asyncio.run(scenario()) >= 10
+        assert tokens.stats()["accepted"] == 1
+    finally:
+        tokens.close()
+        holder.close()
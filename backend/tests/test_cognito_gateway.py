@@ -0,0 +1,266 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from botocore.exceptions import (
+    ClientError,
+    ConnectTimeoutError,
+    EndpointConnectionError,
+    ParamValidationError,
+    ReadTimeoutError,
+    SSLError,
+)
+
+import cognito_gateway
+from cognito_gateway import CircuitBreaker, CognitoGateway, CognitoSaturated, CognitoUnavailable
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(cognito_gateway, "COGNITO_RETRY_BASE_SECONDS", 0.0)
+
+
+def client_error(code: str, status: int = 400, operation: str = "InitiateAuth") -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": code}, "ResponseMetadata": {"HTTPStatusCode": status}}, operation)
+
+
+class ScriptedClient:
+    """Stand-in boto3 client: every operation plays the next outcome (an exception is raised, anything else returned)"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    def _next(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    initiate_auth = _next
+    sign_up = _next
+    respond_to_auth_challenge = _next
+
+
+def gateway(client, **kwargs) -> CognitoGateway:
+    kwargs.setdefault("breaker", CircuitBreaker(failure_threshold=5, reset_timeout=30))
+    return CognitoGateway(client, workers=2, max_queue=2, max_attempts=3, **kwargs)
+
+
+def call(gw: CognitoGateway, operation: str = "initiate_auth"):
+    return asyncio.run(gw.call(operation))
+
+
+# CircuitBreaker
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CognitoUnavailable):
+        breaker.before_call()
+    assert breaker.opened == 1
+    assert breaker.rejected == 1
+
+
+def test_breaker_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+
+
+def test_breaker_half_open_lets_one_trial_through():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.state == "half_open"
+    breaker.before_call()
+    with pytest.raises(CognitoUnavailable):
+        breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == "closed"
+
+
+def test_breaker_failed_trial_reopens():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.opened == 2
+
+
+def test_breaker_released_trial_can_be_retried():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.before_call()
+    breaker.release_trial()
+    breaker.before_call()
+
+
+# Retry classification
+
+def test_success_is_returned():
+    client = ScriptedClient({"AuthenticationResult": {}})
+    assert call(gateway(client)) == {"AuthenticationResult": {}}
+    assert client.calls == 1
+
+
+def test_client_errors_are_answers_not_failures():
+    client = ScriptedClient(client_error("NotAuthorizedException"))
+    gw = gateway(client, breaker=CircuitBreaker(failure_threshold=1))
+    with pytest.raises(ClientError):
+        call(gw)
+    assert client.calls == 1
+    assert gw.breaker.state == "closed"
+    assert gw.failures == 0
+
+
+@pytest.mark.parametrize("error", [
+    ConnectTimeoutError(endpoint_url="https://cognito-idp"),
+    EndpointConnectionError(endpoint_url="https://cognito-idp"),
+])
+@pytest.mark.parametrize("operation", ["initiate_auth", "sign_up"])
+def test_connect_errors_are_retried_for_every_operation(error, operation):
+    client = ScriptedClient(error, {"ok": True})
+    gw = gateway(client)
+    assert call(gw, operation) == {"ok": True}
+    assert client.calls == 2
+    assert gw.retries == 1
+
+
+@pytest.mark.parametrize("operation", ["initiate_auth", "sign_up"])
+def test_throttling_is_retried_for_every_operation(operation):
+    client = ScriptedClient(client_error("TooManyRequestsException"), {"ok": True})
+    assert call(gateway(client), operation) == {"ok": True}
+    assert client.calls == 2
+
+
+def test_server_errors_are_retried_for_idempotent_operations():
+    client = ScriptedClient(client_error("InternalErrorException", 500), {"ok": True})
+    assert call(gateway(client), "initiate_auth") == {"ok": True}
+    assert client.calls == 2
+
+
+def test_server_errors_are_not_retried_for_other_operations():
+    client = ScriptedClient(client_error("InternalErrorException", 500), {"ok": True})
+    gw = gateway(client)
+    with pytest.raises(CognitoUnavailable):
+        call(gw, "sign_up")
+    assert client.calls == 1
+    assert gw.failures == 1
+
+
+def test_read_timeouts_are_retried_for_idempotent_operations():
+    client = ScriptedClient(ReadTimeoutError(endpoint_url="https://cognito-idp"), {"ok": True})
+    assert call(gateway(client), "initiate_auth") == {"ok": True}
+    assert client.calls == 2
+
+
+def test_read_timeouts_are_not_retried_for_other_operations():
+    # sign_up may have gone through; repeating it would fail with UsernameExistsException
+    client = ScriptedClient(ReadTimeoutError(endpoint_url="https://cognito-idp"), {"ok": True})
+    with pytest.raises(CognitoUnavailable):
+        call(gateway(client), "sign_up")
+    assert client.calls == 1
+
+
+def test_attempts_are_capped():
+    client = ScriptedClient(*[EndpointConnectionError(endpoint_url="https://cognito-idp")] * 5)
+    gw = gateway(client)
+    with pytest.raises(CognitoUnavailable):
+        call(gw)
+    assert client.calls == 3
+    assert gw.retries == 2
+    assert gw.failures == 1
+
+
+def test_upstream_failures_open_the_breaker():
+    client = ScriptedClient(*[client_error("ServiceUnavailable", 503, "SignUp")] * 2)
+    gw = gateway(client, breaker=CircuitBreaker(failure_threshold=2, reset_timeout=30))
+    for _ in range(2):
+        with pytest.raises(CognitoUnavailable):
+            call(gw, "sign_up")
+    assert gw.breaker.state == "open"
+    with pytest.raises(CognitoUnavailable):
+        call(gw, "sign_up")
+    assert client.calls == 2
+
+
+def test_throttling_does_not_open_the_breaker():
+    client = ScriptedClient(*[client_error("TooManyRequestsException")] * 3)
+    gw = gateway(client, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=30))
+    with pytest.raises(CognitoUnavailable):
+        call(gw)
+    assert client.calls == 3
+    assert gw.breaker.state == "closed"
+
+
+def test_local_saturation_does_not_open_the_breaker():
+    release = threading.Event()
+
+    class BlockingClient:
+        def initiate_auth(self):
+            release.wait(5)
+            return {"ok": True}
+
+    gw = CognitoGateway(BlockingClient(), workers=1, max_queue=0, breaker=CircuitBreaker(failure_threshold=1))
+
+    async def burst():
+        first = asyncio.ensure_future(gw.call("initiate_auth"))
+        await asyncio.sleep(0.05)
+        with pytest.raises(CognitoSaturated):
+            await gw.call("initiate_auth")
+        release.set()
+        return await first
+
+    try:
+        assert asyncio.run(burst()) == {"ok": True}
+    finally:
+        release.set()
+        gw.shutdown()
+    assert gw.saturated == 1
+    assert gw.breaker.state == "closed"
+    assert gw.breaker.opened == 0
+
+
+def test_caller_errors_release_the_half_open_trial():
+    # An empty username fails botocore's own validation before anything is sent
+    client = ScriptedClient(ParamValidationError(report="Invalid length for parameter Username"), {"ok": True})
+    gw = gateway(client, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+    gw.breaker.record_failure()
+    time.sleep(0.06)
+    with pytest.raises(ParamValidationError):
+        call(gw, "sign_up")
+    assert gw.breaker.state == "half_open"
+    assert gw.failures == 0
+    assert call(gw, "sign_up") == {"ok": True}
+    assert gw.breaker.state == "closed"
+
+
+def test_unclassified_transport_errors_count_against_cognito():
+    client = ScriptedClient(SSLError(endpoint_url="https://cognito-idp", error="handshake failed"), {"ok": True})
+    gw = gateway(client, breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.05))
+    with pytest.raises(CognitoUnavailable):
+        call(gw)
+    assert client.calls == 1
+    assert gw.breaker.state == "open"
+    time.sleep(0.06)
+    # The failed trial reopens the circuit rather than wedging it half-open
+    client.outcomes.insert(0, SSLError(endpoint_url="https://cognito-idp", error="handshake failed"))
+    with pytest.raises(CognitoUnavailable):
+        call(gw)
+    assert gw.breaker.state == "open"
+    time.sleep(0.06)
+    assert call(gw) == {"ok": True}
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+moto = pytest.importorskip("moto")
+
+import boto3
+from botocore.exceptions import ClientError
+
+from cognito_gateway import CircuitBreaker, CognitoGateway
+
+
+@pytest.fixture
+def cognito(monkeypatch):
+    """Gateway over a boto3 client talking to moto's Cognito, plus a confirmed-signup app client"""
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        client = boto3.client("cognito-idp", region_name="us-east-1")
+        pool_id = client.create_user_pool(PoolName="fido-demo")["UserPool"]["Id"]
+        client_id = client.create_user_pool_client(
+            UserPoolId=pool_id, ClientName="web", ExplicitAuthFlows=["ALLOW_USER_PASSWORD_AUTH", "ALLOW_REFRESH_TOKEN_AUTH"],
+        )["UserPoolClient"]["ClientId"]
+        gateway = CognitoGateway(client, workers=2, max_queue=2, breaker=CircuitBreaker(failure_threshold=1))
+        try:
+            yield gateway, pool_id, client_id
+        finally:
+            gateway.shutdown()
+
+
+def test_sign_up_and_login_through_the_gateway(cognito):
+    gateway, pool_id, client_id = cognito
+
+    async def flow():
+        await gateway.call("sign_up", ClientId=client_id, Username="alice", Password="Passw0rd!Passw0rd")
+        await gateway.call("admin_confirm_sign_up", UserPoolId=pool_id, Username="alice")
+        return await gateway.call(
+            "initiate_auth", ClientId=client_id, AuthFlow="USER_PASSWORD_AUTH",
+            AuthParameters={"USERNAME": "alice", "PASSWORD": "Passw0rd!Passw0rd"},
+        )
+
+    result = asyncio.run(flow())
+    assert result["AuthenticationResult"]["AccessToken"]
+    assert gateway.stats()["calls"] == 3
+    assert gateway.stats()["retries"] == 0
+
+
+def test_wrong_password_is_an_answer_not_an_outage(cognito):
+    gateway, pool_id, client_id = cognito
+
+    async def flow():
+        await gateway.call("sign_up", ClientId=client_id, Username="bob", Password="Passw0rd!Passw0rd")
+        await gateway.call("admin_confirm_sign_up", UserPoolId=pool_id, Username="bob")
+        await gateway.call(
+            "initiate_auth", ClientId=client_id, AuthFlow="USER_PASSWORD_AUTH",
+            AuthParameters={"USERNAME": "bob", "PASSWORD": "wrong-password"},
+        )
+
+    with pytest.raises(ClientError) as e:
+        asyncio.run(flow())
+    assert e.value.response["Error"]["Code"] == "NotAuthorizedException"
+    # Even with a threshold of one failure the breaker stays closed
+    assert gateway.breaker.state == "closed"
+    assert gateway.stats()["failures"] == 0
@@ -0,0 +1,42 @@
+from sqlalchemy import inspect, text
+
+import database
+
+
+def use_database(monkeypatch, tmp_path):
+    engine = database.create_engine_from_env(f"sqlite:///{tmp_path / 'fido.db'}")
+    monkeypatch.setattr(database, "engine", engine)
+    monkeypatch.setattr(database, "SCHEMA_CREATE_BACKOFF_SECONDS", 0.0)
+    return engine
+
+
+def test_create_schema_retries_when_another_worker_creates_a_table_first(monkeypatch, tmp_path):
+    engine = use_database(monkeypatch, tmp_path)
+    create_all = database.Base.metadata.create_all
+    calls = []
+
+    def racing_create_all(bind, checkfirst=True):
+        calls.append(checkfirst)
+        if len(calls) == 1:
+            # Another worker creates users between this worker's check and its CREATE TABLE
+            database.User.__table__.create(bind)
+            return create_all(bind=bind, checkfirst=False)
+        return create_all(bind=bind, checkfirst=checkfirst)
+
+    monkeypatch.setattr(database.Base.metadata, "create_all", racing_create_all)
+    database.create_schema()
+    assert len(calls) == 2
+    assert database.schema_exists(inspect(engine))
+
+
+def test_column_migration_tolerates_another_worker_migrating_first(monkeypatch, tmp_path):
+    engine = use_database(monkeypatch, tmp_path)
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR)"))
+        connection.execute(text("CREATE TABLE passkeys (id INTEGER PRIMARY KEY, user_id INTEGER)"))
+    stale = inspect(engine)
+    stale.get_columns("users")  # this worker looked before the other one migrated
+    database.migrate_passkey_count(inspect(engine))
+
+    database.migrate_passkey_count(stale)
+    assert "passkey_count" in {c["name"] for c in inspect(engine).get_columns("users")}
@@ -0,0 +1,93 @@
+def login_start(client, username):
+    response = client.post("/auth/login/start", json={"username": username})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def login_finish(client, username, start, assertion):
+    return client.post("/auth/login/finish", json={
+        "username": username, "assertion": assertion, "challenge_token": start["challenge_token"],
+    })
+
+
+def test_login_with_a_passkey(client, user, passkey):
+    username, _ = user
+    start = login_start(client, username)
+    response = login_finish(client, username, start, passkey.get(start["options"]))
+    assert response.status_code == 200, response.text
+    assert response.json()["username"] == username
+
+
+def test_replayed_login_is_rejected(client, user, passkey):
+    username, _ = user
+    start = login_start(client, username)
+    assertion = passkey.get(start["options"])
+    assert login_finish(client, username, start, assertion).status_code == 200
+    response = login_finish(client, username, start, assertion)
+    assert response.status_code == 400
+    assert "already used" in response.json()["detail"]
+
+
+def test_failed_finishes_do_not_fill_the_replay_cache(main, client, user, passkey, monkeypatch):
+    username, _ = user
+    monkeypatch.setattr(main.challenge_tokens, "replay_cache_size", len(main.challenge_tokens) + 1)
+    for assertion in ({"id": "bogus"}, {**passkey.get(login_start(client, username)["options"]), "id": "bogus"}):
+        start = login_start(client, username)
+        assert login_finish(client, username, start, assertion).status_code == 404
+    start = login_start(client, username)
+    tampered = passkey.get(start["options"])
+    tampered["response"]["signature"] = tampered["response"]["signature"][:-4] + "AAAA"
+    assert login_finish(client, username, start, tampered).status_code == 400
+
+    # The failures above spent nothing, so the one free slot is still there for a real login
+    start = login_start(client, username)
+    assert login_finish(client, username, start, passkey.get(start["options"])).status_code == 200
+    start = login_start(client, username)
+    assert login_finish(client, username, start, passkey.get(start["options"])).status_code == 503
+
+
+def test_usernameless_token_can_be_retried_after_a_failed_assertion(client, passkey):
+    start = client.post("/auth/login/usernameless/start", json={}).json()
+    body = {"assertion": {"id": "bogus"}, "challenge_token": start["challenge_token"]}
+    assert client.post("/auth/login/usernameless/finish", json=body).status_code == 404
+    body["assertion"] = passkey.get(start["options"])
+    assert client.post("/auth/login/usernameless/finish", json=body).status_code == 200
+
+
+def test_batch_spends_each_token_once(main, client, user, passkey, monkeypatch):
+    monkeypatch.setattr(main, "GATEWAY_API_KEY", "gateway-key")
+    username, _ = user
+    start = login_start(client, username)
+    item = {"username": username, "assertion": passkey.get(start["options"]), "challenge_token": start["challenge_token"]}
+    response = client.post("/auth/login/batch", json={"items": [item, item]}, headers={"X-Gateway-Key": "gateway-key"})
+    assert response.status_code == 200, response.text
+    assert response.json()["succeeded"] == 1
+    assert response.json()["results"][1]["status"] == 400
+
+
+def test_usernameless_start_offers_the_credential_from_the_hint_cookie(client, user, passkey):
+    username, _ = user
+    client.cookies.clear()
+    try:
+        start = client.post("/auth/login/usernameless/start", json={}).json()
+        assert start["options"]["allowCredentials"] == []
+
+        # A passkey login on this device leaves the hint cookie behind
+        login = login_start(client, username)
+        assert login_finish(client, username, login, passkey.get(login["options"])).status_code == 200
+        assert client.cookies.get("passkey_hint")
+        start = client.post("/auth/login/usernameless/start", json={}).json()
+        assert [c["id"] for c in start["options"]["allowCredentials"]] == [passkey.credential_id_b64]
+    finally:
+        client.cookies.clear()
+
+
+def test_cors_allows_credentials_for_listed_origins_only(client):
+    preflight = {"Access-Control-Request-Method": "POST", "Access-Control-Request-Headers": "content-type"}
+    response = client.options("/auth/login/usernameless/start", headers={"Origin": "http://localhost", **preflight})
+    assert response.headers["access-control-allow-origin"] == "http://localhost"
+    assert response.headers["access-control-allow-credentials"] == "true"
+
+    response = client.options("/auth/login/usernameless/start", headers={"Origin": "http://evil.example", **preflight})
+    assert response.status_code == 400
+    assert "access-control-allow-origin" not in response.headers
@@ -0,0 +1,47 @@
+import uuid
+
+import pytest
+
+from session_store import MemorySessionStore
+from token_cache import TokenCache
+
+
+@pytest.fixture
+def tokens(main, user):
+    """Mint distinct access tokens for `user`"""
+    username, headers = user
+    uid = main.decode_access_token(headers["Authorization"].split()[1])["uid"]
+
+    def mint():
+        return {"Authorization": "Bearer " + main.create_access_token(
+            {"sub": username, "uid": uid, "name": username, "jti": uuid.uuid4().hex}
+        )}
+    return mint
+
+
+def test_revoked_token_stays_rejected_after_the_token_cache_is_flushed(main, client, tokens, monkeypatch):
+    headers = tokens()
+    assert client.get("/auth/me", headers=headers).status_code == 200
+    assert client.post("/auth/logout", headers=headers).status_code == 200
+    monkeypatch.setattr(main, "token_cache", TokenCache())
+    response = client.get("/auth/me", headers=headers)
+    assert response.status_code == 401
+    assert response.json()["detail"] == "Token revoked"
+
+
+def test_full_revocation_store_refuses_logout_instead_of_forgetting_revocations(main, client, tokens, monkeypatch):
+    monkeypatch.setattr(main, "revoked_tokens", MemorySessionStore(3600, max_entries=2))
+    revoked = [tokens() for _ in range(2)]
+    for headers in revoked:
+        assert client.post("/auth/logout", headers=headers).status_code == 200
+
+    still_valid = tokens()
+    response = client.post("/auth/logout", headers=still_valid)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+
+    monkeypatch.setattr(main, "token_cache", TokenCache())
+    for headers in revoked:
+        assert client.get("/auth/me", headers=headers).status_code == 401
+    # The logout failed, so the token was not revoked (and the client was told)
+    assert client.get("/auth/me", headers=still_valid).status_code == 200
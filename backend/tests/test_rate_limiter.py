@@ -0,0 +1,84 @@
+import asyncio
+import sqlite3
+import threading
+import time
+
+import pytest
+from starlette.requests import Request
+
+import rate_limiter
+from rate_limiter import Budget, MemoryRateLimiter, RateLimited, SQLiteRateLimiter, client_ip
+
+NGINX = "172.28.0.10"
+
+
+@pytest.fixture
+def behind_nginx(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_trusted_proxies", rate_limiter._networks(NGINX))
+
+
+def limiter() -> MemoryRateLimiter:
+    return MemoryRateLimiter({"mobile_register_finish": {"ip": Budget(capacity=2, per_seconds=60)}})
+
+
+def exhaust(limiter: MemoryRateLimiter, ip: str):
+    for _ in range(2):
+        limiter.check("mobile_register_finish", ip=ip)
+    with pytest.raises(RateLimited):
+        limiter.check("mobile_register_finish", ip=ip)
+
+
+def test_forwarded_client_behind_trusted_proxy_gets_its_own_bucket(behind_nginx):
+    limits = limiter()
+    exhaust(limits, client_ip(NGINX, "203.0.113.7"))
+    # Another browser through the same nginx is unaffected
+    limits.check("mobile_register_finish", ip=client_ip(NGINX, "198.51.100.23"))
+
+
+def test_forwarded_for_from_untrusted_peer_is_ignored(behind_nginx):
+    assert client_ip("203.0.113.7", "198.51.100.23") == "203.0.113.7"
+    limits = limiter()
+    exhaust(limits, client_ip("203.0.113.7", "198.51.100.1"))
+    with pytest.raises(RateLimited):
+        limits.check("mobile_register_finish", ip=client_ip("203.0.113.7", "198.51.100.2"))
+
+
+def test_first_untrusted_hop_is_the_client(behind_nginx):
+    # A client-supplied X-Forwarded-For value is prepended; nginx appends the real peer
+    assert client_ip(NGINX, "1.2.3.4, 203.0.113.7") == "203.0.113.7"
+
+
+def test_without_trusted_proxies_everyone_behind_the_proxy_shares_one_bucket(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_trusted_proxies", [])
+    assert client_ip(NGINX, "203.0.113.7") == NGINX
+
+
+def test_ipv6_clients_are_keyed_by_64(behind_nginx):
+    assert client_ip(NGINX, "2001:db8::1") == client_ip(NGINX, "2001:db8::2") == "2001:db8::/64"
+
+
+def test_shared_limiter_waits_for_the_file_lock_off_the_event_loop(main, tmp_path, monkeypatch):
+    path = str(tmp_path / "limits.db")
+    monkeypatch.setattr(main, "rate_limiter", SQLiteRateLimiter(path, {"login_start": {"ip": Budget(10, 60)}}))
+    # Another worker holds the write lock for a while
+    holder = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    holder.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.3, holder.rollback).start()
+    request = Request({"type": "http", "method": "POST", "path": "/", "headers": [], "client": ("203.0.113.7", 1234)})
+
+    async def scenario():
+        check = asyncio.create_task(main.check_rate_limit("login_start", request))
+        ticks = 0
+        while not check.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        await check
+        return ticks
+
+    started = time.monotonic()
+    ticks = asyncio.run(scenario())
+    assert time.monotonic() - started >= 0.3
+    # The loop kept running other work while the check waited
+    assert ticks >= 10
+    main.rate_limiter.close()
+    holder.close()
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+
+from session_store import MemorySessionStore, SQLiteSessionStore
+
+
+def test_async_api_round_trip(tmp_path):
+    async def scenario(store):
+        await store.aset("a", {"n": 1})
+        assert await store.aget("a") == {"n": 1}
+        assert await store.aadd("a", {"n": 2}) is False
+        assert await store.aadd("b", {"n": 2}) is True
+        assert await store.apop("b") == {"n": 2}
+        await store.adelete("a")
+        assert await store.aget("a") is None
+
+    for store in (MemorySessionStore(60), SQLiteSessionStore(str(tmp_path / "sessions.db"), "test", 60)):
+        try:
+            asyncio.run(scenario(store))
+        finally:
+            store.close()
+
+
+def test_sqlite_store_waits_for_the_file_lock_off_the_event_loop(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SQLiteSessionStore(path, "test", 60)
+    # Another worker holds the write lock for a while
+    holder = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    holder.execute("BEGIN IMMEDIATE")
+    threading.Timer(0.3, holder.rollback).start()
+
+    async def scenario():
+        write = asyncio.create_task(store.aset("a", True))
+        ticks = 0
+        while not write.done():
+            await asyncio.sleep(0.01)
+            ticks += 1
+        await write
+        return ticks
+
+    try:
+        # The loop kept running other work while the write waited
+        assert asyncio.run(scenario()) >= 10
+        assert store.get("a") is True
+    finally:
+        store.close()
+        holder.close()
+
+
+def test_sweeper_logs_failures_and_keeps_running(caplog):
+    class FailingStore(MemorySessionStore):
+        sweeps = 0
+
+        def purge_expired(self) -> int:
+            self.sweeps += 1
+            raise sqlite3.OperationalError("database is locked")
+
+    with caplog.at_level(logging.WARNING, logger="session_store"):
+        store = FailingStore(60, sweep_interval=0.01)
+        try:
+            deadline = time.monotonic() + 5
+            while store.sweeps < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+        finally:
+            store.close()
+    assert store.sweeps >= 2
+    failures = [r for r in caplog.records if getattr(r, "event", None) == "session_store.sweep_failed"]
+    assert failures and failures[0].exc_info is not None
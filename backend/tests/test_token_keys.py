@@ -0,0 +1,39 @@
+import os
+import time
+
+import jwt
+import pytest
+from jwt.exceptions import InvalidTokenError
+
+from token_keys import LEGACY_CUTOVER_FILE, TokenKeyring
+
+SECRET = "your-secret-key-change-in-production"
+
+
+def legacy_token() -> str:
+    return jwt.encode({"sub": "user", "exp": int(time.time()) + 600}, SECRET, algorithm="HS256")
+
+
+def test_keyring_tokens_round_trip(tmp_path):
+    keyring = TokenKeyring(str(tmp_path), token_ttl=3600)
+    assert keyring.decode(keyring.encode({"sub": "user"}))["sub"] == "user"
+
+
+def test_legacy_hs256_is_rejected_unless_enabled(tmp_path):
+    keyring = TokenKeyring(str(tmp_path), token_ttl=3600)
+    with pytest.raises(InvalidTokenError):
+        keyring.decode(legacy_token())
+
+
+def test_legacy_hs256_is_accepted_for_one_token_lifetime_after_the_cutover(tmp_path):
+    keyring = TokenKeyring(str(tmp_path), token_ttl=3600, legacy_secret=SECRET)
+    assert keyring.decode(legacy_token())["sub"] == "user"
+    assert keyring.stats()["legacy_hs256"] is True
+
+    # A restart (or another worker) keeps the recorded cutover instead of opening a new window
+    with open(os.path.join(tmp_path, LEGACY_CUTOVER_FILE), "w") as f:
+        f.write(str(int(time.time()) - 3600))
+    restarted = TokenKeyring(str(tmp_path), token_ttl=3600, legacy_secret=SECRET)
+    with pytest.raises(InvalidTokenError):
+        restarted.decode(legacy_token())
+    assert restarted.stats()["legacy_hs256"] is False
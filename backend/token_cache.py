@@ -0,0 +1,87 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+# When full, expired entries are swept at most this often before falling back to LRU eviction
+TOKEN_CACHE_SWEEP_SECONDS = 1.0
+
+
+def token_digest(token: str) -> str:
+    """Cache and revocation key for a bearer token (the token itself is never stored)"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class TokenCache:
+    """Claims of already verified access tokens, kept until the token's exp (LRU-bounded)"""
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._next_sweep = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        digest = token_digest(token)
+        with self._lock:
+            item = self._entries.get(digest)
+            if item is None or item[0] <= time.time():
+                if item is not None:
+                    del self._entries[digest]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return item[1]
+
+    def put(self, token: str, claims: dict):
+        """Remember verified claims until exp; tokens without exp are not cached"""
+        expires_at = claims.get("exp")
+        if not isinstance(expires_at, (int, float)):
+            return
+        digest = token_digest(token)
+        with self._lock:
+            if len(self._entries) >= self.max_entries and digest not in self._entries:
+                self._evict_locked()
+            self._entries[digest] = (expires_at, claims)
+            self._entries.move_to_end(digest)
+
+    def invalidate(self, token: str):
+        self.invalidate_digest(token_digest(token))
+
+    def invalidate_digest(self, digest: str):
+        """Drop a token (e.g. revoked) so its next use is verified from scratch"""
+        with self._lock:
+            if self._entries.pop(digest, None) is not None:
+                self.invalidations += 1
+
+    def _evict_locked(self):
+        now = time.time()
+        if now >= self._next_sweep:
+            self._next_sweep = now + TOKEN_CACHE_SWEEP_SECONDS
+            for digest in [d for d, item in self._entries.items() if item[0] <= now]:
+                del self._entries[digest]
+        while len(self._entries) >= self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -0,0 +1,293 @@
+import fcntl
+import logging
+import os
+import secrets
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm
+from jwt.exceptions import InvalidTokenError
+
+from app_logging import log_event
+
+logger = logging.getLogger(__name__)
+
+# "ES256" or "EdDSA" sign access tokens with the rotating keyring; "HS256" keeps the shared SECRET_KEY
+JWT_ALGORITHM = os.getenv("JWT_ALGORITHM", "ES256")
+# Private signing keys, shared by every worker that can reach the directory (e.g. /app/data/jwt-keys)
+JWT_KEYS_DIR = os.getenv("JWT_KEYS_DIR", "./jwt-keys")
+JWT_KEY_ROTATION_HOURS = float(os.getenv("JWT_KEY_ROTATION_HOURS", "24"))
+# Clients may cache the JWKS this long, so a new key is published this long before it signs anything
+JWKS_MAX_AGE_SECONDS = int(os.getenv("JWKS_MAX_AGE_SECONDS", "300"))
+# How often the key directory is re-read to pick up keys rotated by other workers
+JWT_KEYS_RELOAD_SECONDS = float(os.getenv("JWT_KEYS_RELOAD_SECONDS", "30"))
+# Keep accepting HS256 tokens signed with SECRET_KEY (issued before the switch to the keyring), for one
+# token lifetime after the first start with this enabled; anyone who knows SECRET_KEY can mint them
+JWT_ACCEPT_LEGACY_HS256 = os.getenv("JWT_ACCEPT_LEGACY_HS256", "false").lower() == "true"
+
+SUPPORTED_ALGORITHMS = ("ES256", "EdDSA")
+# Extra time a retired key stays published after the last token it signed has expired
+RETIRE_GRACE_SECONDS = 60
+# Tokens with an unknown kid trigger at most one directory re-read per this many seconds
+UNKNOWN_KID_RELOAD_SECONDS = 1.0
+# When legacy HS256 acceptance started, shared by the workers and kept across restarts so the window closes
+LEGACY_CUTOVER_FILE = "legacy-hs256-cutover"
+
+
+@dataclass(frozen=True)
+class SigningKey:
+    kid: str
+    algorithm: str
+    created: float
+    private_key: Any
+    public_key: Any
+
+    def jwk(self) -> dict:
+        if self.algorithm == "ES256":
+            jwk = ECAlgorithm.to_jwk(self.public_key, as_dict=True)
+        else:
+            jwk = OKPAlgorithm.to_jwk(self.public_key, as_dict=True)
+        jwk.update({"kid": self.kid, "alg": self.algorithm, "use": "sig"})
+        return jwk
+
+
+def _generate_private_key(algorithm: str):
+    if algorithm == "ES256":
+        return ec.generate_private_key(ec.SECP256R1())
+    return ed25519.Ed25519PrivateKey.generate()
+
+
+def _key_algorithm(private_key) -> Optional[str]:
+    if isinstance(private_key, ec.EllipticCurvePrivateKey) and isinstance(private_key.curve, ec.SECP256R1):
+        return "ES256"
+    if isinstance(private_key, ed25519.Ed25519PrivateKey):
+        return "EdDSA"
+    return None
+
+
+class TokenKeyring:
+    """Rotating set of asymmetric JWT signing keys stored as PEM files, one per kid
+
+    Every key file name starts with its creation time. A new key is created once the newest
+    one is older than the rotation interval, but only signs after it has been published for
+    publish_ahead seconds (so cached JWKS copies already contain it). A retired key stays
+    published until every token it signed has expired.
+
+    With legacy_secret set, HS256 tokens without a kid are also accepted, but only until one
+    token_ttl after the cutover recorded in the key directory (the first start with it set).
+    """
+
+    def __init__(
+        self,
+        directory: str = JWT_KEYS_DIR,
+        algorithm: str = JWT_ALGORITHM,
+        rotation_seconds: float = JWT_KEY_ROTATION_HOURS * 3600,
+        publish_ahead: float = JWKS_MAX_AGE_SECONDS,
+        token_ttl: float = 3600,
+        reload_seconds: float = JWT_KEYS_RELOAD_SECONDS,
+        legacy_secret: Optional[str] = None,
+    ):
+        if algorithm not in SUPPORTED_ALGORITHMS:
+            raise ValueError(f"Unsupported JWT_ALGORITHM for the keyring: {algorithm}")
+        self.directory = directory
+        self.algorithm = algorithm
+        self.rotation_seconds = rotation_seconds
+        self.publish_ahead = publish_ahead
+        self.token_ttl = token_ttl
+        self.reload_seconds = reload_seconds
+        self.legacy_secret = legacy_secret
+        self.legacy_until: Optional[float] = None
+        self._keys: Dict[str, SigningKey] = {}
+        self._lock = threading.Lock()
+        self._next_reload = 0.0
+        self._last_unknown_reload = 0.0
+        self._jwks: Optional[dict] = None
+        self.rotations = 0
+        self.unknown_kids = 0
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self._refresh(force=True)
+        if legacy_secret is not None:
+            self.legacy_until = self._legacy_cutover() + token_ttl
+            if time.time() < self.legacy_until:
+                log_event(
+                    logger, "jwt_keys.legacy_hs256_enabled", logging.WARNING,
+                    until=time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.legacy_until)),
+                )
+
+    # Signing and verification
+
+    def encode(self, payload: dict) -> str:
+        key = self.signing_key()
+        return jwt.encode(payload, key.private_key, algorithm=key.algorithm, headers={"kid": key.kid})
+
+    def decode(self, token: str) -> dict:
+        """Verify a token against the key named by its kid (or SECRET_KEY for legacy HS256 tokens)"""
+        kid = jwt.get_unverified_header(token).get("kid")
+        if kid is None:
+            if self.legacy_secret is None or time.time() >= self.legacy_until:
+                raise InvalidTokenError("Token has no key ID")
+            return jwt.decode(token, self.legacy_secret, algorithms=["HS256"])
+
+        key = self.verification_key(kid)
+        if key is None:
+            raise InvalidTokenError("Unknown signing key")
+        # The algorithm comes from our key, never from the token header
+        return jwt.decode(token, key.public_key, algorithms=[key.algorithm])
+
+    def signing_key(self) -> SigningKey:
+        self._refresh()
+        with self._lock:
+            candidates = sorted(
+                (k for k in self._keys.values() if k.algorithm == self.algorithm),
+                key=lambda k: k.created,
+            )
+        published = [k for k in candidates if k.created <= time.time() - self.publish_ahead]
+        # With no key published long enough (first start), nobody can hold an older JWKS copy
+        return (published or candidates)[-1]
+
+    def verification_key(self, kid: str) -> Optional[SigningKey]:
+        key = self._keys.get(kid)
+        if key is None:
+            self.unknown_kids += 1
+            # Possibly just created by another worker; rate-limited so forged kids cannot force rescans
+            if time.time() - self._last_unknown_reload >= UNKNOWN_KID_RELOAD_SECONDS:
+                self._last_unknown_reload = time.time()
+                self._refresh(force=True)
+                key = self._keys.get(kid)
+        return key
+
+    # JWKS
+
+    def jwks(self) -> dict:
+        self._refresh()
+        with self._lock:
+            if self._jwks is None:
+                keys = sorted(self._keys.values(), key=lambda k: k.created, reverse=True)
+                self._jwks = {"keys": [k.jwk() for k in keys]}
+            return self._jwks
+
+    # Key files
+
+    def _legacy_cutover(self) -> float:
+        path = os.path.join(self.directory, LEGACY_CUTOVER_FILE)
+        cutover = int(time.time())
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(cutover))
+        try:
+            # Linking publishes the file with its content in one step and fails if another worker won
+            os.link(tmp_path, path)
+        except FileExistsError:
+            with open(path) as f:
+                cutover = int(f.read())
+        finally:
+            os.remove(tmp_path)
+        return float(cutover)
+
+    def _refresh(self, force: bool = False):
+        now = time.time()
+        if not force and now < self._next_reload:
+            return
+        with self._lock:
+            if not force and now < self._next_reload:
+                return
+            self._next_reload = now + self.reload_seconds
+            self._load_locked()
+            if self._rotation_due(now):
+                self._rotate_locked()
+            self._retire_locked(now)
+
+    def _rotation_due(self, now: float) -> bool:
+        own = [k.created for k in self._keys.values() if k.algorithm == self.algorithm]
+        return not own or max(own) <= now - self.rotation_seconds
+
+    def _rotate_locked(self):
+        # The file lock makes workers sharing the directory agree on one new key
+        with open(os.path.join(self.directory, ".lock"), "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                self._load_locked()
+                if not self._rotation_due(time.time()):
+                    return
+                created = float(int(time.time()))  # Whole seconds, as recorded in the file name
+                kid = f"{int(created)}-{secrets.token_hex(4)}"
+                private_key = _generate_private_key(self.algorithm)
+                pem = private_key.private_bytes(
+                    serialization.Encoding.PEM,
+                    serialization.PrivateFormat.PKCS8,
+                    serialization.NoEncryption(),
+                )
+                path = os.path.join(self.directory, f"{kid}.pem")
+                tmp_path = f"{path}.tmp"
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, "wb") as f:
+                    f.write(pem)
+                os.replace(tmp_path, path)
+                self._add_locked(kid, created, private_key)
+                self.rotations += 1
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load_locked(self):
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            names = []
+        on_disk = set()
+        for name in names:
+            if not name.endswith(".pem"):
+                continue
+            kid = name[:-4]
+            on_disk.add(kid)
+            if kid in self._keys:
+                continue
+            try:
+                created = float(kid.split("-", 1)[0])
+                with open(os.path.join(self.directory, name), "rb") as f:
+                    private_key = serialization.load_pem_private_key(f.read(), password=None)
+            except (OSError, ValueError) as e:
+                log_event(logger, "jwt_keys.unreadable_key", logging.WARNING, file=name, error=str(e))
+                continue
+            self._add_locked(kid, created, private_key)
+        # Keys retired (deleted) by another worker
+        for kid in list(self._keys):
+            if kid not in on_disk:
+                del self._keys[kid]
+                self._jwks = None
+
+    def _add_locked(self, kid: str, created: float, private_key):
+        algorithm = _key_algorithm(private_key)
+        if algorithm is None:
+            log_event(logger, "jwt_keys.unsupported_key", logging.WARNING, kid=kid)
+            return
+        self._keys[kid] = SigningKey(kid, algorithm, created, private_key, private_key.public_key())
+        self._jwks = None
+
+    def _retire_locked(self, now: float):
+        """Drop keys whose successor has signed for longer than a token lives"""
+        ordered = sorted(self._keys.values(), key=lambda k: k.created)
+        for key, successor in zip(ordered, ordered[1:]):
+            stopped_signing = successor.created + self.publish_ahead
+            if stopped_signing + self.token_ttl + RETIRE_GRACE_SECONDS < now:
+                try:
+                    os.remove(os.path.join(self.directory, f"{key.kid}.pem"))
+                except FileNotFoundError:
+                    pass
+                del self._keys[key.kid]
+                self._jwks = None
+
+    def stats(self) -> dict:
+        active = self.signing_key()
+        return {
+            "algorithm": self.algorithm,
+            "active_kid": active.kid,
+            "published_keys": len(self._keys),
+            "rotations": self.rotations,
+            "unknown_kids": self.unknown_kids,
+            "legacy_hs256": self.legacy_until is not None and time.time() < self.legacy_until,
+        }
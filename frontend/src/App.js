@@ -1,8 +1,8 @@
 import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 import {
-  registerStart, registerFinish, loginStart, loginFinish, passwordLogin, getPasskeys, deletePasskey,
-  registerQrStart, getQrStatus, loginUsernamelessStart, loginUsernamelessFinish,
+  registerStart, registerFinish, loginStart, loginFinish, passwordLogin, logout, getPasskeys, deletePasskey,
+  registerQrStart, qrImageUrl, getQrStatus, subscribeQrEvents, loginUsernamelessStart, loginUsernamelessFinish,
   // Cognito imports
   cognitoPasswordLogin, cognitoRegisterStart, cognitoRegisterFinish, cognitoLoginStart, cognitoLoginFinish, cognitoSignUp, cognitoConfirmSignUp
 } from './webauthnService';
@@ -71,6 +71,7 @@ function App() {
   const [qrStatus, setQrStatus] = useState('waiting');
   const [showRegistrationPrompt, setShowRegistrationPrompt] = useState(false);
   const wsRef = useRef(null);
+  const qrStatusRef = useRef(null);
 
   const API_BASE = process.env.REACT_APP_API_URL || 'http://localhost:8000';
 
@@ -87,6 +88,9 @@ function App() {
       if (wsRef.current) {
         wsRef.current.close();
       }
+      if (qrStatusRef.current) {
+        qrStatusRef.current();
+      }
     };
   }, []);
 
@@ -167,7 +171,7 @@ function App() {
 
     try {
       if (authMode === 'local') {
-        const { challenge, options } = await registerStart(username, displayName, token);
+        const { challenge_token, options } = await registerStart(username, displayName, token);
         const credential = await navigator.credentials.create({
           publicKey: {
             challenge: base64urlToBytes(options.challenge),
@@ -184,7 +188,7 @@ function App() {
           },
         });
 
-        await registerFinish(username, displayName, credentialToObject(credential), challenge, token);
+        await registerFinish(username, displayName, credentialToObject(credential), challenge_token, token);
         setMessage('Passkey registered successfully!');
         setHasPasskey(true);
         setShowRegistrationPrompt(false);
@@ -225,11 +229,28 @@ function App() {
     setMessage('');
     setQrStatus('waiting');
 
+    // Stop watching any previous QR session
+    if (wsRef.current) wsRef.current.close();
+    if (qrStatusRef.current) qrStatusRef.current();
+
     try {
       const result = await registerQrStart(username, displayName, token);
-      setQrCode(result.qr_code);
+      setQrCode(qrImageUrl(result.qr_image_url));
       setQrSessionId(result.session_id);
 
+      let completed = false;
+      const markQrCompleted = () => {
+        if (completed) return;
+        completed = true;
+        setQrStatus('completed');
+        setMessage('Passkey registered successfully via QR code!');
+        setHasPasskey(true);
+        setShowRegistrationPrompt(false); // Hide the prompt after successful registration
+        fetchPasskeys();
+        if (wsRef.current) wsRef.current.close();
+        if (qrStatusRef.current) qrStatusRef.current();
+      };
+
       // Connect to WebSocket for real-time updates
       const wsUrl = API_BASE.replace(/^http/, 'ws');
       const ws = new WebSocket(`${wsUrl}/ws/register/${result.session_id}`);
@@ -241,12 +262,7 @@ function App() {
       ws.onmessage = (event) => {
         const data = JSON.parse(event.data);
         if (data.status === 'completed' || data.success) {
-          setQrStatus('completed');
-          setMessage('Passkey registered successfully via QR code!');
-          setHasPasskey(true);
-          setShowRegistrationPrompt(false); // Hide the prompt after successful registration
-          fetchPasskeys();
-          ws.close();
+          markQrCompleted();
         }
       };
 
@@ -260,25 +276,27 @@ function App() {
 
       wsRef.current = ws;
 
-      // Poll for status as fallback
-      const pollInterval = setInterval(async () => {
-        try {
-          const status = await getQrStatus(result.session_id);
-          if (status.completed) {
-            clearInterval(pollInterval);
-            setQrStatus('completed');
-            setMessage('Passkey registered successfully via QR code!');
-            setHasPasskey(true);
-            setShowRegistrationPrompt(false); // Hide the prompt after successful registration
-            fetchPasskeys();
+      // Fallback for networks that block WebSockets: one SSE stream (or a long-poll loop)
+      // that answers as soon as the registration completes, instead of polling every few seconds
+      if (typeof EventSource !== 'undefined') {
+        qrStatusRef.current = subscribeQrEvents(result.session_id, { onCompleted: markQrCompleted });
+      } else {
+        let active = true;
+        qrStatusRef.current = () => { active = false; };
+        (async () => {
+          while (active && !completed) {
+            try {
+              const status = await getQrStatus(result.session_id, token, 25);
+              if (status.completed) {
+                markQrCompleted();
+              }
+            } catch (error) {
+              console.error('QR status error:', error);
+              break;
+            }
           }
-        } catch (error) {
-          console.error('Polling error:', error);
-        }
-      }, 2000);
-
-      // Stop polling after 5 minutes
-      setTimeout(() => clearInterval(pollInterval), 300000);
+        })();
+      }
 
     } catch (error) {
       setMessage(error.message || 'QR registration failed');
@@ -294,7 +312,7 @@ function App() {
 
     try {
       if (authMode === 'local') {
-        const { challenge, options } = await loginStart(username);
+        const { challenge_token, options } = await loginStart(username);
 
         const credential = await navigator.credentials.get({
           publicKey: {
@@ -309,7 +327,7 @@ function App() {
           },
         });
 
-        const result = await loginFinish(username, assertionToObject(credential), challenge);
+        const result = await loginFinish(username, assertionToObject(credential), challenge_token);
         setToken(result.access_token);
         localStorage.setItem('token', result.access_token);
         setMessage('Authentication successful!');
@@ -374,7 +392,7 @@ function App() {
     setMessage('');
 
     try {
-      const { challenge, options } = await loginUsernamelessStart();
+      const { challenge_token, options } = await loginUsernamelessStart();
 
       const credential = await navigator.credentials.get({
         publicKey: {
@@ -389,7 +407,7 @@ function App() {
         },
       });
 
-      const result = await loginUsernamelessFinish(assertionToObject(credential), challenge);
+      const result = await loginUsernamelessFinish(assertionToObject(credential), challenge_token);
       setToken(result.access_token);
       localStorage.setItem('token', result.access_token);
       setMessage(`Authentication successful! Welcome, ${result.username}!`);
@@ -443,6 +461,7 @@ function App() {
 
   const handleLogout = () => {
     if (authMode === 'local') {
+      if (token) logout(token);
       localStorage.removeItem('token');
       setToken(null);
     } else {
@@ -466,6 +485,10 @@ function App() {
       wsRef.current.close();
       wsRef.current = null;
     }
+    if (qrStatusRef.current) {
+      qrStatusRef.current();
+      qrStatusRef.current = null;
+    }
   };
 
   function base64urlToBytes(base64url) {
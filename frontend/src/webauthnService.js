@@ -21,7 +21,7 @@ async function registerStart(username, displayName, token) {
   return response.json();
 }
 
-async function registerFinish(username, displayName, credential, challenge, token) {
+async function registerFinish(username, displayName, credential, challengeToken, token) {
   const response = await fetch(`${API_BASE}/auth/register/finish`, {
     method: 'POST',
     headers: {
@@ -32,7 +32,7 @@ async function registerFinish(username, displayName, credential, challenge, toke
       username,
       display_name: displayName,
       credential,
-      challenge,
+      challenge_token: challengeToken,
     }),
   });
 
@@ -63,16 +63,18 @@ async function loginStart(username) {
   return response.json();
 }
 
-async function loginFinish(username, assertion, challenge) {
+async function loginFinish(username, assertion, challengeToken) {
   const response = await fetch(`${API_BASE}/auth/login/finish`, {
     method: 'POST',
+    // Sends and stores the passkey_hint cookie across origins (frontend and API ports differ)
+    credentials: 'include',
     headers: {
       'Content-Type': 'application/json',
     },
     body: JSON.stringify({
       username,
       assertion,
-      challenge,
+      challenge_token: challengeToken,
     }),
   });
 
@@ -104,6 +106,20 @@ async function passwordLogin(username, password) {
   return response.json();
 }
 
+async function logout(token) {
+  // Revokes the token server-side; the client forgets it either way
+  try {
+    await fetch(`${API_BASE}/auth/logout`, {
+      method: 'POST',
+      headers: {
+        'Authorization': `Bearer ${token}`,
+      },
+    });
+  } catch (error) {
+    console.warn('Logout request failed:', error);
+  }
+}
+
 async function getPasskeys(token) {
   const response = await fetch(`${API_BASE}/auth/passkeys`, {
     method: 'GET',
@@ -157,8 +173,14 @@ async function registerQrStart(username, displayName, token) {
   return response.json();
 }
 
-async function getQrStatus(sessionId, token) {
-  const response = await fetch(`${API_BASE}/auth/register/qr/${sessionId}`, {
+function qrImageUrl(qrImagePath) {
+  return `${API_BASE}${qrImagePath}`;
+}
+
+async function getQrStatus(sessionId, token, wait = 0) {
+  // wait > 0 makes the server hold the request until the registration completes (long-poll)
+  const query = wait > 0 ? `?wait=${wait}` : '';
+  const response = await fetch(`${API_BASE}/auth/register/qr/${sessionId}${query}`, {
     method: 'GET',
     headers: {
       'Authorization': `Bearer ${token}`,
@@ -173,10 +195,25 @@ async function getQrStatus(sessionId, token) {
   return response.json();
 }
 
+function subscribeQrEvents(sessionId, { onCompleted, onExpired }) {
+  // One Server-Sent Events connection per session instead of repeated status polling
+  const source = new EventSource(`${API_BASE}/auth/register/qr/${sessionId}/events`);
+  source.addEventListener('completed', () => {
+    source.close();
+    onCompleted();
+  });
+  source.addEventListener('expired', () => {
+    source.close();
+    if (onExpired) onExpired();
+  });
+  return () => source.close();
+}
+
 // Usernameless login functions
 async function loginUsernamelessStart() {
   const response = await fetch(`${API_BASE}/auth/login/usernameless/start`, {
     method: 'POST',
+    credentials: 'include',
     headers: {
       'Content-Type': 'application/json',
     },
@@ -190,15 +227,16 @@ async function loginUsernamelessStart() {
   return response.json();
 }
 
-async function loginUsernamelessFinish(assertion, challenge) {
+async function loginUsernamelessFinish(assertion, challengeToken) {
   const response = await fetch(`${API_BASE}/auth/login/usernameless/finish`, {
     method: 'POST',
+    credentials: 'include',
     headers: {
       'Content-Type': 'application/json',
     },
     body: JSON.stringify({
       assertion,
-      challenge,
+      challenge_token: challengeToken,
     }),
   });
 
@@ -355,10 +393,13 @@ export {
   loginStart,
   loginFinish,
   passwordLogin,
+  logout,
   getPasskeys,
   deletePasskey,
   registerQrStart,
+  qrImageUrl,
   getQrStatus,
+  subscribeQrEvents,
   loginUsernamelessStart,
   loginUsernamelessFinish,
   // Cognito exports